@@ -0,0 +1,371 @@
+"""Regression test for TraceAndSelect: replays clicks on the phantoms and checks the fills.
+
+The traces and the labels a click leaves were recorded from the original
+per-pixel implementation, and tracing and filling are compared with the
+copy of its build_path() and breadth-first fill kept in
+TraceAndSelectLib.reference, so the faster code is held to giving the
+same results. CTest runs it in Slicer, where TraceAndSelectLib is on the
+path; it needs only NumPy, and can also be run on its own with
+
+    python TraceAndSelectRegressionTest.py [path to qt-scripted-modules]
+"""
+
+import itertools
+import os
+import sys
+import unittest
+import zlib
+
+import numpy
+
+if len(sys.argv) > 1 and os.path.isdir(sys.argv[-1]):
+    sys.path.insert(0, sys.argv.pop())
+else:
+    try:
+        import TraceAndSelectLib
+    except ImportError:
+        sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                        '..', '..', 'lib', 'Slicer-4.7', 'qt-scripted-modules'))
+
+from TraceAndSelectLib import (phantoms, reference, gimme_a_path, find_edges, build_path, find_best_path,
+                               fill_region, fill_volume, SliceMasks, SlicePropagator, propagate, Contour, trace_pool,
+                               SliceEdit, EditGroup, LabelEditHistory, debug, is_debug, set_debug)
+from TraceAndSelectLib.benchmark import quiet
+
+MAX_PIXELS = 25000
+
+# (phantom, size, click, path length, visited length, dead ends, CRC-32 of
+# the path points, pixels labelled, CRC-32 of the int16 labels) for a click
+# on a blank label slice, as the per-pixel implementation traced and filled it
+SLICE_CLICKS = [
+    ('ellipse_slice', 128, (64, 64), 132, 132, 0, 634306351, 1587, 2866467837),
+    ('ellipse_slice', 128, (72, 56), 132, 132, 0, 1743492934, 1587, 2866467837),
+    ('ellipse_slice', 128, (52, 74), 132, 132, 0, 457754762, 1587, 2866467837),
+    ('ellipse_slice', 256, (128, 128), 264, 264, 0, 326801470, 6341, 2214822279),
+    ('ellipse_slice', 256, (144, 112), 264, 264, 0, 2397053684, 6341, 2214822279),
+    ('ellipse_slice', 256, (103, 149), 264, 264, 0, 1854384124, 6341, 2214822279),
+    ('cortical_rings_slice', 128, (64, 78), 156, 156, 0, 693830568, 2463, 1509352329),
+    ('cortical_rings_slice', 128, (72, 70), 64, 64, 0, 4207029616, 413, 139705056),
+    ('cortical_rings_slice', 256, (128, 157), 316, 316, 0, 2999861546, 9885, 1939755082),
+    ('cortical_rings_slice', 256, (144, 141), 128, 128, 0, 36173744, 1647, 1477984403),
+    ('noisy_tissue_slice', 128, (64, 89), 332, 345, 3, 1902283715, 9933, 4142109699),
+    ('noisy_tissue_slice', 128, (72, 81), 324, 341, 7, 1257764416, 9923, 3028516376),
+    ('noisy_tissue_slice', 128, (52, 99), 332, 345, 3, 4174856252, 9933, 4142109699),
+    ('noisy_tissue_slice', 256, (128, 179), 648, 673, 13, 210180039, 25674, 4221133386),
+    ('noisy_tissue_slice', 256, (144, 163), 642, 652, 0, 2406273272, 25653, 499063954),
+    ('nerve_slice', 128, (64, 64), 20, 56, 0, 3638351987, 79, 2877078149),
+    ('nerve_slice', 256, (128, 128), 32, 84, 0, 1571860206, 155, 117493604),
+]
+
+# (phantom, size, slices, pixels labelled, CRC-32 of the int16 labels) after
+# propagating the click through every slice after it
+VOLUME_CLICKS = [
+    ('bone_volume', 128, 12, 24121, 1883407739),
+]
+
+# (phantom, size, slices, voxels labelled, CRC-32 of the int16 labels) after
+# filling the click in 3D through every slice after it
+VOLUME_FILLS = [
+    ('bone_volume', 128, 12, 24121, 1883407739),
+    ('nerve_volume', 128, 12, 485, 936926006),
+]
+
+# (phantom, size, slices, (start, stop) slices filled or None for all,
+# slices propagation fills, least Dice coefficient of the 3D fill against
+# propagation on those slices). 2D phantoms are stacked into slices copies
+# of themselves. Propagation loses the nerve after its first slice, and on
+# both nerves the 3D fill leaves out part of what the traced outline takes in.
+VOLUME_AGREEMENT = [
+    ('bone_volume', 128, 12, None, 12, 1.0),
+    ('bone_volume', 64, 12, None, 12, 0.95),
+    ('bone_volume', 64, 12, (0, 6), 6, 0.96),
+    ('bone_volume', 64, 12, (3, 12), 9, 0.93),
+    ('nerve_volume', 128, 12, None, 1, 0.70),
+    ('ellipse_slice', 128, 6, None, 6, 1.0),
+    ('cortical_rings_slice', 128, 6, None, 6, 1.0),
+    ('noisy_tissue_slice', 128, 6, None, 6, 0.999),
+    ('nerve_slice', 128, 6, None, 6, 0.70),
+]
+
+# (size, slices, offset, pixels labelled, CRC-32 of the int16 labels, CRC-32
+# of the (count, row sum, col sum) centroid of each slice as int64) of a bone
+# phantom click propagated offset slices, as the per-pixel implementation
+# labelled it and seeded each next slice
+BASELINE_PROPAGATION = [
+    (64, 64, 11, 7151, 123778126, 3621217697),
+    (96, 30, 29, 33899, 790538780, 2608357881),
+]
+
+
+def crc(array):
+    return zlib.crc32(numpy.ascontiguousarray(array).tobytes()) & 0xffffffff
+
+def slice_phantom(name, size):
+    return getattr(phantoms, name)(size)
+
+def volume_phantom(name, size, slices):
+    """The named 3D phantom, or the named 2D one stacked into slices copies of itself."""
+    phantom = getattr(phantoms, name)
+    if phantom in phantoms.VOLUMES:
+        return phantom(size, slices)
+    phantom = phantom(size)
+    return phantom._replace(image=numpy.stack([phantom.image] * slices), click=(0,) + tuple(phantom.click))
+
+def dice(first, second):
+    """The Dice coefficient of two boolean masks."""
+    return 2.0 * (first & second).sum() / (first.sum() + second.sum())
+
+def rectangle(bottom, right):
+    """The outline of the rectangle from (0, 0) to (bottom, right), as a traced path."""
+    points = [(row, col) for row in range(bottom + 1) for col in range(right + 1)
+              if row in (0, bottom) or col in (0, right)]
+    return (points, points, 0)
+
+
+class Capture(object):
+    """Stands in for sys.stdout, keeping what is written."""
+
+    def __init__(self):
+        self.parts = []
+
+    def write(self, text):
+        self.parts.append(text)
+
+
+class TraceAndSelectRegressionTest(unittest.TestCase):
+
+    def test_traces(self):
+        """gimme_a_path() traces the outlines the per-pixel implementation did."""
+        for name, size, click, pathLength, visitedLength, deadEnds, pathCrc, labelled, labelCrc in SLICE_CLICKS:
+            phantom = slice_phantom(name, size)
+            with quiet():
+                path, visited, dead_ends = gimme_a_path(click, 200, phantom.hi, phantom.lo, phantom.image)
+            self.assertEqual((len(path), len(visited), dead_ends, crc(Contour(path).points)),
+                             (pathLength, visitedLength, deadEnds, pathCrc), (name, size, click))
+
+    def test_build_path(self):
+        """build_path() traces from every seed what the per-pixel build_path() did."""
+        for name, size, click in sorted(set(entry[:3] for entry in SLICE_CLICKS)):
+            phantom = slice_phantom(name, size)
+            masks = SliceMasks(phantom.image, phantom.hi, phantom.lo)
+            for seed in find_edges(click, 200, masks):
+                with quiet():
+                    traced = build_path(seed, masks)
+                original = reference.build_path(seed, phantom.hi, phantom.lo, phantom.image)
+                self.assertEqual((Contour(traced[0]), Contour(traced[1]), traced[2]),
+                                 (Contour(original[0]), Contour(original[1]), original[2]), (name, size, seed))
+
+    def test_long_contour(self):
+        """build_path() traces a contour of several thousand pixels as the per-pixel build_path() did."""
+        phantom = phantoms.wavy_bone_slice(1100)
+        masks = SliceMasks(phantom.image, phantom.hi, phantom.lo)
+        seed = find_edges(phantom.click, 200, masks)[0]
+        with quiet():
+            traced = build_path(seed, masks)
+        original = reference.build_path(seed, phantom.hi, phantom.lo, phantom.image)
+        self.assertGreater(len(traced[0]), 5000)
+        self.assertEqual((Contour(traced[0]), Contour(traced[1]), traced[2]),
+                         (Contour(original[0]), Contour(original[1]), original[2]))
+
+    def test_click_labels(self):
+        """A click on one slice labels the pixels the per-pixel implementation did."""
+        for name, size, click, pathLength, visitedLength, deadEnds, pathCrc, labelled, labelCrc in SLICE_CLICKS:
+            phantom = slice_phantom(name, size)
+            labelArray = numpy.zeros((1,) + phantom.image.shape, dtype=numpy.int16)
+            propagator = SlicePropagator(phantom.image[numpy.newaxis], labelArray, 0, [0], phantom.hi, phantom.lo)
+            with quiet():
+                result = propagator.fillSlice(0, click, [], 1, MAX_PIXELS)
+            propagator.close()
+            self.assertIsNone(result.error, (name, size, click))
+            self.assertEqual((int((labelArray > 0).sum()), crc(labelArray[0])), (labelled, labelCrc),
+                             (name, size, click))
+
+    def test_find_best_path(self):
+        """find_best_path() does not stop at a long thin box before a squarer one that encloses more."""
+        # Boxes of 40, 38 and 36 pixels whose insides hold 19, 18 and 25
+        paths = [rectangle(20, 2), rectangle(19, 2), rectangle(6, 6)]
+        for order in itertools.permutations(paths):
+            self.assertEqual(find_best_path(list(order), (3, 1)), paths[2])
+
+    def test_fill_region(self):
+        """fill_region() matches the per-pixel fill, over labels, caps and seeds on and off the outline."""
+        random = numpy.random.RandomState(0)
+        for name, size, click in sorted(set(entry[:3] for entry in SLICE_CLICKS)):
+            phantom = slice_phantom(name, size)
+            with quiet():
+                path = list(gimme_a_path(click, 200, phantom.hi, phantom.lo, phantom.image)[0])
+            labels = numpy.zeros(phantom.image.shape, dtype=numpy.int16)
+            labels[random.random_sample(labels.shape) < 0.05] = 1
+            labels[random.random_sample(labels.shape) < 0.02] = 2
+            # A click paints the outline before filling it
+            painted = labels.copy()
+            painted[tuple(numpy.transpose(path))] = 1
+            for start, seed, maxPixels in itertools.product((labels, painted), (click, path[0], (-1, click[1])),
+                                                            (MAX_PIXELS, 500, 0)):
+                expected = start.copy()
+                actual = start.copy()
+                with quiet():
+                    wanted = reference.fill(expected, tuple(seed), path, 1, maxPixels)
+                    got = fill_region(actual, tuple(seed), path, 1, maxPixels)
+                case = (name, size, click, seed, maxPixels)
+                if wanted is None:
+                    self.assertIsNone(got, case)
+                    self.assertTrue(numpy.array_equal(actual, start), case)
+                else:
+                    self.assertEqual(tuple(got), wanted, case)
+                    self.assertTrue(numpy.array_equal(actual, expected), case)
+
+    def test_baseline_propagation(self):
+        """Propagation labels the slices, and seeds each next one from the centroid, as the per-pixel implementation did."""
+        for size, slices, offset, labelled, labelCrc, centroidCrc in BASELINE_PROPAGATION:
+            phantom = phantoms.bone_volume(size, slices)
+            labelArray = numpy.zeros(phantom.image.shape, dtype=numpy.int16)
+            propagator = SlicePropagator(phantom.image, labelArray, 0, range(offset + 1), phantom.hi, phantom.lo)
+            try:
+                with quiet():
+                    results = list(propagate(propagator, phantom.click[1:], [], 1, MAX_PIXELS))
+            finally:
+                propagator.close()
+            centroids = numpy.array([(result.count,) + tuple(result.mean) for result in results], dtype=numpy.int64)
+            self.assertEqual([result.error for result in results], [None] * (offset + 1), size)
+            self.assertEqual((int((labelArray > 0).sum()), crc(labelArray), crc(centroids)),
+                             (labelled, labelCrc, centroidCrc), size)
+
+    def test_propagation(self):
+        """Propagating a click labels the recorded pixels, whether or not slices are tracked."""
+        for name, size, slices, labelled, labelCrc in VOLUME_CLICKS:
+            phantom = getattr(phantoms, name)(size, slices)
+            image, click = phantom.image, phantom.click
+            for tracking in (False, True):
+                labelArray = numpy.zeros(image.shape, dtype=numpy.int16)
+                propagator = SlicePropagator(image, labelArray, 0, range(click[0], image.shape[0]),
+                                             phantom.hi, phantom.lo, tracking=tracking)
+                try:
+                    with quiet():
+                        results = list(propagate(propagator, click[1:], [], 1, MAX_PIXELS))
+                finally:
+                    propagator.close()
+                self.assertEqual([result.error for result in results], [None] * len(results), (name, tracking))
+                self.assertEqual((int((labelArray > 0).sum()), crc(labelArray)), (labelled, labelCrc),
+                                 (name, tracking))
+
+    def test_fill_volume(self):
+        """Filling a click in 3D labels the recorded voxels."""
+        for name, size, slices, labelled, labelCrc in VOLUME_FILLS:
+            phantom = getattr(phantoms, name)(size, slices)
+            image, click = phantom.image, phantom.click
+            labelArray = numpy.zeros(image.shape, dtype=numpy.int16)
+            result = fill_volume(image, labelArray, click, 0, phantom.hi, phantom.lo, 1, image.size,
+                                 (click[0], image.shape[0]))
+            self.assertIsNone(result.error, name)
+            self.assertEqual((int((labelArray > 0).sum()), crc(labelArray)), (labelled, labelCrc), name)
+
+    def test_fill_volume_agreement(self):
+        """Filling in 3D labels close to what propagating the click does, on the slices propagation fills."""
+        for name, size, slices, bounds, slicesFilled, least in VOLUME_AGREEMENT:
+            phantom = volume_phantom(name, size, slices)
+            image = phantom.image
+            start, stop = bounds or (0, slices)
+            click = (start,) + tuple(phantom.click[1:])
+            propagated = numpy.zeros(image.shape, dtype=numpy.int16)
+            propagator = SlicePropagator(image, propagated, 0, range(start, stop), phantom.hi, phantom.lo)
+            try:
+                with quiet():
+                    results = list(propagate(propagator, click[1:], [], 1, MAX_PIXELS))
+            finally:
+                propagator.close()
+            filled = [result.index for result in results if result.error is None]
+            self.assertEqual(len(filled), slicesFilled, (name, size, bounds))
+            labelArray = numpy.zeros(image.shape, dtype=numpy.int16)
+            result = fill_volume(image, labelArray, click, 0, phantom.hi, phantom.lo, 1, image.size, bounds)
+            self.assertIsNone(result.error, (name, size, bounds))
+            self.assertFalse(labelArray[:start].any() or labelArray[stop:].any(), (name, size, bounds))
+            agreement = dice(propagated[filled] > 0, labelArray[filled] > 0)
+            self.assertGreaterEqual(agreement, least, (name, size, bounds))
+
+    def test_fill_volume_capped(self):
+        """A 3D fill cut short at the voxel cap labels that many voxels of the full fill."""
+        for name in ('bone_volume', 'nerve_volume'):
+            phantom = getattr(phantoms, name)(64, 12)
+            image, click = phantom.image, phantom.click
+            full = numpy.zeros(image.shape, dtype=numpy.int16)
+            whole = fill_volume(image, full, click, 0, phantom.hi, phantom.lo, 1, image.size)
+            for maxVoxels in (50, 200, 2000):
+                labelArray = numpy.zeros(image.shape, dtype=numpy.int16)
+                result = fill_volume(image, labelArray, click, 0, phantom.hi, phantom.lo, 1, maxVoxels)
+                self.assertIsNone(result.error, (name, maxVoxels))
+                self.assertEqual(result.capped, maxVoxels < whole.voxelsSet, (name, maxVoxels))
+                self.assertEqual(result.voxelsSet, min(maxVoxels, whole.voxelsSet), (name, maxVoxels))
+                self.assertFalse(((labelArray > 0) & (full == 0)).any(), (name, maxVoxels))
+
+
+class LabelEditHistoryTest(unittest.TestCase):
+
+    def test_grouped_click(self):
+        """The slices one click fills are undone and redone in one step."""
+        labelArray = numpy.zeros((4, 8, 8), dtype=numpy.int16)
+        history = LabelEditHistory()
+        group = EditGroup('label')
+        for index in (1, 2, 3):
+            before = labelArray[index].copy()
+            labelArray[index, 2:6, 2:6] = index
+            group.add(SliceEdit('label', 0, index, before, labelArray[index]))
+        group.add(SliceEdit('label', 0, 0, labelArray[0].copy(), labelArray[0]))
+        filled = labelArray.copy()
+        self.assertEqual((len(group.edits), len(group)), (3, 48))
+        history.record(group)
+        self.assertIs(history.undo(lambda key: labelArray), group)
+        self.assertFalse(labelArray.any())
+        self.assertIs(history.redo(lambda key: labelArray), group)
+        self.assertTrue(numpy.array_equal(labelArray, filled))
+        self.assertEqual(history.undoStack, [group])
+
+
+class DebugTest(unittest.TestCase):
+
+    def tearDown(self):
+        set_debug(False)
+
+    def test_switch(self):
+        """is_debug() follows set_debug(), and debug() writes only while it is on."""
+        for enabled in (False, True):
+            set_debug(enabled)
+            self.assertIs(is_debug(), enabled)
+            stdout = sys.stdout
+            sys.stdout = output = Capture()
+            try:
+                debug("@@@value=", 42)
+            finally:
+                sys.stdout = stdout
+            self.assertEqual(''.join(output.parts), '@@@value= 42\n' if enabled else '')
+
+
+class TracePoolTest(unittest.TestCase):
+
+    def tearDown(self):
+        trace_pool(0)
+
+    def test_shared_pool(self):
+        """The shared pool is replaced when its size or kind changes, and closed by trace_pool(0)."""
+        first = trace_pool(2, 'thread')
+        self.assertIs(trace_pool(2, 'thread'), first)
+        second = trace_pool(3, 'thread')
+        self.assertIsNot(second, first)
+        self.assertIsNone(first.pool)
+        trace_pool(0)
+        self.assertIsNone(second.pool)
+
+    def test_process_traces(self):
+        """Seeds traced on worker processes give the paths serial tracing does."""
+        pool = trace_pool(2, 'process')
+        for name, size, click in sorted(set(entry[:3] for entry in SLICE_CLICKS))[:6]:
+            phantom = slice_phantom(name, size)
+            with quiet():
+                serial = gimme_a_path(click, 200, phantom.hi, phantom.lo, phantom.image)
+                pooled = gimme_a_path(click, 200, phantom.hi, phantom.lo, phantom.image, pool=pool)
+            self.assertEqual((Contour(pooled[0]), Contour(pooled[1]), pooled[2]),
+                             (Contour(serial[0]), Contour(serial[1]), serial[2]), (name, size, click))
+
+
+if __name__ == '__main__':
+    unittest.main()
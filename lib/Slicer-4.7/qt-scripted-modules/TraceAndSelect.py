@@ -1,11 +1,17 @@
 import os
 import vtk, qt, ctk, slicer
+import vtk.util.numpy_support
 import EditorLib
 from EditorLib.EditOptions import HelpButton
 from EditorLib.EditOptions import EditOptions
 from EditorLib import EditUtil
 from EditorLib import LabelEffect
 import math
+import timeit
+import numpy
+from TraceAndSelectLib import (PLANE_AXES, SlicePropagator, PropagationJob, TracedOutline,
+                               slice_indexes, segment_batch, EditGroup, labelEditHistory, sliceMaskCache,
+                               StageStats, fill_volume, debug, is_debug, set_debug)
 
 #
 # The Editor Extension itself.
@@ -62,6 +68,20 @@ class TraceAndSelectOptions(EditorLib.LabelEffectOptions):
     self.frame.layout().addWidget(self.preview)
     ## End preview checkbox
 
+    ## Volume mode checkbox
+    self.volumeMode = qt.QCheckBox("Fill in 3D", self.frame)
+    self.volumeMode.setToolTip("Fill the whole structure around the click in one go instead of slice by slice. The structure is grown voxel by voxel rather than traced on each slice, so the result can differ from a slice by slice fill, mostly around thin or broken walls. A non-zero offset value limits it to that many slices.")
+    self.frame.layout().addWidget(self.volumeMode)
+    self.widgets.append(self.volumeMode)
+    ## End volume mode checkbox
+
+    ## Tracking checkbox
+    self.tracking = qt.QCheckBox("Track between slices", self.frame)
+    self.tracking.setToolTip("Follow the outline of each slice onto the next one instead of searching every slice in full. Slices where the outline changes too much are still searched in full.")
+    self.frame.layout().addWidget(self.tracking)
+    self.widgets.append(self.tracking)
+    ## End tracking checkbox
+
 
 
 
@@ -127,6 +147,40 @@ class TraceAndSelectOptions(EditorLib.LabelEffectOptions):
     self.maxPixelsFrame.layout().addWidget(self.maxPixelsSpinBox)
     self.widgets.append(self.maxPixelsSpinBox)
 
+    self.maxVoxelsFrame = qt.QFrame(self.frame)
+    self.maxVoxelsFrame.setLayout(qt.QHBoxLayout())
+    self.frame.layout().addWidget(self.maxVoxelsFrame)
+    self.widgets.append(self.maxVoxelsFrame)
+    self.maxVoxelsLabel = qt.QLabel("Max Voxels per 3D fill:", self.maxVoxelsFrame)
+    self.maxVoxelsLabel.setToolTip("Set the maxVoxels a 3D fill grows to")
+    self.maxVoxelsFrame.layout().addWidget(self.maxVoxelsLabel)
+    self.widgets.append(self.maxVoxelsLabel)
+    self.maxVoxelsSpinBox = qt.QDoubleSpinBox(self.maxVoxelsFrame)
+    self.maxVoxelsSpinBox.setToolTip("Set the maxVoxels a 3D fill grows to")
+    self.maxVoxelsSpinBox.minimum = 1
+    self.maxVoxelsSpinBox.maximum = 1000000000
+    self.maxVoxelsSpinBox.decimals = 0
+    self.maxVoxelsSpinBox.suffix = ""
+    self.maxVoxelsFrame.layout().addWidget(self.maxVoxelsSpinBox)
+    self.widgets.append(self.maxVoxelsSpinBox)
+
+
+    ## Undo and redo of fills
+    # Fills are kept as deltas in the effect's own history, not as snapshots
+    # on the Editor's undo list, so they have their own undo and redo
+    self.undoFrame = qt.QFrame(self.frame)
+    self.undoFrame.setLayout(qt.QHBoxLayout())
+    self.frame.layout().addWidget(self.undoFrame)
+    self.widgets.append(self.undoFrame)
+    self.undoButton = qt.QPushButton("Undo Fill", self.undoFrame)
+    self.undoButton.setToolTip("Take back the last fill, every slice of it (Ctrl+Z in a slice view).")
+    self.undoFrame.layout().addWidget(self.undoButton)
+    self.widgets.append(self.undoButton)
+    self.redoButton = qt.QPushButton("Redo Fill", self.undoFrame)
+    self.redoButton.setToolTip("Fill again what the last undo took back (Ctrl+Y in a slice view).")
+    self.undoFrame.layout().addWidget(self.redoButton)
+    self.widgets.append(self.redoButton)
+    ## End undo and redo
 
     # Help Browser
     self.helpBrowser = qt.QPushButton("Visit the Webpage")
@@ -146,6 +200,10 @@ class TraceAndSelectOptions(EditorLib.LabelEffectOptions):
     self.connections.append( 
         (self.maxPixelsSpinBox, 'valueChanged(double)', self.onMaxPixelsSpinBoxChanged) )
     self.connections.append( (self.preview, "clicked()", self.onPreviewChanged ) )
+    self.connections.append( (self.volumeMode, "clicked()", self.onVolumeModeChanged ) )
+    self.connections.append( (self.tracking, "clicked()", self.onTrackingChanged ) )
+    self.connections.append(
+        (self.maxVoxelsSpinBox, 'valueChanged(double)', self.onMaxVoxelsSpinBoxChanged) )
 
     self.connections.append( (self.tissueRadioButton, "clicked()", self.onTissueButtonChanged ) )
     self.connections.append( (self.boneRadioButton, "clicked()", self.onBoneButtonChanged ) )
@@ -155,6 +213,8 @@ class TraceAndSelectOptions(EditorLib.LabelEffectOptions):
     self.connections.append( (self.thresh, "valuesChanged(double,double)", self.onThreshValuesChange ) )
 
     self.connections.append((self.helpBrowser, "clicked()", self.onHelpBrowserPressed))
+    self.connections.append((self.undoButton, "clicked()", self.onUndoPressed))
+    self.connections.append((self.redoButton, "clicked()", self.onRedoPressed))
     
 
 
@@ -183,8 +243,15 @@ class TraceAndSelectOptions(EditorLib.LabelEffectOptions):
       ("maxPixels", "25000"),
       ("offsetvalue", '0'),
       ("preview", "0"),
+      ("fillMode", "Plane"),
+      ("tracking", "0"),
+      ("maxVoxels", "5000000"),
       ("paintThresholdMin", "250"),
       ("paintThresholdMax", "2799"),
+      ("maskCacheMB", "128"),
+      ("undoMB", "64"),
+      ("pyramidFactor", "1"),
+      ("debug", "0"),
     )
     for d in defaults:
       param = "TraceAndSelect,"+d[0]
@@ -213,12 +280,21 @@ class TraceAndSelectOptions(EditorLib.LabelEffectOptions):
                 float(self.parameterNode.GetParameter("TraceAndSelect,paintThresholdMin")) )
     self.thresh.setMaximumValue(
                 float(self.parameterNode.GetParameter("TraceAndSelect,paintThresholdMax")) )
-    self.errorMessageFrame.setText(str(self.parameterNode.GetParameter("TraceAndSelect,errorMessage")))
+    message = str(self.parameterNode.GetParameter("TraceAndSelect,errorMessage"))
+    stats = self.parameterNode.GetParameter("TraceAndSelect,stats")
+    if stats:
+      message += "\n\nLast click:\n" + stats
+    self.errorMessageFrame.setText(message)
     self.errorMessageFrame.setStyleSheet("QTextEdit {color:blue}")
     self.errorMessageFrame.setStyleSheet(self.parameterNode.GetParameter("TraceAndSelect,errorMessageColor"))
     self.maxPixelsSpinBox.setValue( float(self.parameterNode.GetParameter("TraceAndSelect,maxPixels")) )
     self.preview.setChecked( int(self.parameterNode.GetParameter("TraceAndSelect,preview")) )
+    self.volumeMode.setChecked( self.parameterNode.GetParameter("TraceAndSelect,fillMode") == "Volume" )
+    self.tracking.setChecked( int(self.parameterNode.GetParameter("TraceAndSelect,tracking") or 0) )
+    self.maxVoxelsSpinBox.setValue( float(self.parameterNode.GetParameter("TraceAndSelect,maxVoxels") or 5000000) )
     self.offsetvalueSpinBox.setValue( float(self.parameterNode.GetParameter("TraceAndSelect,offsetvalue")))
+    self.undoButton.enabled = bool(labelEditHistory.undoStack)
+    self.redoButton.enabled = bool(labelEditHistory.redoStack)
     self.connectWidgets()
                                             
   def onToleranceSpinBoxChanged(self,value):
@@ -241,8 +317,29 @@ class TraceAndSelectOptions(EditorLib.LabelEffectOptions):
       return
     self.updateMRMLFromGUI()
 
+  def onVolumeModeChanged(self):
+    if self.updatingGUI:
+      return
+    self.updateMRMLFromGUI()
+
+  def onTrackingChanged(self):
+    if self.updatingGUI:
+      return
+    self.updateMRMLFromGUI()
+
+  def onMaxVoxelsSpinBoxChanged(self,value):
+    if self.updatingGUI:
+      return
+    self.updateMRMLFromGUI()
+
   def onHelpBrowserPressed(self):
     qt.QDesktopServices.openUrl(qt.QUrl("https://fastslice.github.io/"))
+
+  def onUndoPressed(self):
+    TraceAndSelectLogic(EditUtil.EditUtil().getSliceLogic()).undo()
+
+  def onRedoPressed(self):
+    TraceAndSelectLogic(EditUtil.EditUtil().getSliceLogic()).redo()
                             
   def onTissueButtonChanged(self):
     self.parameterNode.SetParameter("TraceAndSelect,paintThresholdMin","-2500")
@@ -259,7 +356,7 @@ class TraceAndSelectOptions(EditorLib.LabelEffectOptions):
     self.updateMRMLFromGUI()
   """
   def onThresholdValuesChange(self,min,max):
-    print("Threshold changed")
+    debug("Threshold changed")
     self.disconnectWidgets()
     self.tissueRadioButton.setChecked(False)
     self.boneRadioButton.setChecked(False)
@@ -274,11 +371,20 @@ class TraceAndSelectOptions(EditorLib.LabelEffectOptions):
         self.parameterNode.SetParameter( "TraceAndSelect,preview", "1" )
     else:
         self.parameterNode.SetParameter( "TraceAndSelect,preview", "0" )
+    if self.volumeMode.checked:
+        self.parameterNode.SetParameter( "TraceAndSelect,fillMode", "Volume" )
+    else:
+        self.parameterNode.SetParameter( "TraceAndSelect,fillMode", "Plane" )
+    if self.tracking.checked:
+        self.parameterNode.SetParameter( "TraceAndSelect,tracking", "1" )
+    else:
+        self.parameterNode.SetParameter( "TraceAndSelect,tracking", "0" )
     self.parameterNode.SetParameter(
                 "TraceAndSelect,paintThresholdMin", str(self.thresh.minimumValue) )
     self.parameterNode.SetParameter(
                 "TraceAndSelect,paintThresholdMax", str(self.thresh.maximumValue) )
     self.parameterNode.SetParameter( "TraceAndSelect,maxPixels", str(self.maxPixelsSpinBox.value) )
+    self.parameterNode.SetParameter( "TraceAndSelect,maxVoxels", str(self.maxVoxelsSpinBox.value) )
     self.parameterNode.SetParameter( "TraceAndSelect,offsetvalue", str(self.offsetvalueSpinBox.value) )
     self.parameterNode.SetDisableModifiedEvent(disableState)
     if not disableState:
@@ -300,28 +406,78 @@ class TraceAndSelectTool(LabelEffect.LabelEffectTool):
 
   def __init__(self, sliceWidget):
     super(TraceAndSelectTool,self).__init__(sliceWidget)
-    # create a logic instance to do the non-gui work
+    # create a logic instance to do the non-gui work; it is kept for every
+    # click in this view so that its cached volume views are reused
     self.logic = TraceAndSelectLogic(self.sliceWidget.sliceLogic())
     
-    self.prevPath = []
-    self.prevFillPoint = None
+    # Outline shown by the last right click, waiting for a left click to fill it
+    self.outline = None
+
+    # Previewed outlines are drawn on top of the slice view rather than
+    # painted into the label volume
+    self.previewPolyData = vtk.vtkPolyData()
+    self.previewMapper = vtk.vtkPolyDataMapper2D()
+    self.previewMapper.SetInputData(self.previewPolyData)
+    self.previewActor = vtk.vtkActor2D()
+    self.previewActor.SetMapper(self.previewMapper)
+    actorProperty = self.previewActor.GetProperty()
+    actorProperty.SetColor(1, 1, 0)
+    actorProperty.SetLineWidth(1)
+    self.renderer.AddActor2D(self.previewActor)
+    self.actors.append(self.previewActor)
 
   def cleanup(self):
+    self.logic.cancelJob()
+    self.logic.cleanup()
     super(TraceAndSelectTool,self).cleanup()
 
+  def showPreview(self, outline):
+    """Draw outline in the slice view and keep it for a later left click."""
+    self.outline = outline
+    # Pixel centres of the closed path in the IJK space of the label volume
+    coordinates = numpy.zeros((len(outline.path) + 1, 3))
+    inPlane = [a for a in range(3) if a != outline.axis]
+    coordinates[:-1, inPlane[0]] = outline.path.rows
+    coordinates[:-1, inPlane[1]] = outline.path.cols
+    coordinates[:-1, outline.axis] = outline.index
+    coordinates[-1] = coordinates[0]
+    points = vtk.vtkPoints()
+    points.SetData(vtk.util.numpy_support.numpy_to_vtk(coordinates[:, ::-1].copy(), deep=1))
+    lines = vtk.vtkCellArray()
+    lines.InsertNextCell(len(coordinates))
+    for pointId in range(len(coordinates)):
+      lines.InsertCellPoint(pointId)
+    ijkPolyData = vtk.vtkPolyData()
+    ijkPolyData.SetPoints(points)
+    ijkPolyData.SetLines(lines)
+
+    xyToIJK = self.sliceWidget.sliceLogic().GetLabelLayer().GetXYToIJKTransform()
+    ijkToXY = vtk.vtkGeneralTransform()
+    ijkToXY.DeepCopy(xyToIJK)
+    ijkToXY.Inverse()
+    transformFilter = vtk.vtkTransformPolyDataFilter()
+    transformFilter.SetTransform(ijkToXY)
+    transformFilter.SetInputData(ijkPolyData)
+    transformFilter.Update()
+    self.previewPolyData.DeepCopy(transformFilter.GetOutput())
+    self.sliceView.scheduleRender()
+
+  def clearPreview(self):
+    """Forget the previewed outline and remove it from the slice view."""
+    self.outline = None
+    self.previewPolyData.Initialize()
+    self.sliceView.scheduleRender()
+
   def processEvent(self, caller=None, event=None):
     """
     handle events from the render window interactor
     """
     
-    node = EditUtil.EditUtil().getParameterNode()
-    preview = int(node.GetParameter("TraceAndSelect,preview"))
+    preview = self.logic.parameters().preview
     # Clear any saved outlines if preview has been just disabled
     if not preview:
-        if self.prevPath != []:
-            self.prevPath = []
-            self.prevFillPoint = None
-            self.undoRedo.undo()
+        if self.outline is not None:
+            self.clearPreview()
     
     
     # let the superclass deal with the event if it wants to
@@ -330,42 +486,45 @@ class TraceAndSelectTool(LabelEffect.LabelEffectTool):
     # LEFT CLICK
     if event == "LeftButtonPressEvent":
       xy = self.interactor.GetEventPosition()
-      sliceLogic = self.sliceWidget.sliceLogic()
-      logic = TraceAndSelectLogic(sliceLogic)
-      logic.undoRedo = self.undoRedo
-      if self.prevPath != []:
-        logic.apply(xy, forced_path=self.prevPath, forced_point=self.prevFillPoint)
-        self.prevPath = []
-        self.prevFillPoint = None
+      logic = self.logic
+      if self.outline is not None:
+        # Fill the previewed outline without tracing it again
+        outline = self.outline
+        self.clearPreview()
+        logic.apply(xy, outline=outline)
       else:
         logic.apply(xy)
-      print("Got a %s at %s in %s" % (event,str(xy),self.sliceWidget.sliceLogic().GetSliceNode().GetName()))
+      if is_debug():
+        debug("Got a", event, "at", xy, "in", self.sliceWidget.sliceLogic().GetSliceNode().GetName())
       self.abortEvent(event)
     # RIGHT CLICK
     elif event == "RightButtonPressEvent" and preview:
         xy = self.interactor.GetEventPosition()
-        sliceLogic = self.sliceWidget.sliceLogic()
-        logic = TraceAndSelectLogic(sliceLogic)
-        logic.undoRedo = self.undoRedo
+        logic = self.logic
         # Erase stored path and remove from view
-        if self.prevPath != []:
-            self.prevPath = []
-            self.prevFillPoint = None
-            logic.undoRedo.undo()
-        # Store prevPath and prevFillPoint
-        self.prevPath, self.prevFillPoint = logic.apply(xy, 1)
-        print("Got a %s at %s in %s" % (event,str(xy),self.sliceWidget.sliceLogic().GetSliceNode().GetName()))
+        if self.outline is not None:
+            self.clearPreview()
+        outline = logic.apply(xy, 1)
+        if outline is not None:
+            self.showPreview(outline)
+        if is_debug():
+            debug("Got a", event, "at", xy, "in", self.sliceWidget.sliceLogic().GetSliceNode().GetName())
         self.abortEvent(event)
+    # CTRL+Z / CTRL+Y, the effect's own undo and redo of fills
+    elif event == "KeyPressEvent" and self.interactor.GetControlKey():
+        key = self.interactor.GetKeySym().lower()
+        if key == 'z' and not self.interactor.GetShiftKey():
+            self.logic.undo()
+            self.abortEvent(event)
+        elif key == 'y' or key == 'z':
+            self.logic.redo()
+            self.abortEvent(event)
     # SLICE VIEW HAS CHANGED
     elif event == "ModifiedEvent":  # Offset was changed on one of the viewing panels
         # Erase stored path and remove from view
-        if self.prevPath != []:
-            self.prevPath = []
-            self.prevFillPoint = None
-            self.undoRedo.undo()
-            sliceLogic = self.sliceWidget.sliceLogic()
-            logic = TraceAndSelectLogic(sliceLogic)
-            logic.setErrorMessage("Previewed path was discarded.", 1)
+        if self.outline is not None:
+            self.clearPreview()
+            self.logic.setErrorMessage("Previewed path was discarded.", 1)
 
     else:
       pass
@@ -381,6 +540,11 @@ class TraceAndSelectTool(LabelEffect.LabelEffectTool):
 # TraceAndSelectLogic
 #
 
+# The multi-slice fill running in the background, if any. Every slice view
+# has its own logic, so it is kept here where all of them see it: no fill,
+# undo or redo starts from any view while it runs
+runningJob = None
+
 class TraceAndSelectLogic(LabelEffect.LabelEffectLogic):
   """
   This class contains helper methods for a given effect
@@ -392,9 +556,80 @@ class TraceAndSelectLogic(LabelEffect.LabelEffectLogic):
   by other code without the need for a view context.
   """
 
+  # Seconds of slices a background fill job runs between Qt events
+  chunkSeconds = 0.1
+
   def __init__(self,sliceLogic):
     self.sliceLogic = sliceLogic
     self.fillMode = 'Plane'
+    # The multi-slice fill this logic started, while it runs; see fill()
+    # and runningJob
+    self.job = None
+    self.jobParams = None
+    self.jobTimer = None
+    # The EditGroup of the slices the running job has filled
+    self.editGroup = None
+    # Kept across clicks; see volumeViews(), sliceAxis() and parameters()
+    self.views = None
+    self.axis = None
+    self.axisKey = None
+    self.params = None
+    self.parameterNode = None
+    self.parameterNodeTag = None
+
+  def parameters(self):
+    """Return the TraceAndSelectParameters of the parameter node, parsed again only after the node is modified."""
+    node = EditUtil.EditUtil().getParameterNode()
+    if node is not self.parameterNode:
+      self.cleanup()
+      self.parameterNode = node
+      self.parameterNodeTag = node.AddObserver("ModifiedEvent", self.onParameterNodeModified)
+    if self.params is None:
+      self.params = TraceAndSelectParameters(node)
+    return self.params
+
+  def onParameterNodeModified(self, caller, event):
+    self.params = None
+
+  def cleanup(self):
+    """Stop observing the parameter node."""
+    if self.parameterNode is not None:
+      self.parameterNode.RemoveObserver(self.parameterNodeTag)
+    self.parameterNode = None
+    self.parameterNodeTag = None
+    self.params = None
+
+  def volumeViews(self):
+    """Return the TraceAndSelectViews of the background and label volumes of the view.
+
+    The views of the click before are reused unless a volume node, its
+    image data or the scalar array behind it has changed since.
+    """
+    backgroundNode = self.sliceLogic.GetBackgroundLayer().GetVolumeNode()
+    labelLogic = self.sliceLogic.GetLabelLayer()
+    labelNode = labelLogic.GetVolumeNode()
+    backgroundImage = backgroundNode.GetImageData()
+    labelImage = labelNode.GetImageData()
+    key = (backgroundNode, labelNode, backgroundImage, labelImage,
+           backgroundImage.GetDimensions(), labelImage.GetDimensions(),
+           backgroundImage.GetPointData().GetScalars().GetVoidPointer(0),
+           labelImage.GetPointData().GetScalars().GetVoidPointer(0))
+    if self.views is None or self.views.key != key:
+      debug("@@@Making new volume views")
+      self.views = TraceAndSelectViews(key, labelLogic.GetXYToIJKTransform())
+    return self.views
+
+  def sliceAxis(self):
+    """The array axis normal to the slice plane, worked out again only when the slice orientation or label volume changes."""
+    sliceToRAS = self.sliceLogic.GetSliceNode().GetSliceToRAS()
+    key = (self.sliceLogic.GetLabelLayer().GetVolumeNode(),) + \
+          tuple(sliceToRAS.GetElement(row, column) for row in range(3) for column in range(3))
+    if key != self.axisKey:
+      # select the plane corresponding to current slice orientation
+      # for the input volume; axis is the array axis normal to it
+      self.axis = PLANE_AXES[self.sliceIJKPlane()]
+      self.axisKey = key
+    return self.axis
 
 
   ###
@@ -408,7 +643,7 @@ class TraceAndSelectLogic(LabelEffect.LabelEffectLogic):
   ##
   ###
   
-  def apply(self,xy, mode=0, forced_path=None, forced_point=None):
+  def apply(self,xy, mode=0, outline=None):
     #
     # get the parameters from MRML
     #
@@ -419,10 +654,7 @@ class TraceAndSelectLogic(LabelEffect.LabelEffectLogic):
     #
     # get the label and background volume nodes
     #
-    labelLogic = self.sliceLogic.GetLabelLayer()
-    labelNode = labelLogic.GetVolumeNode()
-    backgroundLogic = self.sliceLogic.GetBackgroundLayer()
-    backgroundNode = backgroundLogic.GetVolumeNode()
+    views = self.volumeViews()
 
     ##### self.errorMessageFrame.textCursor().insertHtml('Error Detected!')
     ##### self.errorMessageFrame.setStyleSheet("QTextEdit {color:red}")
@@ -435,7 +667,7 @@ class TraceAndSelectLogic(LabelEffect.LabelEffectLogic):
     # by the editor, but can be different if the use selected
     # different bg nodes, but that is not handled here).
     #
-    xyToIJK = labelLogic.GetXYToIJKTransform()
+    xyToIJK = views.xyToIJK
     ijkFloat = xyToIJK.TransformDoublePoint(xy+(0,))
     ijk = []
     for element in ijkFloat:
@@ -451,9 +683,14 @@ class TraceAndSelectLogic(LabelEffect.LabelEffectLogic):
     #
     # Get the numpy array for the bg and label
     #
-    node = EditUtil.EditUtil().getParameterNode()
-    offset = float(node.GetParameter("TraceAndSelect,offsetvalue"))
-    if offset != 0 and mode == 0:
+    if self.jobRunning():
+      return
+    params = self.parameters()
+    self.fillMode = params.fillMode
+    offset = params.offset
+    # A 3D fill is done in one go, so there is no progress to show
+    volumeFill = self.fillMode == 'Volume' and outline is None
+    if offset != 0 and mode == 0 and not volumeFill:
       self.progress = qt.QProgressDialog()
       self.progress.setLabelText("Processing Slices...")
       self.progress.setCancelButtonText("Abort Fill")
@@ -461,243 +698,310 @@ class TraceAndSelectLogic(LabelEffect.LabelEffectLogic):
       self.progress.setMaximum(abs(offset))
       self.progress.setAutoClose(1)
       self.progress.open()
-    return self.fill(ijk, [], mode, forced_path, forced_point)
-
-  def fill(self, ijk, optional_seeds=[], mode=0, forced_path=None, forced_point=None):
-    print("Mode: %d" % mode)
-    paintOver = 1
-    mean = (0, 0)
-    count = 0
+    # Multi-slice fills run in the background so the view stays responsive
+    return self.fill(ijk, [], mode, outline, params, offset != 0 and mode == 0)
+
+  def fill(self, ijk, optional_seeds=[], mode=0, outline=None, params=None, background=False):
+    """Trace and fill the slice containing ijk, then propagate through offsetvalue more slices.
+
+    Slices are processed in a loop: parameters are read and the volumes are
+    converted to arrays once, and each slice after the first is seeded from
+    the centroid of the fill on the slice before it. In outline only mode
+    (mode 1) nothing is painted and the TracedOutline of the slice is
+    returned. Passing such an outline fills it on its own slice instead of
+    tracing from ijk. Otherwise the RegionStats of the pixels filled on every
+    slice is returned, or None after an error is reported. In Volume fill
+    mode a click fills the structure around ijk in 3D instead; see fillVolume().
+    params, the TraceAndSelectParameters to use throughout, defaults to
+    those of the parameter node now. The parameter node is only written to
+    once the slices are done.
+
+    The slices are filled by a PropagationJob. If background is True the
+    job is returned at once, its region growing as slices land, and the Qt event loop runs it in chunks of
+    about chunkSeconds, showing each chunk as it lands; the progress
+    dialog's cancel takes effect before the next chunk.
+
+    The time spent in each stage, with counts of the work done, is kept in
+    self.stats and published as the TraceAndSelect,stats parameter.
+    """
+    global runningJob
     node = EditUtil.EditUtil().getParameterNode()
+    if params is None:
+      params = self.parameters()
+    set_debug(params.debug)
+    debug("Mode:", mode)
     
     # Max number of pixels to fill in (does not include path)
-    print("@@@MaxPixels:%s" % node.GetParameter("TraceAndSelect,maxPixels"))
-    maxPixels = float(node.GetParameter("TraceAndSelect,maxPixels"))
+    maxPixels = params.maxPixels
     
     # Minimum intensity value to be detected
-    print("@@@Theshold Min:%s" % node.GetParameter("TraceAndSelect,paintThresholdMin"))
-    thresholdMin = float(node.GetParameter("TraceAndSelect,paintThresholdMin"))
+    thresholdMin = params.thresholdMin
     
     # Maximum intensity value to be detected
-    print("@@@Theshold Max:%s" % node.GetParameter("TraceAndSelect,paintThresholdMax"))
-    thresholdMax = float(node.GetParameter("TraceAndSelect,paintThresholdMax"))
+    thresholdMax = params.thresholdMax
+
+    offset = params.offset
+    debug("@@@MaxPixels:", maxPixels, "Threshold:", thresholdMin, thresholdMax, "Offset:", offset)
   
     
-    labelLogic = self.sliceLogic.GetLabelLayer()
-    labelNode = labelLogic.GetVolumeNode()
-    backgroundLogic = self.sliceLogic.GetBackgroundLayer()
-    backgroundNode = backgroundLogic.GetVolumeNode()
-
-    import vtk.util.numpy_support, numpy
-    backgroundImage = backgroundNode.GetImageData()
-    labelImage = labelNode.GetImageData()
-    shape = list(backgroundImage.GetDimensions())
-    shape.reverse()
-    backgroundArray = vtk.util.numpy_support.vtk_to_numpy(backgroundImage.GetPointData().GetScalars()).reshape(shape)
-    labelArray = vtk.util.numpy_support.vtk_to_numpy(labelImage.GetPointData().GetScalars()).reshape(shape)
-
-    ijk_reconstruction_indexes = []
-    # THIS SHOULD ALWAYS BE TRUE
-    # VOLUME MODE IS DISABLED BECAUSE I HAVE NO CLUE WHAT IT IS
-    original_ijk = list(ijk)
-    if self.fillMode == 'Plane':
-      # select the plane corresponding to current slice orientation
-      # for the input volume
-      ijkPlane = self.sliceIJKPlane()
-      i,j,k = ijk
-      if ijkPlane == 'JK':
-        backgroundDrawArray = backgroundArray[:,:,k]
-        labelDrawArray = labelArray[:,:,k]
-        ijk = (i, j)
-        ijk_reconstruction_indexes = (0,1)
-      if ijkPlane == 'IK':
-        backgroundDrawArray = backgroundArray[:,j,:]
-        labelDrawArray = labelArray[:,j,:]
-        ijk = (i, k)
-        ijk_reconstruction_indexes = (0, 2)
-      if ijkPlane == 'IJ':
-        backgroundDrawArray = backgroundArray[i,:,:]
-        labelDrawArray = labelArray[i,:,:]
-        ijk = (j, k)
-        ijk_reconstruction_indexes = (1,2)
-    else:
-        print("HOW DID YOU DO THAT??? WHAT DID YOU DO TO ACTIVATE VOLUME MODE???")
-        self.setErrorMessage("Error: volume mode not supported.")
+    views = self.volumeViews()
+    labelNode = views.labelNode
+    self.labelNode = labelNode
+    backgroundNode = views.backgroundNode
+    backgroundImage = views.backgroundImage
+    labelEditHistory.maxBytes = params.undoMB * 2**20
+
+    shape = views.shape
+    backgroundArray = views.backgroundArray
+    labelArray = views.labelArray
+
+    if self.fillMode not in ('Plane', 'Volume'):
+        self.setErrorMessage("Error: unknown fill mode %s." % self.fillMode)
         return
+    axis = self.sliceAxis()
+    inPlane = [a for a in range(3) if a != axis]
+    point = (ijk[inPlane[0]], ijk[inPlane[1]])
+    if outline is not None:
+      ijk = list(ijk)
+      ijk[outline.axis] = outline.index
 
+    # Slices to process, stopping at the edge of the volume
+    indexes = slice_indexes(ijk[axis], offset if mode == 0 else 0, shape[axis])
 
-    # Log info about where the user clicked for debugging purposes
-    value = backgroundDrawArray[ijk]
-    print("@@@location=", ijk)
-    print("@@@value=", value)
-    
     # Get the current label that the user wishes to assign using the tool
     label = EditUtil.EditUtil().getLabel()
-    
-    # Use lo and hi for threshold checks
-    # Easiest way to do things is check if a pixel is outside the threshold, ie.
-
-    lo = thresholdMin
-    hi = thresholdMax
-    
-    best_path = []
-    fill_point = ijk
 
-    if mode == 0 and forced_path is not None and forced_point is not None:
-        best_path = forced_path
-        fill_point = forced_point
-    else:
-        # Build path
-        
-        best_path, visited, dead_ends = gimme_a_path(ijk, 200, hi, lo, backgroundDrawArray,
-                                                     optional_seeds)
-        print("@@@Dead ends:", dead_ends)
-        
-        attempts = 0
-        max_attempts = 2
-        while dead_ends > 150 or dead_ends < 0 and attempts < max_attempts:
-            attempts += 1
-            lo -= 25
-            print("Lowering min tolerance to:", lo)
-            node.SetParameter("LabelEffect,paintThresholdMin", str(lo))
-            best_path, visited, dead_ends = gimme_a_path(ijk, 200, hi, lo, backgroundDrawArray,
-                                                         optional_seeds)
-            print("@@@Dead ends:", dead_ends)
-        
-        if dead_ends < 0:
-            print("@@@No path found? Weird.")
-            self.setErrorMessage("Error: could not find any suitable path.")
-            return
-        
-        # Save state before doing anything
-        self.undoRedo.saveState()
-        for pixel in visited:
-            labelDrawArray[pixel] = label
-        
-        EditUtil.EditUtil().markVolumeNodeAsModified(labelNode)
-
-        if mode == 1:  # Outline only mode
-            print("Outline made, returning.")
-            self.setErrorMessage("Preview complete. No errrors detected.\nLeft click to confirm.\nRight click to try a new outline.\nUndo to remove.", 1)
-            return (best_path, ijk)
-        
-    
-    #
-    # Fill path
-    #
-    
-    # Fill the path using a recursive search
-    toVisit = [fill_point,]
-    extrema = get_extrema(best_path)
-    # Create a map that contains the location of the pixels
-    # that have been already visited (added or considered to be added).
-    # This is required if paintOver is enabled because then we reconsider
-    # all pixels (not just the ones that have not labelled yet).
-    if paintOver:
-      labelDrawVisitedArray = numpy.zeros(labelDrawArray.shape,dtype='bool')
-
-    pixelsSet = 0
-    print("@@@FILLING PATH")
-    while toVisit != []:
-      location = toVisit.pop(0)
-
-      try:
-        l = fetch_val(labelDrawArray, location)
-        b = fetch_val(backgroundDrawArray, location)
-      except IndexError:
-        continue
-      if (not paintOver and l != 0):
-        # label filled already and not painting over, leave it alone
-        continue
+    if self.fillMode == 'Volume' and mode == 0 and outline is None:
+      # A previewed outline is still filled on its own slice
+      return self.fillVolume(backgroundArray, labelArray, ijk, axis, indexes, thresholdMax, thresholdMin,
+                             label, offset != 0, params.maxVoxels)
+
+    # Masks are cached per slice and threshold range; a new modification time
+    # of the background image data means the cached masks no longer apply
+    sliceMaskCache.maxBytes = params.maskCacheMB * 2**20
+    sliceMaskCache.trim()
+    cacheKey = (backgroundNode.GetID(), backgroundImage.GetMTime())
+    stats = StageStats()
+    self.stats = stats
+    propagator = SlicePropagator(backgroundArray, labelArray, axis, indexes, thresholdMax, thresholdMin,
+                                 cache=sliceMaskCache, cacheKey=cacheKey, stats=stats,
+                                 tracking=params.tracking, pyramidFactor=params.pyramidFactor)
+    if mode == 1:  # Outline only mode
+      clickStart = timeit.default_timer()
       try:
-        if (paintOver and l == label):
-          temp1 = mean[0] + location[0]
-          temp2 = mean[1] + location[1]
-          mean = (temp1, temp2)
-          count += 1
-          # label is the current one, but maybe it was filled with another high/low value,
-          # so we have to visit it once (and only once) in this session, too
-          if  labelDrawVisitedArray[location]:
-            # visited already, so don't try to fill it again
-            continue
-          else:
-            # we'll visit this pixel now, so mark it as visited
-            labelDrawVisitedArray[location] = True
-      except ValueError:
-        print("@@@VALUE ERROR!", l)
-        print("@@@Location: ", location)
-        print("@@@fill_point:", fill_point)
-        print("@@@toVisit:", toVisit)
-        continue
-      if location in best_path:
-        continue
-      if not (extrema[0] < location[0] < extrema[1] and extrema[2] < location[1] < extrema[3]):
-        # Went out of bounds for path
-        print("@@@WENT OUT OF BOUNDS FOR PATH!")
-        self.setErrorMessage("Error: Went out of bounds for path.")
-        self.undoRedo.undo()
-        return
-      labelDrawArray[location] = label
-      if l != label:
-        # only count those pixels that were changed (to allow step-by-step growing by multiple mouse clicks)
-        pixelsSet += 1
-      if pixelsSet > maxPixels:
-        toVisit = []
-      else:
-          # add the 4 neighbors to the stack
-          toVisit.append((location[0] - 1, location[1]     ))
-          toVisit.append((location[0] + 1, location[1]     ))
-          toVisit.append((location[0]    , location[1] - 1 ))
-          toVisit.append((location[0]    , location[1] + 1 ))
-
-    # signal to slicer that the label needs to be updated
-    ## CHANGE OFFSET
-    print("@@@Offset:|%s|" % node.GetParameter("TraceAndSelect,offsetvalue"))
-    
-    self.offset = float(node.GetParameter("TraceAndSelect,offsetvalue"))
-    print("OFFSET SIGN: %s" % math.copysign(1, self.offset) )
-
-    if self.offset != 0:
-      slices_seen = self.progress.maximum - abs(self.offset)
+        return self.traceOutline(propagator, indexes[0], point, optional_seeds)
+      finally:
+        propagator.close()
+        stats.addTime('click', timeit.default_timer() - clickStart)
+        node.SetParameter("TraceAndSelect,stats", stats.summary())
+
+    # Every slice the click fills is undone in one step
+    self.editGroup = EditGroup(labelNode.GetID())
+    job = PropagationJob(propagator, point, optional_seeds, label, maxPixels, outline, labelNode.GetID(),
+                         self.sliceFilled)
+    self.job = job
+    runningJob = job
+    self.jobParams = params
+    if background:
+      # The Qt event loop runs a chunk of slices at a time from here on
+      self.jobTimer = qt.QTimer()
+      self.jobTimer.setInterval(0)
+      self.jobTimer.connect('timeout()', self.runChunk)
+      self.jobTimer.start()
+      return job
+    try:
+      while not job.done:
+        job.step(0)
+        if job.done:
+          break
+        if self.progress.wasCanceled:
+          job.cancel()
+        else:
+          self.progress.setValue(job.slicesDone)
+    finally:
+      self.finishJob(job)
+    if job.error is not None:
+      return None
+    return job.region
+
+  def cancelJob(self):
+    """Stop the running fill job, if any, keeping the slices it has filled."""
+    job = self.job
+    if job is not None:
+      job.cancel()
+      self.finishJob(job)
+
+  def sliceFilled(self, result):
+    """Add the edit of each slice a fill job paints, as it lands, to the click's EditGroup."""
+    if result.error is None:
+      self.editGroup.add(result.edit)
+
+  def runChunk(self):
+    """Fill the next chunk of slices of the running job and show them. The job's timer calls this."""
+    job = self.job
+    try:
       if self.progress.wasCanceled:
-        self.offset = 0
-        layoutManager = slicer.app.layoutManager()
-        widget = layoutManager.sliceWidget('Red')
-        rednode = widget.sliceLogic().GetSliceNode()
-        rednode.SetSliceOffset(rednode.GetSliceOffset() + math.copysign(1, self.offset))
-        node.SetParameter("TraceAndSelect,offsetvalue",
-                          str(0))
-        self.setErrorMessage("Fill abandoned after {} slice(s)".format(int(slices_seen)),1)
-        return
-      self.progress.setValue(slices_seen)
+        job.cancel()
+      else:
+        job.step(self.chunkSeconds)
+    finally:
+      if job.done:
+        self.finishJob(job)
+      else:
+        self.progress.setValue(job.slicesDone)
+        # Show the slices filled so far
+        EditUtil.EditUtil().markVolumeNodeAsModified(self.labelNode)
+
+  def jobRunning(self):
+    """True, after reporting it, if a fill job started from any view is still running."""
+    if runningJob is None:
+      return False
+    self.setErrorMessage("Error: a fill is still running.")
+    return True
+
+  def finishJob(self, job):
+    """Report how a fill job ended and write its outcome to the parameter node, once."""
+    global runningJob
+    if self.jobTimer is not None:
+      self.jobTimer.stop()
+      self.jobTimer = None
+    self.job = None
+    if runningJob is job:
+      runningJob = None
+    self.recordEdit(self.editGroup)
+    self.editGroup = None
+    params = self.jobParams
+    node = EditUtil.EditUtil().getParameterNode()
+    stats = job.propagator.stats
+    stats.addTime('click', job.elapsed())
+    lowered = [result.lo for result in job.results if result.lo != params.thresholdMin]
+    if lowered:
+      node.SetParameter("LabelEffect,paintThresholdMin", str(lowered[-1]))
+    slicesDone = job.slicesDone
+    if job.error is not None:
+      self.setErrorMessage("Error: %s." % job.error)
+      # The offset counts down to the slices still to fill
+      slicesLeft = job.total - 1 - slicesDone if slicesDone else None
+    elif job.cancelled:
+      self.setErrorMessage("Fill abandoned after {} slice(s)".format(slicesDone),1)
+      slicesLeft = 0
+    else:
+      debug("@@@FILL DONE")
+      self.setErrorMessage("Fill complete. {} pixel(s) filled.".format(job.region.count), 1)
+      slicesLeft = 0 if job.total > 1 else None
+    step = int(math.copysign(1, params.offset))
+    if slicesLeft is not None:
+      node.SetParameter("TraceAndSelect,offsetvalue", str(float(step * slicesLeft)))
+    node.SetParameter("TraceAndSelect,stats", stats.summary())
+    debug("@@@Slice timings:", job.timings)
+
+    if params.offset != 0:
+      self.progress.close()
+    slicesReached = len(job.results)
+    if slicesReached > 1:
+      # Leave the Red view on the last slice that was reached
       layoutManager = slicer.app.layoutManager()
       widget = layoutManager.sliceWidget('Red')
       rednode = widget.sliceLogic().GetSliceNode()
-      rednode.SetSliceOffset(rednode.GetSliceOffset() + math.copysign(1, self.offset))
-      node.SetParameter("TraceAndSelect,offsetvalue", str(self.offset -  math.copysign(1, self.offset)))
-      print(self.offset)
-      
-      ### Calc centoid mean stuff here
-
-      recs_mean = (mean[0]/count, mean[1]/count)
-      rec_mean = get_optional_seeds(best_path, recs_mean)[0]
-      print("MEAN:", rec_mean, recs_mean)
-      rec_ijk = list(original_ijk)
-      for i in range(0,3):
-        rec_ijk[i] = int(rec_ijk[i] + int(math.copysign(1, self.offset)))
-      rec_ijk[ijk_reconstruction_indexes[0]] = rec_mean[0]
-      rec_ijk[ijk_reconstruction_indexes[1]] = rec_mean[1]
-      print("RECURSIVE IJK:", rec_ijk)
-      print("#########RECURSE#########")
-      return self.fill(rec_ijk, optional_seeds=get_optional_seeds(best_path, recs_mean))
-      
-      ###
-    
-    print("@@@FILL DONE")
-    EditUtil.EditUtil().markVolumeNodeAsModified(labelNode)
-    self.setErrorMessage("Fill complete. No errors detected.", 1)
+      rednode.SetSliceOffset(rednode.GetSliceOffset() + step * (slicesReached - 1))
 
-    return
+    if is_debug():
+      debug("@@@Mask cache:", sliceMaskCache.stats())
+    # signal to slicer that the label needs to be updated
+    EditUtil.EditUtil().markVolumeNodeAsModified(self.labelNode)
+
+  def fillVolume(self, backgroundArray, labelArray, ijk, axis, indexes, hi, lo, label, bounded, maxVoxels):
+    """Fill the structure around ijk in 3D in one go, as Volume fill mode does.
+
+    If bounded the fill stays within the slices in indexes. maxVoxels is the
+    voxel cap. The fill is one undo step. Returns the RegionStats of the
+    voxels filled, or None after an error is reported.
+    """
+    node = EditUtil.EditUtil().getParameterNode()
+    bounds = (min(indexes), max(indexes) + 1) if bounded else None
+    stats = StageStats()
+    self.stats = stats
+    clickStart = timeit.default_timer()
+    try:
+      result = fill_volume(backgroundArray, labelArray, ijk, axis, hi, lo, label, maxVoxels, bounds,
+                           self.labelNode.GetID(), stats)
+    finally:
+      stats.addTime('click', timeit.default_timer() - clickStart)
+      node.SetParameter("TraceAndSelect,stats", stats.summary())
+    if result.error is not None:
+      self.setErrorMessage("Error: %s." % result.error)
+      return
+    self.recordEdit(result.edit)
+    if result.capped:
+      self.setErrorMessage("Fill stopped at the voxel cap after {} voxel(s).".format(result.count), 1)
+    else:
+      self.setErrorMessage("Fill complete. {} voxel(s) filled.".format(result.count), 1)
+    EditUtil.EditUtil().markVolumeNodeAsModified(self.labelNode)
+    return result.region
+
+  def traceOutline(self, propagator, index, point, optional_seeds):
+    """Trace slice index without painting anything. Returns the TracedOutline, or None after reporting an error."""
+    best_path, visited, dead_ends, lo = propagator.trace(index, point, optional_seeds)
+    if lo != propagator.lo:
+      EditUtil.EditUtil().getParameterNode().SetParameter("LabelEffect,paintThresholdMin", str(lo))
+    if dead_ends < 0:
+      debug("@@@No path found? Weird.")
+      self.setErrorMessage("Error: could not find any suitable path.")
+      return None
+    debug("Outline made, returning.")
+    self.setErrorMessage("Preview complete. No errrors detected.\nLeft click to confirm.\nRight click to try a new outline.\nUncheck preview to remove.", 1)
+    return TracedOutline(propagator.axis, index, point, best_path, visited,
+                         propagator.labelSlice(index).shape)
+
+  def segmentBatch(self, backgroundArray, labelArray, requests):
+    """Replay many clicks on arrays without touching the slice view, parameter node or undo history.
+
+    requests are (ijk, plane, thresholds, maxPixels, label[, offset]) tuples,
+    filled in turn into labelArray; slices seen before reuse their masks.
+    Returns a BatchResult per request, with its fills, stats and timing.
+    See TraceAndSelectLib.segment_batch().
+    """
+    return segment_batch(backgroundArray, labelArray, requests)
+
+  def recordEdit(self, edit):
+    """Add the edit of a click, an EditGroup or VolumeEdit, to the undo history.
+
+    Fills are undone by the effect's own undo() and redo() from their
+    deltas, and are not put on the Editor's undo list: its undo and redo
+    copy the whole label volume every time.
+    """
+    labelEditHistory.record(edit)
+
+  def labelArrayForNode(self, nodeID):
+    """Return the label volume array of the node with the given ID, or None if it is gone."""
+    node = slicer.mrmlScene.GetNodeByID(nodeID)
+    if node is None or node.GetImageData() is None:
+      return None
+    return volume_array(node.GetImageData())
+
+  def undo(self, edit=None):
+    """Revert the most recent TraceAndSelect fill, or edit wherever it is in the history. Returns the edit, or None."""
+    if self.jobRunning():
+      return None
+    edit = labelEditHistory.undo(self.labelArrayForNode, edit)
+    if edit is None:
+      self.setErrorMessage("Nothing to undo.", 1)
+      return None
+    EditUtil.EditUtil().markVolumeNodeAsModified(slicer.mrmlScene.GetNodeByID(edit.volumeKey))
+    self.setErrorMessage("Fill undone. {} pixel(s) restored.".format(len(edit)), 1)
+    return edit
+
+  def redo(self, edit=None):
+    """Re-apply the most recently undone TraceAndSelect fill, or edit wherever it is. Returns the edit, or None."""
+    if self.jobRunning():
+      return None
+    edit = labelEditHistory.redo(self.labelArrayForNode, edit)
+    if edit is None:
+      self.setErrorMessage("Nothing to redo.", 1)
+      return None
+    EditUtil.EditUtil().markVolumeNodeAsModified(slicer.mrmlScene.GetNodeByID(edit.volumeKey))
+    self.setErrorMessage("Fill redone. {} pixel(s) filled.".format(len(edit)), 1)
+    return edit
   
   def setErrorMessage(self, errorText, errorColor = 0):
     """Call this to seet the message in the error box.
@@ -719,246 +1023,56 @@ class TraceAndSelectLogic(LabelEffect.LabelEffectLogic):
     node.SetParameter("TraceAndSelect,errorMessageColor", str(errorColor))
     return
   
-import random
-  
-def get_optional_seeds(seeds, mid, a= 2, b=3):
-  optional_seeds = []
-  maxes = [0,0]
-  mins = [10000, 10000]
-  for i in seeds:
-    maxes[0] = max(i[0], maxes[0])
-    maxes[1] = max(i[1], maxes[1])
-    mins[0] = min(i[0], mins[0])
-    mins[1] = min(i[1], mins[1])
-    
-  optional_seeds.append( (int(mid[0] + a*mins[0])/b, int(mid[1]) ))
-  optional_seeds.append( ( int(mid[0]), int(mid[1] + a*mins[1])/b) )
-  optional_seeds.append( (int(mid[0] + a*maxes[0])/b  ,int(mid[1])) )
-  optional_seeds.append( (int(mid[0]), int(mid[1] + a*mins[1])/b) )
 
-  return optional_seeds
-  
-  
-def gimme_a_path(location, seed_distance, hi, lo, bgArray, optional_seeds=[]):
-    """Finds the seeds, then builds the paths, then outputs the best path. No messy stuff required."""
-    #
-    # Find edge pixels
-    #
-    seeds = find_edges(location, seed_distance, hi, lo, bgArray)
-    print("BEFORE", seeds)
-    seeds.extend(optional_seeds)
-    print("AFTER", seeds)
-    #
-    # Build paths
-    #
-    print("@@@BUILDING PATH")
-    paths = []
-    for seed in seeds:
-        if seed is None:
-            continue
-        print("--- SEED ---",  str(seed))
-        repeat = False
-        for path in paths:
-            if seed in path:
-                repeat = True
-            break
-        if repeat:
-            continue
-        ret_val = build_path(seed, hi, lo, bgArray)
-        if ret_val[0] == []:
-            continue
-        paths.append(ret_val)
-    
-    #
-    # Find best path
-    #
-    best_path = find_best_path(paths, location)
-    best_path = smooth_path(best_path, hi, lo, bgArray)
-        
-    return best_path
-    
+class TraceAndSelectParameters(object):
+  """
+  The TraceAndSelect parameters of a parameter node, read once and
+  converted from strings. An operation keeps using the snapshot it started
+  with; TraceAndSelectLogic.parameters() reads a new one after the node
+  has been modified.
+  """
 
-def smooth_path(path_obj, hi, lo, bgArray):
-    """Smooth the path by adding extra pixels to visited."""
-    offsets = [
-        (0, 1),
-        (1, 1),
-        (1, 0),
-        (1, -1),
-        (0, -1),
-        (-1, -1),
-        (-1, 0),
-        (-1, 1)
-    ]
-    num_pixels_added = 0
-    best_path, visited, dead_ends = path_obj
-    for pixel in best_path:
-        for offset in offsets:
-            neighbor = (pixel[0] + offset[0], pixel[1] + offset[1])
-            p_intensity = None
-            n_intensity = None
-            try:
-                p_intensity = fetch_val(bgArray, pixel)
-                n_intensity = fetch_val(bgArray, neighbor)
-            except IndexError:
-                continue
-            if neighbor in visited or lo < n_intensity < hi:
-                continue
-            """
-            distance = abs(bgArray[neighbor] - bgArray[pixel])
-            percentage = float(distance) / (bgArray[pixel] + 3024)  # Add 3024 to scale with negative grayscale vals
-            if percentage <= 0.2:
-                visited.append(neighbor)
-                num_pixels_added += 1
-            """
-            proximity = abs(n_intensity - p_intensity)
-            if bgArray[neighbor] > hi:
-                distance = bgArray[neighbor] - hi
-            else:
-                distance = lo - n_intensity
-            if distance <= 125:
-                visited.append(neighbor)
-                num_pixels_added += 1
-    print("%d pixels were added during smoothing." %num_pixels_added)
-    return (best_path, visited, dead_ends)
-    
-  
-  ###
-  ###
-  ## End HERE ##########
-  ##
-  ###
-  ###
+  def __init__(self, node):
+    def number(name, default):
+      value = node.GetParameter("TraceAndSelect," + name)
+      return float(value) if value else default
+    self.maxPixels = number("maxPixels", 25000)
+    self.thresholdMin = number("paintThresholdMin", 250)
+    self.thresholdMax = number("paintThresholdMax", 2799)
+    self.offset = number("offsetvalue", 0)
+    self.preview = bool(number("preview", 0))
+    self.fillMode = node.GetParameter("TraceAndSelect,fillMode") or 'Plane'
+    self.tracking = bool(number("tracking", 0))
+    self.maxVoxels = number("maxVoxels", 5000000)
+    self.maskCacheMB = number("maskCacheMB", 128)
+    self.undoMB = number("undoMB", 64)
+    self.pyramidFactor = int(number("pyramidFactor", 1))
+    self.debug = int(number("debug", 0))
+
+
+def volume_array(imageData):
+  """A NumPy view, indexed [k, j, i], of the scalars of imageData."""
+  shape = list(imageData.GetDimensions())
+  shape.reverse()
+  return vtk.util.numpy_support.vtk_to_numpy(imageData.GetPointData().GetScalars()).reshape(shape)
+
+
+class TraceAndSelectViews(object):
+  """
+  The background and label volumes of a slice view and NumPy views of
+  their voxels, kept by TraceAndSelectLogic from one click to the next.
+  key identifies the nodes, image data and scalar arrays the views were
+  made from; xyToIJK is the label layer's XY to IJK transform, which Slicer
+  keeps up to date as the view changes.
+  """
 
-def find_edge(point, offset, max_dist, hi, lo, bgArray):
-    """Return the first edgepoint and its distance from point using offset.
-    None if no path found.
-    """
-    for i in range(1, max_dist):
-        next = (point[0] + i * offset[0], point[1] + i * offset[1])
-        if is_edge(next, hi, lo, bgArray):
-            return (next, i)
-    return None
-
-def find_edges(starting_point, max_dist, hi, lo, bgArray):
-    """Return an array of edge points found growing outward from starting_point.
-    Search does not exceed max_dist.
-    If starting_point is within threshold, find a maximum of 4 points, one for each offset.
-    If starting_point is NOT within threshold, try to find as many as 8 points; two for each offset.
-    """
-    try:
-        b = fetch_val(bgArray, starting_point)
-    except IndexError:
-        return None
-    offsets = [(0,1), (1,0), (0,-1), (-1,0)]
-    edgePoints = []
-    for offset in offsets:
-        first_result = find_edge(starting_point, offset, max_dist, hi, lo, bgArray)
-        if first_result is not None:
-            edgePoints.append(first_result[0])
-            if b < lo or b > hi:
-                # Try to find second point, since starting click was outside threshold
-                second_result = find_edge(first_result[0], offset, max_dist - first_result[1], hi, lo, bgArray)
-                if second_result is not None:
-                    edgePoints.append(second_result[0])
-    return edgePoints
-
-def build_path(start, hi, lo, bgArray):
-    """Return a complete path from start."""
-    dead_ends = 0
-    offsets = [
-        (0, 1),
-        (1, 1),
-        (1, 0),
-        (1, -1),
-        (0, -1),
-        (-1, -1),
-        (-1, 0),
-        (-1, 1)
-    ]
-    visited = [start,]
-    path = [start,]
-    location = start
-    while path != []:
-        found = False
-        for offset in offsets:
-            neighbor = (location[0] + offset[0], location[1] + offset[1])
-            if len(visited) > 1 and neighbor == start:
-                # lArray[neighbor] = label
-                # print("Dead ends: ", dead_ends)
-                return (path, visited, dead_ends)
-            if is_edge(neighbor, hi, lo, bgArray) and neighbor not in visited:
-                # lArray[neighbor] = label
-                visited.append(neighbor)
-                path.append(neighbor)
-                location = neighbor
-                found = True
-                break
-        if not found:
-            # Dead end found, re-trace steps
-            # print("@@@DEAD END!")
-            dead_ends += 1
-            path.pop()
-            if len(path) > 0:
-                location = path[len(path)-1]
-    print("@@@Edge is not part of the path? What the?")
-    return ([],[], -1)
-
-def find_best_path(paths, ijk):
-    """Returns the best path from a list of paths ([points], [visited], dead_ends)"""
-    best_path = ([],[],-1)
-    best_area = 0
-    for path in paths:
-        extrema = get_extrema(path[0])
-        # Check if ijk is likely contained within the path
-        if extrema[0] < ijk[0] < extrema[1] and extrema[2] < ijk[1] < extrema[3]:
-            # Create an over estimate of the approximate area of the path
-            area = (extrema[1]-extrema[0])*(extrema[3]-extrema[2])
-            if area > best_area:
-                best_path = path
-                best_area = area
-    return best_path
-        
-
-def get_extrema(list):
-    """Returns the max and min x and y values from a list of coordinate tuples in the form of (min_x, max_x, min_y, max_y)."""
-    max_x = max(list,key=lambda item:item[0])[0]
-    max_y = max(list,key=lambda item:item[1])[1]
-    min_x = min(list,key=lambda item:item[0])[0]
-    min_y = min(list,key=lambda item:item[1])[1]
-    return (min_x, max_x, min_y, max_y)
-
-def is_edge(location, hi, lo, bgArray):
-    """Return true is location is an edge pixel."""
-    offsets = [
-        (0,1),
-        (1,0),
-        (0,-1),
-        (-1,0)
-    ]
-    # Check that location is within threshold first
-    try:
-        b = fetch_val(bgArray, location)
-    except IndexError:
-        return False
-    if b < lo or b > hi:
-        return False
-    
-    # Check if its neighbors are outside the threshold
-    for offset in offsets:
-        tmp = (location[0] + offset[0], location[1] + offset[1])
-        try:
-            b = fetch_val(bgArray, tmp)
-        except IndexError:
-            return True
-        if b < lo or b > hi:
-            return True
-    return False
-
-def fetch_val(array, coordinate):
-    if coordinate[0] < 0 or coordinate[1] < 0:
-        raise IndexError
-    return array[coordinate]
+  def __init__(self, key, xyToIJK):
+    self.key = key
+    self.backgroundNode, self.labelNode, self.backgroundImage, self.labelImage = key[:4]
+    self.xyToIJK = xyToIJK
+    self.backgroundArray = volume_array(self.backgroundImage)
+    self.labelArray = volume_array(self.labelImage)
+    self.shape = list(self.backgroundArray.shape)
 
 
 #
@@ -0,0 +1,26 @@
+"""The TraceAndSelect algorithms, kept free of Slicer so they can also run headless.
+
+Slicer loads every .py file directly in qt-scripted-modules as a module, so
+everything the effect needs apart from its Slicer classes lives in this
+package instead.
+"""
+
+from .masks import (SliceMasks, SliceMaskCache, sliceMaskCache, ThresholdLevels, take_slice,
+                    prepared_masks, edge_distance_map, EDGE_DIRECTIONS, NO_EDGE)
+from .contour import Contour, as_contour
+from .tracing import (get_optional_seeds, gimme_a_path, smooth_path, find_edge, find_edges,
+                      build_path, find_best_path, is_edge, fetch_val,
+                      encloses, ContourIndex)
+from .tracking import TRACKING_BAND, track_path, dilate, box_overlap
+from .pyramid import downsample, upsample_contour, coarse_to_fine_path
+from .fill import (path_mask, get_extrema, path_enclosure, fill_region, scanline_region, breadth_first_region,
+                   Enclosure, TracedOutline)
+from .regions import RegionStats
+from .history import SliceEdit, VolumeEdit, EditGroup, LabelEditHistory, labelEditHistory
+from .propagation import (PLANE_AXES, SlicePropagator, SliceFill, propagate, slice_indexes,
+                          PropagationJob)
+from .instrumentation import StageStats, NoStats, noStats, debug, is_debug, set_debug
+from .batch import BatchRequest, BatchResult, batch_request, segment_batch
+from .tracepool import TracePool, SeedTraces, BitmapMasks, trace_pool, shared_bitmap, inside_slicer
+from .volumefill import VolumeFill, fill_volume, grow_region, fill_holes, volume_seeds, in_threshold, LookedAt
+from .volumes import open_volume, create_volume
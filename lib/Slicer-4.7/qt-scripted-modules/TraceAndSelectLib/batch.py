@@ -0,0 +1,80 @@
+"""Replaying many clicks on a volume in one call, without a slice view or parameter node."""
+
+import collections
+import timeit
+
+from .masks import SliceMaskCache
+from .propagation import PLANE_AXES, SlicePropagator, propagate, slice_indexes
+from .instrumentation import StageStats
+from .regions import RegionStats
+
+BatchRequest = collections.namedtuple('BatchRequest', 'ijk plane thresholds maxPixels label offset')
+
+
+def batch_request(ijk, plane, thresholds, maxPixels, label, offset=0):
+    """Make a BatchRequest; offset, the number of slices to propagate through, defaults to 0."""
+    return BatchRequest(tuple(ijk), plane, tuple(thresholds), maxPixels, label, offset)
+
+
+class BatchResult(object):
+    """What one request of segment_batch() did.
+
+    fills lists the SliceFill of each slice that was filled. error is None
+    if every slice was, and otherwise says why the request stopped.
+    stats holds the request's StageStats and seconds its wall time.
+    """
+
+    def __init__(self, request, fills, stats, seconds, error=None):
+        self.request = request
+        self.fills = fills
+        self.stats = stats
+        self.seconds = seconds
+        self.error = error
+
+    @property
+    def pixelsSet(self):
+        return sum(fill.pixelsSet for fill in self.fills)
+
+    @property
+    def region(self):
+        """The RegionStats of the request's fills together."""
+        return RegionStats.combine([fill.region for fill in self.fills], PLANE_AXES[self.request.plane])
+
+
+def segment_batch(backgroundArray, labelArray, requests, cache=None, cacheKey=(), tracePool=None):
+    """Trace and fill every request in turn, as a click would, writing into labelArray.
+
+    requests are BatchRequests or tuples (ijk, plane, thresholds, maxPixels,
+    label[, offset]). ijk is a voxel in IJK order, as Slicer reports it, of
+    arrays indexed [k, j, i]; plane is 'IJ', 'IK' or 'JK', and thresholds
+    is (lo, hi). Requests on a slice and threshold range already seen reuse
+    its masks from cache, a SliceMaskCache, keyed under cacheKey; a cache
+    of its own is used if none is given. If tracePool, a TracePool, is given
+    the seeds of each slice are traced on it. Returns a BatchResult per request.
+    """
+    if cache is None:
+        cache = SliceMaskCache()
+    results = []
+    for request in requests:
+        request = batch_request(*request)
+        stats = StageStats()
+        start = timeit.default_timer()
+        ijk = tuple(reversed(request.ijk))
+        if len(ijk) != 3 or not all(0 <= ijk[a] < backgroundArray.shape[a] for a in range(3)):
+            results.append(BatchResult(request, [], stats, 0.0, "voxel is outside the volume"))
+            continue
+        axis = PLANE_AXES[request.plane]
+        inPlane = [a for a in range(3) if a != axis]
+        point = (ijk[inPlane[0]], ijk[inPlane[1]])
+        lo, hi = request.thresholds
+        indexes = slice_indexes(ijk[axis], request.offset, backgroundArray.shape[axis])
+        propagator = SlicePropagator(backgroundArray, labelArray, axis, indexes, hi, lo,
+                                     cache=cache, cacheKey=cacheKey, stats=stats, tracePool=tracePool)
+        try:
+            fills = list(propagate(propagator, point, [], request.label, request.maxPixels))
+        finally:
+            propagator.close()
+        error = fills[-1].error if fills else None
+        results.append(BatchResult(request, [fill for fill in fills if fill.error is None], stats,
+                                   timeit.default_timer() - start, error))
+    return results
@@ -0,0 +1,279 @@
+"""Time the stages of tracing and filling on synthetic phantoms, without Slicer.
+
+Run from the qt-scripted-modules directory, for example
+
+    python -m TraceAndSelectLib.benchmark --sizes 128 256 512 --output bench.json
+
+Every stage is run --repeat times on each phantom and size, and the best and
+median wall clock times are reported together with the contour length and
+pixel counts of the result, so runs made before and after a change can be
+compared. build_path and fill are also timed as the original pixel-by-pixel
+code did them, in rows marked baseline, with same telling whether the two
+gave the same result; --no-baseline leaves those out. A wavy bone slice of
+--long-contour size, with an outline over 8000 pixels long at the default
+1100, is benchmarked too, as that is where tracing used to be slowest.
+Results are printed as a table and, with --output, written as JSON.
+"""
+
+import argparse
+import contextlib
+import json
+import os
+import platform
+import sys
+import time
+import timeit
+
+import numpy
+
+from .masks import SliceMasks, prepared_masks
+from .contour import Contour
+from .tracing import gimme_a_path, smooth_path, find_edges, build_path, find_best_path
+from .fill import path_mask, fill_region
+from .propagation import SlicePropagator, propagate
+from .volumefill import fill_volume
+from .pyramid import coarse_to_fine_path
+from . import phantoms, reference
+
+# Defaults of the effect's parameters
+SEED_DISTANCE = 200
+MAX_PIXELS = 25000
+# Shrink factors coarse to fine tracing is compared at
+PYRAMID_FACTORS = (2, 4)
+# Size of the wavy bone slice whose long contour is benchmarked on its own
+LONG_CONTOUR_SIZE = 1100
+
+
+@contextlib.contextmanager
+def quiet():
+    """Send the debugging output of the code being timed to os.devnull."""
+    stdout = sys.stdout
+    with open(os.devnull, 'w') as devnull:
+        sys.stdout = devnull
+        try:
+            yield
+        finally:
+            sys.stdout = stdout
+
+def timed(function, repeat, setup=None):
+    """Call function repeat times, each time with the arguments setup() returns, if given.
+
+    Only the calls are timed. Returns (times, result), result being what the
+    last call returned.
+    """
+    times = []
+    result = None
+    for i in range(repeat):
+        args = setup() if setup is not None else ()
+        with quiet():
+            start = timeit.default_timer()
+            result = function(*args)
+            times.append(timeit.default_timer() - start)
+    return (times, result)
+
+def record(phantom, stage, times, **counts):
+    """A result row for one stage."""
+    row = {
+        'phantom': phantom.name,
+        'shape': list(phantom.image.shape),
+        'stage': stage,
+        'repeat': len(times),
+        'best': min(times) if times else None,
+        'median': float(numpy.median(times)) if times else None,
+    }
+    row.update(counts)
+    return row
+
+def benchmark_slice(phantom, repeat, maxPixels=MAX_PIXELS, baseline=True):
+    """Time each stage of tracing and filling the 2D phantom. Returns a list of result rows.
+
+    With baseline, build_path and fill are timed a second time with the
+    original code in reference.
+    """
+    image, click, lo, hi = phantom.image, phantom.click, phantom.lo, phantom.hi
+    rows = []
+
+    times, masks = timed(prepared_masks, repeat, lambda: (image, hi, lo))
+    rows.append(record(phantom, 'masks', times, pixels=int(image.size)))
+
+    # A first click on the slice builds the edge distance maps of its lines;
+    # clicks after it only look them up
+    times, seeds = timed(find_edges, repeat,
+                         lambda: (click, SEED_DISTANCE, SliceMasks.fromMasks(hi, lo, masks.inThreshold, masks.edges)))
+    seeds = seeds or []
+    rows.append(record(phantom, 'find_edges', times, seeds=len(seeds)))
+    find_edges(click, SEED_DISTANCE, masks)
+    times, seeds = timed(find_edges, repeat, lambda: (click, SEED_DISTANCE, masks))
+    rows.append(record(phantom, 'find_edges cached', times, seeds=len(seeds or [])))
+
+    traces = []
+    for seed in seeds:
+        with quiet():
+            path = build_path(seed, masks)
+        if path[0]:
+            traces.append((seed, path))
+    raw = find_best_path([path for seed, path in traces], click)
+    if not raw[0]:
+        rows.append(record(phantom, 'build_path', [], error='no path'))
+        return rows
+    start = [seed for seed, path in traces if path is raw][0]
+    times, built = timed(build_path, repeat, lambda: (start, masks))
+    rows.append(record(phantom, 'build_path', times, contourLength=len(built[0]),
+                       visited=len(built[1]), deadEnds=built[2]))
+    if baseline:
+        times, original = timed(reference.build_path, repeat, lambda: (start, hi, lo, image))
+        rows.append(record(phantom, 'build_path baseline', times, contourLength=len(original[0]),
+                           visited=len(original[1]), deadEnds=original[2],
+                           same=(Contour(original[0]), Contour(original[1]), original[2]) ==
+                                (Contour(built[0]), Contour(built[1]), built[2])))
+
+    times, smoothed = timed(smooth_path, repeat, lambda: (raw, hi, lo, image))
+    rows.append(record(phantom, 'smooth_path', times, contourLength=len(raw[0]),
+                       added=len(smoothed[1]) - len(raw[1])))
+
+    times, traced = timed(gimme_a_path, repeat, lambda: (click, SEED_DISTANCE, hi, lo, image, [],
+                                                         SliceMasks(image, hi, lo)))
+    best_path, visited, dead_ends = traced
+    rows.append(record(phantom, 'gimme_a_path', times, seeds=len(seeds),
+                       contourLength=len(best_path), visited=len(visited), deadEnds=dead_ends))
+    if not best_path:
+        return rows
+
+    # Coarse to fine tracing, checked against the full size outline by the
+    # pixels the two fills label differently
+    fullLabels = filled_labels(image, click, traced, maxPixels)
+    for factor in PYRAMID_FACTORS:
+        times, refined = timed(coarse_to_fine_path, repeat, lambda: (click, SEED_DISTANCE, hi, lo, image, factor))
+        stage = 'coarse_to_fine x%d' % factor
+        if refined is None:
+            rows.append(record(phantom, stage, times, error='no path'))
+            continue
+        labels = filled_labels(image, click, refined, maxPixels)
+        if labels is None or fullLabels is None:
+            rows.append(record(phantom, stage, times, error='out of bounds'))
+            continue
+        both = int((labels & fullLabels).sum())
+        rows.append(record(phantom, stage, times, contourLength=len(refined[0]),
+                           pixelsDiffering=int((labels != fullLabels).sum()),
+                           dice=round(2.0 * both / (labels.sum() + fullLabels.sum()), 4)))
+
+    barrier = path_mask(best_path, image.shape)
+    def fill_setup():
+        labelArray = numpy.zeros(image.shape, dtype=numpy.int16)
+        labelArray[visited.rows, visited.cols] = 1
+        return (labelArray, click, best_path, 1, maxPixels, barrier)
+    times, filled = timed(fill_region, repeat, fill_setup)
+    if filled is None:
+        rows.append(record(phantom, 'fill', times, error='out of bounds'))
+    else:
+        rows.append(record(phantom, 'fill', times, maxPixels=maxPixels, pixelsSet=filled[0],
+                           count=filled[2]))
+    if baseline:
+        times, original = timed(reference.fill, repeat, lambda: fill_setup()[:5])
+        same = (original is None) == (filled is None) and (original is None or tuple(filled) == original)
+        if original is None:
+            rows.append(record(phantom, 'fill baseline', times, error='out of bounds', same=same))
+        else:
+            rows.append(record(phantom, 'fill baseline', times, maxPixels=maxPixels, pixelsSet=original[0],
+                               count=original[2], same=same))
+    return rows
+
+def filled_labels(image, click, traced, maxPixels):
+    """The pixels a click would label with the traced (path, visited, dead_ends), or None if the fill leaks."""
+    labelArray = numpy.zeros(image.shape, dtype=numpy.int16)
+    labelArray[traced[1].rows, traced[1].cols] = 1
+    with quiet():
+        if fill_region(labelArray, click, traced[0], 1, maxPixels) is None:
+            return None
+    return labelArray > 0
+
+def benchmark_volume(phantom, repeat, maxPixels=MAX_PIXELS):
+    """Time filling every slice of the 3D phantom from its click, slice by slice, tracking and in 3D. Returns a list of result rows."""
+    image, click, lo, hi = phantom.image, phantom.click, phantom.lo, phantom.hi
+    indexes = range(click[0], image.shape[0])
+
+    rows = []
+    labelArrays = {}
+    for stage, tracking in (('propagate', False), ('propagate tracked', True)):
+        def run(labelArray):
+            propagator = SlicePropagator(image, labelArray, 0, indexes, hi, lo, tracking=tracking)
+            try:
+                return (list(propagate(propagator, click[1:], [], 1, maxPixels)), labelArray)
+            finally:
+                propagator.close()
+        times, (results, labelArrays[stage]) = timed(run, repeat,
+                                                     lambda: (numpy.zeros(image.shape, dtype=numpy.int16),))
+        filled = [result for result in results if result.error is None]
+        row = record(phantom, stage, times, slices=len(indexes), slicesFilled=len(filled),
+                     pixelsSet=sum(result.pixelsSet for result in filled))
+        if tracking:
+            # Pixels labelled differently from the fill that seeds every slice in full
+            row['pixelsDiffering'] = int((labelArrays[stage] != labelArrays['propagate']).sum())
+        if len(filled) < len(results):
+            row['error'] = results[-1].error
+        rows.append(row)
+
+    # The same slices filled in one go by the 3D fill mode
+    bounds = (click[0], image.shape[0])
+    def fill(labelArray):
+        return fill_volume(image, labelArray, click, 0, hi, lo, 1, image.size, bounds)
+    times, result = timed(fill, repeat, lambda: (numpy.zeros(image.shape, dtype=numpy.int16),))
+    row = record(phantom, 'fill_volume', times, voxelsSet=result.voxelsSet)
+    if result.error is not None:
+        row['error'] = result.error
+    rows.append(row)
+    return rows
+
+def run(sizes=(128, 256, 512), slices=20, repeat=3, baseline=True, longContour=LONG_CONTOUR_SIZE):
+    """Benchmark every phantom at every size, and the wavy bone slice at size longContour unless it is 0.
+
+    Returns the results as a JSON-ready dictionary.
+    """
+    rows = []
+    for size in sizes:
+        for generator in phantoms.SLICES:
+            rows.extend(benchmark_slice(generator(size), repeat, baseline=baseline))
+        for generator in phantoms.VOLUMES:
+            rows.extend(benchmark_volume(generator(size, slices), repeat))
+    if longContour:
+        rows.extend(benchmark_slice(phantoms.wavy_bone_slice(longContour), repeat, baseline=baseline))
+    return {
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'numpy': numpy.__version__,
+        'platform': platform.platform(),
+        'results': rows,
+    }
+
+def print_table(results, out=sys.stdout):
+    out.write('%-15s %-13s %-19s %10s %10s  %s\n' % ('phantom', 'shape', 'stage', 'best ms', 'median ms', 'details'))
+    for row in results['results']:
+        details = ', '.join('%s=%s' % (key, row[key]) for key in sorted(row)
+                            if key not in ('phantom', 'shape', 'stage', 'repeat', 'best', 'median'))
+        out.write('%-15s %-13s %-19s %10.2f %10.2f  %s\n' % (
+            row['phantom'], 'x'.join(str(n) for n in row['shape']), row['stage'],
+            (row['best'] or 0) * 1000, (row['median'] or 0) * 1000, details))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[128, 256, 512],
+                        help='slice sizes in pixels (default: 128 256 512)')
+    parser.add_argument('--slices', type=int, default=20,
+                        help='number of slices in the volume phantoms (default: 20)')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='times each stage is run (default: 3)')
+    parser.add_argument('--no-baseline', dest='baseline', action='store_false',
+                        help='do not time the original build_path and fill')
+    parser.add_argument('--long-contour', type=int, default=LONG_CONTOUR_SIZE,
+                        help='size of the wavy bone slice, 0 to leave it out (default: %d)' % LONG_CONTOUR_SIZE)
+    parser.add_argument('--output', help='write the results to this JSON file')
+    args = parser.parse_args(argv)
+    results = run(args.sizes, args.slices, args.repeat, args.baseline, args.long_contour)
+    print_table(results)
+    if args.output:
+        with open(args.output, 'w') as out:
+            json.dump(results, out, indent=1, sort_keys=True)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,141 @@
+"""Traced paths of pixels kept as coordinate arrays."""
+
+import numpy
+
+# Row and column steps of the eight chain codes, counter-clockwise from (0, 1)
+CHAIN_STEPS = numpy.array([(0, 1), (-1, 1), (-1, 0), (-1, -1), (0, -1), (1, -1), (1, 0), (1, 1)],
+                          dtype=numpy.int32)
+# Code of each step, indexed by (row step + 1) * 3 + column step + 1
+CHAIN_CODES = numpy.array([3, 2, 1, 4, 255, 0, 5, 6, 7], dtype=numpy.uint8)
+
+
+def as_contour(path):
+    """Return path as a Contour, converting a list of (row, col) tuples."""
+    return path if isinstance(path, Contour) else Contour(path)
+
+
+class Contour(object):
+    """A path of pixels as an (n, 2) int32 array of (row, col), about 8 bytes a pixel.
+
+    Geometry is computed on the whole array at once. A Contour is a sequence
+    of (row, col) tuples as well, so code written for lists of pixels still
+    works with it, though more slowly.
+    """
+
+    def __init__(self, points=()):
+        self.points = numpy.array(points, dtype=numpy.int32).reshape(-1, 2)
+        self._extrema = None
+
+    @classmethod
+    def fromFlat(cls, indexes, width, pad=0):
+        """Make a Contour from flat indices into an array of the given width, padded by pad pixels."""
+        indexes = numpy.array(indexes, dtype=numpy.int64)
+        contour = cls.__new__(cls)
+        contour.points = numpy.empty((len(indexes), 2), dtype=numpy.int32)
+        contour.points[:, 0] = indexes // width - pad
+        contour.points[:, 1] = indexes % width - pad
+        contour._extrema = None
+        return contour
+
+    @classmethod
+    def fromChainCode(cls, start, codes):
+        """Make a Contour from its first pixel and the chain codes of the steps after it."""
+        steps = CHAIN_STEPS[numpy.asarray(codes, dtype=numpy.intp)]
+        points = numpy.empty((len(steps) + 1, 2), dtype=numpy.int32)
+        points[0] = start
+        numpy.cumsum(steps, axis=0, out=points[1:])
+        points[1:] += points[0]
+        return cls(points)
+
+    def __len__(self):
+        return len(self.points)
+
+    def __iter__(self):
+        return iter(map(tuple, self.points.tolist()))
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return Contour(self.points[index])
+        return tuple(self.points[index].tolist())
+
+    def __eq__(self, other):
+        if not isinstance(other, Contour):
+            other = Contour(other)
+        return numpy.array_equal(self.points, other.points)
+
+    def __ne__(self, other):
+        return not self == other
+
+    __hash__ = None
+
+    def __repr__(self):
+        return 'Contour(%r)' % (self.tolist(),)
+
+    def tolist(self):
+        return [tuple(point) for point in self.points.tolist()]
+
+    @property
+    def rows(self):
+        return self.points[:, 0]
+
+    @property
+    def cols(self):
+        return self.points[:, 1]
+
+    @property
+    def nbytes(self):
+        return self.points.nbytes
+
+    def shifted(self, offset):
+        """A new Contour of these pixels moved by offset, a (row, col) pair."""
+        return Contour(self.points + numpy.array(offset, dtype=numpy.int32))
+
+    def concatenate(self, points):
+        """A new Contour of these pixels followed by points, an (n, 2) array."""
+        return Contour(numpy.concatenate((self.points, numpy.asarray(points, dtype=numpy.int32).reshape(-1, 2))))
+
+    def extrema(self):
+        """(min_row, max_row, min_col, max_col), as get_extrema() returns them."""
+        if self._extrema is None:
+            low = self.points.min(axis=0)
+            high = self.points.max(axis=0)
+            self._extrema = (int(low[0]), int(high[0]), int(low[1]), int(high[1]))
+        return self._extrema
+
+    def centroid(self):
+        """Mean (row, col) of the pixels."""
+        return tuple(self.points.mean(axis=0).tolist())
+
+    def area(self):
+        """Area of the polygon through the pixel centres, by the shoelace formula."""
+        if len(self.points) < 3:
+            return 0.0
+        rows = self.points[:, 0].astype(numpy.float64)
+        cols = self.points[:, 1].astype(numpy.float64)
+        return abs(numpy.dot(rows, numpy.roll(cols, -1)) - numpy.dot(cols, numpy.roll(rows, -1))) / 2.0
+
+    def mask(self, shape, offset=(0, 0)):
+        """Rasterize the pixels into a boolean array of the given shape, less offset (row, col)."""
+        mask = numpy.zeros(shape, dtype=bool)
+        if len(self.points):
+            mask[self.points[:, 0] - offset[0], self.points[:, 1] - offset[1]] = True
+        return mask
+
+    def flat(self, width):
+        """Flat indices of the pixels into an array of the given width."""
+        return self.points[:, 0].astype(numpy.int64) * width + self.points[:, 1]
+
+    def chainCode(self):
+        """Return (start, codes): the first pixel and the uint8 chain code of each step after it.
+
+        Raises ValueError if two pixels in a row are not 8-neighbours.
+        """
+        if not len(self.points):
+            raise ValueError("an empty contour has no chain code")
+        steps = numpy.diff(self.points, axis=0)
+        if len(steps) and numpy.abs(steps).max() > 1:
+            raise ValueError("the contour has a gap")
+        codes = CHAIN_CODES[(steps[:, 0] + 1) * 3 + steps[:, 1] + 1]
+        if (codes == 255).any():
+            raise ValueError("the contour repeats a pixel")
+        return (tuple(self.points[0].tolist()), codes)
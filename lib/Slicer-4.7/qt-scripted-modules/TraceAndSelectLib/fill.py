@@ -0,0 +1,293 @@
+"""Filling the inside of a traced outline."""
+
+import numpy
+
+from .contour import as_contour
+
+def path_mask(path, shape):
+    """Rasterize a Contour or list of (row, col) pixels into a boolean array of the given shape."""
+    return as_contour(path).mask(shape)
+
+def get_extrema(list):
+    """Returns the max and min x and y values from a Contour or list of coordinate tuples in the form of (min_x, max_x, min_y, max_y)."""
+    return as_contour(list).extrema()
+
+def path_enclosure(path, point, barrier=None):
+    """Return the Enclosure of path around point, or None if point is off the path and not strictly inside its bounding box.
+
+    The inside is found by a 4-connected fill from point within the bounding
+    box, with the path pixels as the barrier, so the test is exact. barrier
+    may be given as the already rasterized path_mask of path.
+    """
+    if not path:
+        return None
+    path = as_contour(path)
+    extrema = path.extrema()
+    if not (extrema[0] <= point[0] <= extrema[1] and extrema[2] <= point[1] <= extrema[3]):
+        return None
+    box = (slice(extrema[0], extrema[1] + 1), slice(extrema[2], extrema[3] + 1))
+    if barrier is not None:
+        barrierBox = barrier[box]
+    else:
+        barrierBox = path.mask((extrema[1] - extrema[0] + 1, extrema[3] - extrema[2] + 1),
+                               (extrema[0], extrema[2]))
+    seed = (point[0] - extrema[0] - 1, point[1] - extrema[2] - 1)
+    if barrierBox[seed[0] + 1, seed[1] + 1]:
+        return Enclosure(extrema, box, barrierBox, seed, None, False)
+    if not (extrema[0] < point[0] < extrema[1] and extrema[2] < point[1] < extrema[3]):
+        return None
+    region, leaked = scanline_region(barrierBox, seed)
+    return Enclosure(extrema, box, barrierBox, seed, region, leaked)
+
+def fill_region(labelArray, fill_point, best_path, label, maxPixels, barrier=None, enclosure=None):
+    """Set label on every pixel enclosed by best_path that is 4-connected to fill_point.
+
+    Existing labels are painted over, and the path pixels themselves are the
+    barrier. Reaching a pixel on or outside the path's bounding box means the
+    path does not enclose fill_point: nothing is written and None is returned.
+    Once more than maxPixels unlabelled pixels have been set the fill stops,
+    keeping the pixels a breadth-first fill from fill_point would have reached.
+    barrier may be given as the already rasterized path_mask of best_path,
+    and enclosure as its path_enclosure() around fill_point, which saves
+    filling it again.
+    Returns (pixelsSet, mean, count): the number of pixels that changed, and
+    the centroid sums of the pixels carrying label the fill reached, as the
+    original pixel-by-pixel fill kept them. That fill counted a pixel each
+    time it took it off its queue carrying label, so mean is the sum of the
+    coordinates of those visits and count their number; propagation seeds
+    the next slice from mean / count.
+    """
+    if fill_point[0] < 0 or fill_point[1] < 0 or \
+       fill_point[0] >= labelArray.shape[0] or fill_point[1] >= labelArray.shape[1]:
+        return (0, (0, 0), 0)
+    if enclosure is None:
+        enclosure = path_enclosure(best_path, fill_point, barrier)
+        if enclosure is None:
+            return None
+    if enclosure.onPath:
+        if labelArray[fill_point] == label:
+            return (0, tuple(fill_point), 1)
+        return (0, (0, 0), 0)
+    # Everything happens inside the path's bounding box; its outer ring is
+    # where a leaking fill would step out of bounds
+    extrema = enclosure.extrema
+    box = enclosure.box
+    barrierBox = enclosure.barrierBox
+    labelBox = labelArray[box]
+    seed = enclosure.seed
+    region = enclosure.region
+    labelled = labelBox == label
+    unlabelled = region & ~labelled[1:-1, 1:-1]
+    if unlabelled.sum() > maxPixels:
+        # The cap cuts the region short, so which pixels get set, and how
+        # often each is visited, depends on the order they are reached in
+        reached = breadth_first_region(barrierBox, labelBox, seed, label, maxPixels)
+        if reached is None:
+            return None
+        region, visits = reached
+        unlabelled = region & ~labelled[1:-1, 1:-1]
+    elif enclosure.leaked:
+        return None
+    else:
+        visits = queue_visits(region, barrierBox, labelled, seed)
+    pixelsSet = int(unlabelled.sum())
+    labelBox[1:-1, 1:-1][region] = label
+
+    rows, cols = numpy.nonzero(visits)
+    weights = visits[rows, cols].astype(numpy.int64)
+    count = int(weights.sum())
+    mean = (int((rows * weights).sum()) + count * extrema[0], int((cols * weights).sum()) + count * extrema[2])
+    return (pixelsSet, mean, count)
+
+def queue_visits(region, barrierBox, labelled, seed):
+    """How many times the pixel-by-pixel fill of region took each pixel of the box off its queue carrying label.
+
+    region is the inside filled from seed, as scanline_region() found it,
+    and labelled marks the pixels of the box carrying label before the fill.
+    Every time the fill took a pixel inside the path off its queue it put
+    the pixel's 4 neighbours on, once for a pixel carrying label and twice
+    for one it painted, which it took off again carrying label; an
+    unlabelled pixel taken off only once was painted but not gone over again.
+    Pixels of the path are never gone over, so they are counted only if they
+    carry label. Without a cap every pixel put on the queue is taken off, so
+    the counts follow from the region alone.
+    """
+    inside = numpy.zeros(barrierBox.shape, dtype=bool)
+    inside[1:-1, 1:-1] = region
+    start = numpy.zeros(barrierBox.shape, dtype=numpy.int8)
+    start[seed[0] + 1, seed[1] + 1] = 1
+    # A painted pixel goes over its neighbours twice once it is queued
+    # twice, which most are; settle the few that are not. No pixel is
+    # queued more than 9 times, so small integers will do
+    once = inside.view(numpy.int8)
+    expansions = once
+    while True:
+        queued = start.copy()
+        queued[1:, :] += expansions[:-1, :]
+        queued[:-1, :] += expansions[1:, :]
+        queued[:, 1:] += expansions[:, :-1]
+        queued[:, :-1] += expansions[:, 1:]
+        settled = once + (inside & ~labelled & (queued >= 2))
+        if numpy.array_equal(settled, expansions):
+            break
+        expansions = settled
+    visits = numpy.where(inside, queued - ~labelled, 0).astype(numpy.int8)
+    visits[barrierBox & labelled] = queued[barrierBox & labelled]
+    return visits
+
+def scanline_region(barrierBox, seed):
+    """Return (region, leaked) for a 4-connected fill of the inside of barrierBox from seed.
+
+    The fill runs over horizontal spans of non-barrier pixels in the interior
+    of the box (everything but its outer ring); region is a boolean array the
+    shape of that interior. leaked is True if the region touches a
+    non-barrier pixel of the outer ring.
+    """
+    inside = ~barrierBox[1:-1, 1:-1]
+    height, width = inside.shape
+    padded = numpy.zeros((height, width + 2), dtype=numpy.int8)
+    padded[:, 1:-1] = inside
+    steps = numpy.diff(padded, axis=1)
+    runRows, runStarts = numpy.nonzero(steps == 1)
+    runEnds = numpy.nonzero(steps == -1)[1]
+    firstRun = numpy.searchsorted(runRows, numpy.arange(height + 1)).tolist()
+    runRows = runRows.tolist()
+    runStarts = runStarts.tolist()
+    runEnds = runEnds.tolist()
+
+    row, col = seed
+    start = firstRun[row]
+    while runEnds[start] <= col:
+        start += 1
+    filled = bytearray(len(runStarts))
+    filled[start] = 1
+    toVisit = [start]
+    region = numpy.zeros((height, width), dtype=bool)
+    leaked = False
+    while toVisit:
+        run = toVisit.pop()
+        row = runRows[run]
+        first = runStarts[run]
+        end = runEnds[run]
+        region[row, first:end] = True
+        if not leaked:
+            # The ring pixel beyond a span or row at the edge of the interior
+            leaked = (first == 0 and not barrierBox[row + 1, 0]) or \
+                     (end == width and not barrierBox[row + 1, -1]) or \
+                     (row == 0 and not barrierBox[0, first + 1:end + 1].all()) or \
+                     (row == height - 1 and not barrierBox[-1, first + 1:end + 1].all())
+        for other in (row - 1, row + 1):
+            if other < 0 or other >= height:
+                continue
+            # Spans of the neighbouring row that overlap this one
+            for candidate in range(firstRun[other], firstRun[other + 1]):
+                if runStarts[candidate] >= end:
+                    break
+                if runEnds[candidate] > first and not filled[candidate]:
+                    filled[candidate] = 1
+                    toVisit.append(candidate)
+    return (region, leaked)
+
+def breadth_first_region(barrierBox, labelBox, seed, label, maxPixels):
+    """Return (region, visits): the part of the inside of barrierBox a breadth-first fill from seed reaches before the cap.
+
+    The queue of the original pixel-by-pixel fill is replayed, stopping at
+    the pixel that takes the number of unlabelled pixels past maxPixels.
+    visits counts, for each pixel of the box, the times it was taken off the
+    queue carrying label, as queue_visits() does without a cap. Returns None
+    if a non-barrier pixel of the outer ring is reached first.
+
+    The queue is first in, first out, so it is replayed a generation at a
+    time: the entries the previous generation put on it, in order. What the
+    fill did with an entry depends only on whether its pixel carries label
+    and how many times the pixel was taken off before.
+    """
+    height, width = labelBox.shape
+    inside = ~barrierBox.ravel()
+    ring = numpy.ones(labelBox.shape, dtype=bool)
+    ring[1:-1, 1:-1] = False
+    ring = ring.ravel() & inside
+    labelled = (labelBox == label).ravel()
+    offsets = numpy.array([-width, width, -1, 1])
+    taken = numpy.zeros(height * width, dtype=numpy.int64)
+    painted = []
+    counted = []
+    pixelsSet = 0
+    queue = numpy.array([(seed[0] + 1) * width + seed[1] + 1])
+    while len(queue):
+        # The times each entry's pixel was taken off before it: in earlier
+        # generations, and earlier in this one
+        order = numpy.argsort(queue, kind='mergesort')
+        ordered = queue[order]
+        starts = numpy.flatnonzero(numpy.r_[True, ordered[1:] != ordered[:-1]])
+        repeats = numpy.diff(numpy.r_[starts, len(queue)])
+        rank = numpy.empty(len(queue), dtype=numpy.int64)
+        rank[order] = numpy.arange(len(queue)) - numpy.repeat(starts, repeats)
+        times = taken[queue] + rank
+        carrying = labelled[queue]
+        within = inside[queue]
+        # An unlabelled pixel is painted and gone over the first time it is
+        # taken off, and gone over again the second; a labelled one once
+        paints = within & ~ring[queue] & ~carrying & (times == 0)
+        expands = within & ((~carrying & (times <= 1)) | (carrying & (times == 0)))
+        total = numpy.cumsum(paints) + pixelsSet
+        over = numpy.flatnonzero(total > maxPixels)
+        stop = over[0] if len(over) else len(queue)
+        if (expands[:stop] & ring[queue[:stop]]).any():
+            return None
+        counted.append(queue[:stop][(carrying | (within & (times > 0)))[:stop]])
+        painted.append(queue[:stop + 1][paints[:stop + 1]])
+        if stop < len(queue):
+            break
+        pixelsSet = total[-1]
+        taken[ordered[starts]] += repeats
+        queue = (queue[expands][:, numpy.newaxis] + offsets).ravel()
+    region = numpy.zeros(height * width, dtype=bool)
+    region[numpy.concatenate(painted)] = True
+    visits = numpy.bincount(numpy.concatenate(counted), minlength=height * width)
+    return (region.reshape(height, width)[1:-1, 1:-1], visits.reshape(height, width))
+
+class Enclosure(object):
+    """The inside of a path around a point, as found by path_enclosure().
+
+    extrema are the path's (min_row, max_row, min_col, max_col), box the
+    slices of its bounding box and barrierBox the path rasterized in that
+    box. region is the boolean inside of the box, minus its outer ring,
+    reached from seed, the point in region's coordinates; leaked is True if
+    the fill got out to the ring, so the path does not enclose the point.
+    onPath is True, and region None, if the point is on the path itself.
+    """
+
+    def __init__(self, extrema, box, barrierBox, seed, region, leaked):
+        self.extrema = extrema
+        self.box = box
+        self.barrierBox = barrierBox
+        self.seed = seed
+        self.region = region
+        self.leaked = leaked
+        self.onPath = region is None
+        self._area = None
+
+    @property
+    def area(self):
+        """The number of pixels inside the path, not counting the path itself."""
+        if self._area is None:
+            self._area = 0 if self.region is None else int(self.region.sum())
+        return self._area
+
+
+class TracedOutline(object):
+    """An outline traced on one slice, kept so that it can be filled later without tracing again.
+
+    path and visited are the Contours gimme_a_path() returns; barrier is path
+    rasterized to the slice shape for fill_region(); point is where the fill
+    starts. axis and index locate the slice in the volume.
+    """
+
+    def __init__(self, axis, index, point, path, visited, shape):
+        self.axis = axis
+        self.index = index
+        self.point = point
+        self.path = as_contour(path)
+        self.visited = as_contour(visited)
+        self.barrier = self.path.mask(shape)
@@ -0,0 +1,174 @@
+"""Undo history of the slice edits made by fills."""
+
+import numpy
+
+from .masks import take_slice
+
+
+class SliceEdit(object):
+    """The pixels of one slice changed by an edit, with their values before and after it.
+
+    volumeKey identifies the label volume, and axis and index the slice in
+    it. Only changed pixels are kept, as flat indices into the slice.
+    """
+
+    def __init__(self, volumeKey, axis, index, before, after):
+        self.volumeKey = volumeKey
+        self.axis = axis
+        self.index = index
+        self.shape = before.shape
+        changed = numpy.flatnonzero(before != after)
+        self.pixels = changed.astype(numpy.int32 if before.size < 2**31 else numpy.int64)
+        self.before = before.ravel()[changed]
+        self.after = numpy.asarray(after).ravel()[changed]
+
+    def __len__(self):
+        return len(self.pixels)
+
+    @property
+    def nbytes(self):
+        return self.pixels.nbytes + self.before.nbytes + self.after.nbytes
+
+    def revert(self, labelArray):
+        """Put the old values back into the 3D labelArray."""
+        take_slice(labelArray, self.axis, self.index)[numpy.unravel_index(self.pixels, self.shape)] = self.before
+
+    def reapply(self, labelArray):
+        """Write the edited values into the 3D labelArray again."""
+        take_slice(labelArray, self.axis, self.index)[numpy.unravel_index(self.pixels, self.shape)] = self.after
+
+class VolumeEdit(object):
+    """The voxels of a block of a 3D label volume changed by an edit, with their values before and after it.
+
+    Stands in for a SliceEdit when one edit spans many slices. box is the
+    tuple of slices giving the block; only changed voxels are kept, as flat
+    indices into it.
+    """
+
+    def __init__(self, volumeKey, box, before, after):
+        self.volumeKey = volumeKey
+        self.box = box
+        self.shape = before.shape
+        changed = numpy.flatnonzero(before != after)
+        self.pixels = changed.astype(numpy.int32 if before.size < 2**31 else numpy.int64)
+        self.before = before.ravel()[changed]
+        self.after = numpy.asarray(after).ravel()[changed]
+
+    def __len__(self):
+        return len(self.pixels)
+
+    @property
+    def nbytes(self):
+        return self.pixels.nbytes + self.before.nbytes + self.after.nbytes
+
+    def revert(self, labelArray):
+        """Put the old values back into the 3D labelArray."""
+        labelArray[self.box].flat[self.pixels] = self.before
+
+    def reapply(self, labelArray):
+        """Write the edited values into the 3D labelArray again."""
+        labelArray[self.box].flat[self.pixels] = self.after
+
+class EditGroup(object):
+    """The SliceEdits of one click, undone and redone together as one step.
+
+    A multi-slice fill adds the edit of each slice as it lands, so a single
+    undo takes back every slice the click filled.
+    """
+
+    def __init__(self, volumeKey):
+        self.volumeKey = volumeKey
+        self.edits = []
+
+    def add(self, edit):
+        if len(edit):
+            self.edits.append(edit)
+
+    def __len__(self):
+        return sum(len(edit) for edit in self.edits)
+
+    @property
+    def nbytes(self):
+        return sum(edit.nbytes for edit in self.edits)
+
+    def revert(self, labelArray):
+        """Put the old values back into the 3D labelArray, the last slice filled first."""
+        for edit in reversed(self.edits):
+            edit.revert(labelArray)
+
+    def reapply(self, labelArray):
+        """Write the edited values into the 3D labelArray again."""
+        for edit in self.edits:
+            edit.reapply(labelArray)
+
+class LabelEditHistory(object):
+    """Undo and redo stacks of EditGroups, VolumeEdits and SliceEdits, kept within maxBytes of memory.
+
+    When recording an edit goes over budget the oldest undoable edits are
+    dropped.
+    """
+
+    def __init__(self, maxBytes=64 * 2**20):
+        self.maxBytes = maxBytes
+        self.undoStack = []
+        self.redoStack = []
+
+    @property
+    def nbytes(self):
+        return sum(edit.nbytes for edit in self.undoStack) + sum(edit.nbytes for edit in self.redoStack)
+
+    def record(self, edit):
+        """Push an edit, clearing the redo stack.
+
+        Returns the list of edits dropped to stay within budget, or None if
+        the edit changed nothing and was not recorded.
+        """
+        if not len(edit):
+            return None
+        self.undoStack.append(edit)
+        self.redoStack = []
+        nbytes = self.nbytes
+        evicted = []
+        while nbytes > self.maxBytes and len(self.undoStack) > 1:
+            oldest = self.undoStack.pop(0)
+            nbytes -= oldest.nbytes
+            evicted.append(oldest)
+        return evicted
+
+    def undo(self, labelArrayFor, edit=None):
+        """Revert the latest edit in the array labelArrayFor(edit.volumeKey) returns. Returns the edit, or None.
+
+        If edit is given, that edit is reverted wherever it is on the undo
+        stack instead; None is returned if it is not there.
+        """
+        return self._move(self.undoStack, self.redoStack, labelArrayFor, 'revert', edit)
+
+    def redo(self, labelArrayFor, edit=None):
+        """Re-apply the latest undone edit, or edit wherever it is on the redo stack. Returns the edit, or None."""
+        return self._move(self.redoStack, self.undoStack, labelArrayFor, 'reapply', edit)
+
+    def _move(self, source, target, labelArrayFor, method, edit=None):
+        if edit is not None:
+            positions = [position for position, other in enumerate(source) if other is edit]
+            if not positions:
+                return None
+            source.pop(positions[-1])
+            labelArray = labelArrayFor(edit.volumeKey)
+            if labelArray is None:
+                return None
+            getattr(edit, method)(labelArray)
+            target.append(edit)
+            return edit
+        while source:
+            edit = source.pop()
+            labelArray = labelArrayFor(edit.volumeKey)
+            if labelArray is None:
+                # The volume is gone, so the edit is of no use any more
+                continue
+            getattr(edit, method)(labelArray)
+            target.append(edit)
+            return edit
+        return None
+
+# Shared by every logic instance so edits can be undone after the click that made them
+labelEditHistory = LabelEditHistory()
@@ -0,0 +1,133 @@
+"""Wall times and work counts of the stages of a click, and the switch for debugging output."""
+
+import collections
+import sys
+import timeit
+
+# Debugging output is off unless set_debug() turns it on
+debugging = False
+
+
+def set_debug(enabled):
+    """Turn the output of debug() on or off."""
+    global debugging
+    debugging = bool(enabled)
+
+def is_debug():
+    """True if debugging output is on."""
+    return debugging
+
+def debug(*args):
+    """Print args separated by spaces if debugging is on.
+
+    Pass values rather than formatted strings, so nothing is formatted while
+    debugging is off. The arguments themselves are still worked out, so
+    put a debug() call whose arguments take work, such as a lookup or a
+    call into VTK, under "if is_debug():".
+    """
+    if debugging:
+        sys.stdout.write(' '.join(str(arg) for arg in args) + '\n')
+
+
+class StageStats(object):
+    """Wall time spent in each stage of a click, and totals of the work done.
+
+    times maps a stage to the seconds spent in it and calls to the number of
+    times it ran; counts maps a kind of work (seeds tried, pixels visited,
+    dead ends...) to its total, and values holds the latest value of other
+    results, such as the threshold a trace used. Stages are timed with
+
+        with stats.stage('trace'):
+            ...
+
+    and may nest, in which case the outer stage includes the inner ones.
+    """
+
+    def __init__(self):
+        self.times = collections.OrderedDict()
+        self.calls = collections.OrderedDict()
+        self.counts = collections.OrderedDict()
+        self.values = collections.OrderedDict()
+
+    def stage(self, name):
+        return _Stage(self, name)
+
+    def add(self, name, count=1):
+        """Add count to the total of name."""
+        self.counts[name] = self.counts.get(name, 0) + count
+
+    def set(self, name, value):
+        self.values[name] = value
+
+    def addTime(self, name, seconds):
+        self.times[name] = self.times.get(name, 0.0) + seconds
+        self.calls[name] = self.calls.get(name, 0) + 1
+
+    def asDict(self):
+        return {'times': dict(self.times), 'calls': dict(self.calls), 'counts': dict(self.counts),
+                'values': dict(self.values)}
+
+    def summary(self):
+        """One line per stage with its time in milliseconds, then a line of counts and one of values."""
+        lines = []
+        for name, seconds in self.times.items():
+            calls = self.calls[name]
+            line = '%s: %.1f ms' % (name, seconds * 1000)
+            if calls > 1:
+                line += ' (%d runs)' % calls
+            lines.append(line)
+        if self.counts:
+            lines.append(', '.join('%s %d' % (name, count) for name, count in self.counts.items()))
+        if self.values:
+            lines.append(', '.join('%s %s' % (name, value) for name, value in self.values.items()))
+        return '\n'.join(lines)
+
+
+class _Stage(object):
+    """Context manager adding the time spent in its block to a stage of a StageStats."""
+
+    __slots__ = ('stats', 'name', 'start')
+
+    def __init__(self, stats, name):
+        self.stats = stats
+        self.name = name
+
+    def __enter__(self):
+        self.start = timeit.default_timer()
+        return self
+
+    def __exit__(self, *exc):
+        self.stats.addTime(self.name, timeit.default_timer() - self.start)
+        return False
+
+
+class _NoStage(object):
+    """Context manager that does nothing, for code run without stats."""
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+class NoStats(object):
+    """Stands in for a StageStats when nothing is to be recorded, at the cost of a method call."""
+
+    _stage = _NoStage()
+
+    def stage(self, name):
+        return self._stage
+
+    def add(self, name, count=1):
+        pass
+
+    def set(self, name, value):
+        pass
+
+    def addTime(self, name, seconds):
+        pass
+
+noStats = NoStats()
@@ -0,0 +1,233 @@
+"""Threshold and edge masks of background slices, and the cache they are kept in."""
+
+import collections
+
+import numpy
+
+
+def take_slice(array, axis, index):
+    """Return the 2D view of a 3D array at index along axis."""
+    key = [slice(None)] * array.ndim
+    key[axis] = index
+    return array[tuple(key)]
+
+def prepared_masks(bgArray, hi, lo):
+    """Build the SliceMasks of bgArray with its edge bitmap ready for tracing."""
+    masks = SliceMasks(bgArray, hi, lo)
+    masks.edgeBitmap()
+    return masks
+
+
+# The axis directions edge distance maps are kept for, as (row, col) steps
+EDGE_DIRECTIONS = ((0, 1), (1, 0), (0, -1), (-1, 0))
+EDGE_DISTANCE_TYPE = numpy.uint16
+# Distance map value for no edge within reach
+NO_EDGE = numpy.iinfo(EDGE_DISTANCE_TYPE).max
+
+def edge_distance_map(edges, direction):
+    """Steps from each pixel to the next True pixel of the 2D edges in direction, one of EDGE_DIRECTIONS.
+
+    Each line along the direction is scanned once: a running minimum, from
+    the far end back, of the positions of the edge pixels gives the next one
+    at or beyond each position, and shifting it by one leaves out the pixel
+    itself. Distances not below NO_EDGE, or to no edge at all, are NO_EDGE.
+    """
+    # Turn the slice so that direction runs along increasing columns
+    if direction[0]:
+        edges = edges.T
+    if direction[0] < 0 or direction[1] < 0:
+        edges = edges[:, ::-1]
+    height, width = edges.shape
+    positions = numpy.arange(width, dtype=numpy.int64)
+    nextEdge = numpy.where(edges, positions, width + NO_EDGE)
+    nextEdge = numpy.minimum.accumulate(nextEdge[:, ::-1], axis=1)[:, ::-1]
+    distances = numpy.empty((height, width), dtype=EDGE_DISTANCE_TYPE)
+    distances[:, -1] = NO_EDGE
+    distances[:, :-1] = numpy.minimum(nextEdge[:, 1:] - positions[:-1], NO_EDGE)
+    if direction[0] < 0 or direction[1] < 0:
+        distances = distances[:, ::-1]
+    if direction[0]:
+        distances = distances.T
+    return numpy.ascontiguousarray(distances)
+
+
+class SliceMaskCache(object):
+    """Least recently used store of SliceMasks, kept within maxBytes of memory.
+
+    hits and misses count the lookups made with get(); evictions counts the
+    entries dropped to stay within the budget. Masks grow as the edge distance
+    maps of their lines are built, so their sizes are summed afresh whenever
+    the budget is checked, on every get() and put().
+    """
+
+    def __init__(self, maxBytes=128 * 2**20):
+        self.maxBytes = maxBytes
+        self.entries = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def __len__(self):
+        return len(self.entries)
+
+    @property
+    def nbytes(self):
+        return sum(masks.nbytes for masks in self.entries.values())
+
+    def get(self, key):
+        """Return the masks stored under key and mark them as recently used, or None."""
+        masks = self.entries.pop(key, None)
+        if masks is None:
+            self.misses += 1
+            return None
+        self.entries[key] = masks
+        self.hits += 1
+        self.trim()
+        return masks
+
+    def put(self, key, masks):
+        """Store masks under key, evicting the least recently used entries to make room."""
+        self.entries.pop(key, None)
+        if masks.nbytes > self.maxBytes:
+            return
+        self.entries[key] = masks
+        self.trim()
+
+    def trim(self):
+        """Evict least recently used entries until the cache fits in maxBytes."""
+        nbytes = self.nbytes
+        while nbytes > self.maxBytes and self.entries:
+            key, masks = self.entries.popitem(last=False)
+            nbytes -= masks.nbytes
+            self.evictions += 1
+
+    def clear(self):
+        self.entries.clear()
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                'entries': len(self.entries), 'bytes': self.nbytes}
+
+# Shared by every logic instance, so masks outlive a single click
+sliceMaskCache = SliceMaskCache()
+
+
+class SliceMasks(object):
+    """Threshold and edge masks of a 2D background slice for one (hi, lo) range.
+
+    inThreshold is True where lo <= value <= hi. edges is True for in-threshold
+    pixels that have at least one 4-neighbour out of threshold or outside the
+    slice, so the image border counts as an edge just like it did when is_edge()
+    fetched the neighbours one by one.
+    Edge distance maps of the rows and columns of the slice, for finding the
+    nearest edge along them with one lookup, are built as they are needed.
+    """
+
+    def __init__(self, bgArray, hi, lo):
+        # Written as the negation of the out-of-threshold test so values that
+        # compare false both ways (NaN) are treated as in threshold, as before
+        inThreshold = ~((bgArray < lo) | (bgArray > hi))
+        padded = numpy.zeros((bgArray.shape[0] + 2, bgArray.shape[1] + 2), dtype=bool)
+        padded[1:-1, 1:-1] = inThreshold
+        surrounded = padded[:-2, 1:-1] & padded[2:, 1:-1] & padded[1:-1, :-2] & padded[1:-1, 2:]
+        self._setMasks(hi, lo, inThreshold, inThreshold & ~surrounded)
+
+    @classmethod
+    def fromMasks(cls, hi, lo, inThreshold, edges):
+        """Make SliceMasks from threshold and edge masks computed elsewhere."""
+        masks = cls.__new__(cls)
+        masks._setMasks(hi, lo, inThreshold, edges)
+        return masks
+
+    def _setMasks(self, hi, lo, inThreshold, edges):
+        self.hi = hi
+        self.lo = lo
+        self.inThreshold = inThreshold
+        self.edges = edges
+        self.paddedWidth = edges.shape[1] + 4
+        self._edgeBitmap = None
+        self._edgeLines = {}
+        self._edgeLineBytes = 0
+
+    @property
+    def nbytes(self):
+        """Memory used by the masks, counting the edge bitmap whether or not it is built yet.
+
+        The edge distance maps of lines are counted once they are built.
+        """
+        return self.inThreshold.nbytes + self.edges.nbytes + (self.edges.shape[0] + 4) * self.paddedWidth + \
+            self._edgeLineBytes
+
+    def edgeBitmap(self):
+        """Edges padded by two pixels on every side, flattened to a bytearray for fast lookups."""
+        if self._edgeBitmap is None:
+            padded = numpy.zeros((self.edges.shape[0] + 4, self.paddedWidth), dtype=numpy.uint8)
+            padded[2:-2, 2:-2] = self.edges
+            self._edgeBitmap = bytearray(padded.tobytes())
+        return self._edgeBitmap
+
+    def edgeDistance(self, point, direction):
+        """Steps from point to the next edge pixel in direction, as the edge distance maps give it.
+
+        The maps of the row or column through point are built the first time
+        it is looked along and kept. Returns None if point is outside the
+        slice or direction is not one of EDGE_DIRECTIONS, so the maps cannot tell.
+        """
+        if direction not in EDGE_DIRECTIONS or not (0 <= point[0] < self.edges.shape[0] and
+                                                    0 <= point[1] < self.edges.shape[1]):
+            return None
+        if direction[0]:
+            key = (1, point[1])
+            position = point[0]
+        else:
+            key = (0, point[0])
+            position = point[1]
+        maps = self._edgeLines.get(key)
+        if maps is None:
+            line = self.edges[:, key[1]:key[1] + 1] if key[0] else self.edges[key[1]:key[1] + 1, :]
+            maps = dict((lineDirection, edge_distance_map(line, lineDirection).ravel())
+                        for lineDirection in EDGE_DIRECTIONS if bool(lineDirection[0]) == bool(key[0]))
+            self._edgeLines[key] = maps
+            self._edgeLineBytes += sum(distances.nbytes for distances in maps.values())
+        return int(maps[direction][position])
+
+
+class ThresholdLevels(object):
+    """The SliceMasks of a 2D background slice for several lower thresholds, from one pass over it.
+
+    The slice is reduced once to level, the index in los of the first
+    candidate lower threshold each pixel is in threshold for, and
+    neighbourLevel, the highest level among its 4-neighbours (pixels outside
+    the slice never being in threshold). For candidate k a pixel is then in
+    threshold if level <= k, and an edge if also neighbourLevel > k, so the
+    masks of every candidate come from comparing two small integer maps.
+    los must be in decreasing order, as the lower threshold is relaxed.
+    """
+
+    def __init__(self, bgArray, hi, los):
+        self.hi = hi
+        self.los = list(los)
+        count = len(self.los)
+        levelType = numpy.min_scalar_type(count)
+        # The number of candidates a value is below; NaN is below none, so it
+        # counts as in threshold as in SliceMasks
+        level = numpy.zeros(bgArray.shape, dtype=levelType)
+        for lo in self.los:
+            level += bgArray < lo
+        level[bgArray > hi] = count
+        padded = numpy.empty((bgArray.shape[0] + 2, bgArray.shape[1] + 2), dtype=levelType)
+        padded.fill(count)
+        padded[1:-1, 1:-1] = level
+        neighbourLevel = numpy.maximum(numpy.maximum(padded[:-2, 1:-1], padded[2:, 1:-1]),
+                                       numpy.maximum(padded[1:-1, :-2], padded[1:-1, 2:]))
+        self.level = level
+        self.neighbourLevel = neighbourLevel
+
+    def masks(self, k):
+        """The SliceMasks for lower threshold los[k]."""
+        inThreshold = self.level <= k
+        edges = inThreshold & (self.neighbourLevel > k)
+        return SliceMasks.fromMasks(self.hi, self.los[k], inThreshold, edges)
@@ -0,0 +1,143 @@
+"""Synthetic CT-like images for exercising the tracing and filling code without real scans.
+
+Every generator returns a Phantom: the image in Hounsfield units, a click
+inside the structure of interest, and the thresholds the effect would use
+for it. Slices are 2D; volumes are 3D with the click given as (slice, row,
+column). Geometry scales with size, so bigger phantoms also have longer
+contours. A fixed seed makes the noise, and so the results, repeatable.
+"""
+
+import collections
+
+import numpy
+
+AIR = -1000
+FAT = -100
+SOFT_TISSUE = 40
+NERVE = 35
+MARROW = 60
+CORTICAL_BONE = 1400
+
+# Threshold ranges of the effect's Bone/Nerve and Tissue buttons
+BONE_RANGE = (250, 2799)
+TISSUE_RANGE = (-250, 2799)
+# Nerves are picked out from the fat around them
+NERVE_RANGE = (0, 100)
+
+Phantom = collections.namedtuple('Phantom', 'name image click lo hi')
+
+
+def ellipse_mask(shape, center, radii, angle=0.0):
+    """Boolean mask of the ellipse with the given center and (row, col) radii, rotated by angle radians."""
+    rows, cols = numpy.ogrid[:shape[0], :shape[1]]
+    dr = rows - center[0]
+    dc = cols - center[1]
+    cos, sin = numpy.cos(angle), numpy.sin(angle)
+    u = (dr * cos + dc * sin) / float(radii[0])
+    v = (dc * cos - dr * sin) / float(radii[1])
+    return u * u + v * v <= 1.0
+
+def body(size):
+    """A size x size slice of soft tissue in a layer of fat, surrounded by air."""
+    shape = (size, size)
+    center = (size / 2.0, size / 2.0)
+    image = numpy.full(shape, AIR, dtype=numpy.float64)
+    image[ellipse_mask(shape, center, (0.46 * size, 0.42 * size))] = FAT
+    image[ellipse_mask(shape, center, (0.40 * size, 0.36 * size))] = SOFT_TISSUE
+    return image
+
+def finish(image, noise, seed):
+    """Add Gaussian noise of the given standard deviation and round to the int16 voxels of a CT volume."""
+    image = image + numpy.random.RandomState(seed).normal(0.0, noise, image.shape)
+    return numpy.round(image).astype(numpy.int16)
+
+def ellipse_slice(size=256, seed=0):
+    """A solid oval bone in the middle of the body."""
+    image = body(size)
+    center = (size / 2.0, size / 2.0)
+    image[ellipse_mask(image.shape, center, (0.22 * size, 0.14 * size), 0.3)] = CORTICAL_BONE
+    click = (size // 2, size // 2)
+    return Phantom('ellipse', finish(image, 10.0, seed), click, BONE_RANGE[0], BONE_RANGE[1])
+
+def cortical_rings_slice(size=256, seed=0):
+    """A long bone cut across: a ring of cortex around marrow, with a second ring nested in the marrow.
+
+    The click is in the marrow between the rings, so the outline wanted is
+    the outer one.
+    """
+    image = body(size)
+    shape = image.shape
+    center = (size / 2.0, size / 2.0)
+    for radii, value in (((0.24, 0.20), CORTICAL_BONE), ((0.19, 0.15), MARROW),
+                         ((0.10, 0.08), CORTICAL_BONE), ((0.06, 0.045), MARROW)):
+        image[ellipse_mask(shape, center, (radii[0] * size, radii[1] * size))] = value
+    click = (size // 2, int(center[1] + 0.115 * size))
+    return Phantom('cortical_rings', finish(image, 10.0, seed), click, BONE_RANGE[0], BONE_RANGE[1])
+
+def noisy_tissue_slice(size=256, seed=0):
+    """The whole body outline in tissue mode, with heavy noise roughening its edge.
+
+    The click is off centre, so the edge is within the 200 pixel seed search
+    of large slices too.
+    """
+    image = body(size)
+    click = (size // 2, int(0.7 * size))
+    return Phantom('noisy_tissue', finish(image, 60.0, seed), click, TISSUE_RANGE[0], TISSUE_RANGE[1])
+
+def nerve_slice(size=256, seed=0):
+    """A thin nerve running through fat, a few pixels across."""
+    shape = (size, size)
+    image = numpy.full(shape, FAT, dtype=numpy.float64)
+    center = (size / 2.0, size / 2.0)
+    radius = max(size / 40.0, 4.0)
+    image[ellipse_mask(shape, center, (radius, radius * 0.8))] = NERVE
+    click = (size // 2, size // 2)
+    return Phantom('nerve', finish(image, 8.0, seed), click, NERVE_RANGE[0], NERVE_RANGE[1])
+
+def wavy_bone_slice(size=1100, seed=0):
+    """A bone whose outline ripples 32 times around it, for contours several times longer than an ellipse's.
+
+    At the default size the contour is over 8000 pixels long. The click is
+    off centre, within the 200 pixel seed search of the edge.
+    """
+    image = body(size)
+    rows, cols = numpy.ogrid[:size, :size]
+    dr = rows - size / 2.0
+    dc = cols - size / 2.0
+    radius = 0.25 * size * (1.0 + 0.25 * numpy.sin(32 * numpy.arctan2(dr, dc)))
+    image[numpy.hypot(dr, dc) <= radius] = CORTICAL_BONE
+    click = (size // 2, int(0.65 * size))
+    return Phantom('wavy_bone', finish(image, 10.0, seed), click, BONE_RANGE[0], BONE_RANGE[1])
+
+SLICES = (ellipse_slice, cortical_rings_slice, noisy_tissue_slice, nerve_slice)
+
+
+def bone_volume(size=256, slices=20, seed=0):
+    """A stack of cortical ring slices whose bone drifts and narrows along the first axis."""
+    image = numpy.empty((slices, size, size), dtype=numpy.int16)
+    for index in range(slices):
+        section = body(size)
+        shape = section.shape
+        shift = 0.02 * size * numpy.sin(index / 6.0)
+        scale = 1.0 - 0.2 * index / float(max(slices - 1, 1))
+        center = (size / 2.0 + shift, size / 2.0 - shift)
+        for radii, value in (((0.24, 0.20), CORTICAL_BONE), ((0.19, 0.15), MARROW)):
+            image_radii = (radii[0] * size * scale, radii[1] * size * scale)
+            section[ellipse_mask(shape, center, image_radii)] = value
+        image[index] = finish(section, 10.0, seed + index)
+    click = (0, size // 2, size // 2)
+    return Phantom('bone_volume', image, click, BONE_RANGE[0], BONE_RANGE[1])
+
+def nerve_volume(size=256, slices=20, seed=0):
+    """A thin nerve winding through fat along the first axis."""
+    image = numpy.empty((slices, size, size), dtype=numpy.int16)
+    radius = max(size / 40.0, 4.0)
+    for index in range(slices):
+        section = numpy.full((size, size), FAT, dtype=numpy.float64)
+        center = (size / 2.0 + radius * numpy.sin(index / 4.0), size / 2.0 + radius * numpy.cos(index / 5.0))
+        section[ellipse_mask(section.shape, center, (radius, radius * 0.8))] = NERVE
+        image[index] = finish(section, 8.0, seed + index)
+    click = (0, int(round(size / 2.0)), int(round(size / 2.0 + radius)))
+    return Phantom('nerve_volume', image, click, NERVE_RANGE[0], NERVE_RANGE[1])
+
+VOLUMES = (bone_volume, nerve_volume)
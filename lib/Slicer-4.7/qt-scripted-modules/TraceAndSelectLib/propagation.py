@@ -0,0 +1,426 @@
+"""Tracing and filling a run of slices one after another."""
+
+import math
+import multiprocessing
+import multiprocessing.pool
+import timeit
+
+from .masks import take_slice, prepared_masks, ThresholdLevels
+from .contour import Contour
+from .tracing import gimme_a_path, get_optional_seeds, fetch_val
+from .tracking import track_path
+from .pyramid import coarse_to_fine_path
+from .fill import fill_region, path_enclosure
+from .regions import RegionStats
+from .history import SliceEdit
+from .instrumentation import debug, is_debug, noStats
+
+# The array axis normal to each slice plane; arrays are indexed [k, j, i]
+PLANE_AXES = {'IJ': 0, 'IK': 1, 'JK': 2}
+
+
+def slice_indexes(start, offset, count):
+    """The slices from start through offset more along an axis of count slices, stopping at the edge of the volume."""
+    step = int(math.copysign(1, offset))
+    last = min(max(start + step * int(abs(offset)), 0), count - 1)
+    return list(range(start, last + step, step))
+
+
+class SlicePropagator(object):
+    """Slice views and masks for a run of slices that are traced one after another.
+
+    indexes lists the slices along axis in the order they will be processed.
+    While one slice is traced and filled, the masks of the next few are built
+    on a pool of worker threads. The NumPy operations that build them release
+    the GIL, so this work overlaps with tracing on multi-core machines.
+    If cache is given, masks are looked up in and added to it under
+    cacheKey + (axis, index, hi, lo); cacheKey should identify the
+    background volume and its current contents. If stats, a StageStats, is
+    given, the time spent on each stage of every slice is added to it. If
+    tracePool, a TracePool, is given the seeds of each slice are traced on it.
+    With tracking, a slice traced after another follows the outline of the
+    slice before with track_path(), and is only seeded in full when that
+    loses track. With a pyramidFactor above 1 slices are traced coarse to
+    fine by coarse_to_fine_path(), and at full size only if that fails.
+    """
+
+    def __init__(self, backgroundArray, labelArray, axis, indexes, hi, lo, workers=None,
+                 cache=None, cacheKey=(), stats=None, tracePool=None, tracking=False, pyramidFactor=1):
+        self.backgroundArray = backgroundArray
+        self.labelArray = labelArray
+        self.axis = axis
+        self.indexes = list(indexes)
+        self.hi = hi
+        self.lo = lo
+        if workers is None:
+            try:
+                workers = multiprocessing.cpu_count()
+            except NotImplementedError:
+                workers = 1
+        # No point in a pool for a single slice
+        self.workers = max(min(workers, len(self.indexes) - 1), 0)
+        self.pool = None
+        self.pending = {}
+        self.cache = cache
+        self.cacheKey = tuple(cacheKey)
+        self.stats = stats if stats is not None else noStats
+        self.tracePool = tracePool
+        self.tracking = tracking
+        self.pyramidFactor = pyramidFactor
+
+    def backgroundSlice(self, index):
+        return take_slice(self.backgroundArray, self.axis, index)
+
+    def labelSlice(self, index):
+        return take_slice(self.labelArray, self.axis, index)
+
+    def key(self, index, lo):
+        return self.cacheKey + (self.axis, index, self.hi, lo)
+
+    def masks(self, index, lo=None):
+        """Return the SliceMasks of slice index, queueing the slices after it on the pool.
+
+        lo defaults to the lower threshold of the run; only masks for that
+        threshold are built ahead of time.
+        """
+        if lo is None:
+            lo = self.lo
+        if self.workers:
+            if self.pool is None:
+                self.pool = multiprocessing.pool.ThreadPool(self.workers)
+            position = self.indexes.index(index)
+            for upcoming in self.indexes[position + 1:position + 1 + self.workers]:
+                if upcoming in self.pending:
+                    continue
+                if self.cache is not None and self.key(upcoming, self.lo) in self.cache:
+                    continue
+                self.pending[upcoming] = self.pool.apply_async(
+                    prepared_masks, (self.backgroundSlice(upcoming), self.hi, self.lo))
+        if self.cache is not None:
+            masks = self.cache.get(self.key(index, lo))
+            if masks is not None:
+                return masks
+        pending = None
+        if lo == self.lo:
+            pending = self.pending.pop(index, None)
+        if pending is not None:
+            masks = pending.get()
+        else:
+            masks = prepared_masks(self.backgroundSlice(index), self.hi, lo)
+        if self.cache is not None:
+            self.cache.put(self.key(index, lo), masks)
+        return masks
+
+    def sweepMasks(self, index, los):
+        """Return the SliceMasks of slice index for each lower threshold in los, in decreasing order.
+
+        Masks not already in the cache are all built from one ThresholdLevels
+        of the slice.
+        """
+        found = {}
+        if self.cache is not None:
+            for lo in los:
+                masks = self.cache.get(self.key(index, lo))
+                if masks is not None:
+                    found[lo] = masks
+        missing = [lo for lo in los if lo not in found]
+        if missing:
+            levels = ThresholdLevels(self.backgroundSlice(index), self.hi, missing)
+            for k, lo in enumerate(missing):
+                found[lo] = levels.masks(k)
+                if self.cache is not None:
+                    self.cache.put(self.key(index, lo), found[lo])
+        return [found[lo] for lo in los]
+
+    def trace(self, index, point, optional_seeds=[], maxAttempts=2, previous=None):
+        """Trace the outline around point on slice index.
+
+        If tracking and given previous, the outline of the slice before, the
+        outline is first tracked from it at lo. Otherwise, or if that loses
+        track, the slice is traced coarse to fine at lo if pyramidFactor is
+        above 1.
+
+        A trace is acceptable if it finds a path with at most 150 dead ends.
+        If the trace at lo is not, the lower thresholds lo - 25, lo - 50, ...
+        (maxAttempts of them) are swept, their masks built together from one
+        pass over the slice. The first acceptable trace wins, and if there is
+        none, the path with the fewest dead ends. If no trace finds a path the
+        last one is returned.
+        Returns (best_path, visited, dead_ends, lo), lo being the lower
+        threshold of the winning trace; dead_ends is -1 if no path was found.
+        """
+        backgroundDrawArray = self.backgroundSlice(index)
+
+        # Log info about where the user clicked for debugging purposes
+        if is_debug():
+            debug("@@@location=", point)
+            try:
+                debug("@@@value=", fetch_val(backgroundDrawArray, point))
+            except IndexError:
+                pass
+
+        stats = self.stats
+        if self.tracking and previous is not None and len(previous):
+            tracked = track_path(point, previous, self.hi, self.lo, backgroundDrawArray, stats=stats)
+            if tracked is not None:
+                stats.add('slices tracked')
+                stats.set('threshold used', self.lo)
+                return tracked + (self.lo,)
+            stats.add('tracking fallbacks')
+        if self.pyramidFactor > 1:
+            refined = coarse_to_fine_path(point, 200, self.hi, self.lo, backgroundDrawArray, self.pyramidFactor,
+                                          optional_seeds, stats)
+            if refined is not None:
+                stats.add('slices coarse to fine')
+                stats.set('threshold used', self.lo)
+                return refined + (self.lo,)
+            stats.add('coarse to fine fallbacks')
+
+        # Threshold and edge masks are computed once for the slice and shared
+        # by every tracing routine instead of testing pixels one at a time
+        with stats.stage('masks'):
+            masks = self.masks(index)
+        best = gimme_a_path(point, 200, self.hi, self.lo, backgroundDrawArray,
+                            optional_seeds, masks, stats, self.tracePool) + (self.lo,)
+        stats.add('thresholds tried')
+        debug("@@@Dead ends:", best[2])
+
+        if not 0 <= best[2] <= 150 and maxAttempts > 0:
+            los = [self.lo - 25 * attempt for attempt in range(1, maxAttempts + 1)]
+            with stats.stage('masks'):
+                candidates = self.sweepMasks(index, los)
+            for lo, masks in zip(los, candidates):
+                debug("Lowering min tolerance to:", lo)
+                traced = gimme_a_path(point, 200, self.hi, lo, backgroundDrawArray,
+                                      optional_seeds, masks, stats, self.tracePool) + (lo,)
+                stats.add('thresholds tried')
+                debug("@@@Dead ends:", traced[2])
+                if 0 <= traced[2] <= 150:
+                    best = traced
+                    break
+                if best[2] < 0 or 0 <= traced[2] < best[2]:
+                    best = traced
+        stats.set('threshold used', best[3])
+        return best
+
+    def fillSlice(self, index, point, optional_seeds, label, maxPixels, outline=None, volumeKey=None,
+                  previous=None):
+        """Trace slice index around point, then paint the outline and fill its inside with label.
+
+        If outline, a TracedOutline of the slice, is given it is filled as it
+        is, without tracing. previous, the outline of the slice before, is
+        tracked from if tracking. Returns a SliceFill; its edit is recorded under
+        volumeKey. A slice that fails is left as it was.
+        """
+        with self.stats.stage('slice'):
+            result = self._fillSlice(index, point, optional_seeds, label, maxPixels, outline, volumeKey,
+                                     previous)
+        self.stats.add('slices')
+        return result
+
+    def _fillSlice(self, index, point, optional_seeds, label, maxPixels, outline, volumeKey, previous):
+        labelDrawArray = self.labelSlice(index)
+        lo = self.lo
+        fill_point = point
+        barrier = None
+        if outline is not None:
+            best_path = outline.path
+            visited = outline.visited
+            fill_point = outline.point
+            barrier = outline.barrier
+        else:
+            best_path, visited, dead_ends, lo = self.trace(index, point, optional_seeds, previous=previous)
+            if dead_ends < 0:
+                debug("@@@No path found? Weird.")
+                return SliceFill(index, lo, error="could not find any suitable path")
+
+        # A path that does not close round the fill point cannot hold the
+        # fill, so it is turned down before any label pixel is written
+        enclosure = path_enclosure(best_path, fill_point, barrier)
+        if enclosure is None or enclosure.leaked:
+            debug("@@@WENT OUT OF BOUNDS FOR PATH!")
+            return SliceFill(index, lo, best_path, error="Went out of bounds for path")
+
+        # Keep the slice as it was so the edit can be recorded
+        before = labelDrawArray.copy()
+        labelDrawArray[visited.rows, visited.cols] = label
+
+        # Fill the inside of the path, using the path itself as the barrier
+        debug("@@@FILLING PATH")
+        with self.stats.stage('fill'):
+            filled = fill_region(labelDrawArray, fill_point, best_path, label, maxPixels, barrier, enclosure)
+        pixelsSet, mean, count = filled
+        self.stats.add('pixels filled', pixelsSet)
+        edit = SliceEdit(volumeKey, self.axis, index, before, labelDrawArray)
+        return SliceFill(index, lo, best_path, pixelsSet, mean, count, edit, RegionStats.fromEdit(edit))
+
+    def close(self):
+        """Stop the worker threads and drop any masks that were not used."""
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool.join()
+            self.pool = None
+        self.pending = {}
+
+
+class SliceFill(object):
+    """What tracing and filling one slice of a propagation run did.
+
+    error is None after a fill, or says why the slice was left unchanged.
+    path is the traced outline, a Contour, and lo the lower threshold it was traced with.
+    pixelsSet, mean and count are as returned by fill_region(), and edit is
+    the SliceEdit of the fill. region is the RegionStats of the pixels the
+    fill changed, path included.
+    """
+
+    def __init__(self, index, lo, path=None, pixelsSet=0, mean=(0, 0), count=0, edit=None, region=None,
+                 error=None):
+        self.index = index
+        self.lo = lo
+        self.path = path if path is not None else Contour()
+        self.pixelsSet = pixelsSet
+        self.mean = mean
+        self.count = count
+        self.edit = edit
+        self.region = region if region is not None else RegionStats()
+        self.error = error
+
+    def centre(self):
+        """The (row, col) the next slice is seeded from, or None if the fill has no pixels to centre on.
+
+        This is mean // count, the centroid fill_region() kept of the visits
+        to labelled pixels, as the original fill seeded the next slice, or the
+        centroid of the pixels it changed if it made no such visits.
+        """
+        if self.count:
+            return (self.mean[0] // self.count, self.mean[1] // self.count)
+        centroid = self.region.planeCentroid()
+        if centroid is not None:
+            return (int(centroid[0]), int(centroid[1]))
+        return None
+
+
+def propagate(propagator, point, optional_seeds, label, maxPixels, outline=None, volumeKey=None):
+    """Trace and fill the slices of propagator in order, yielding a SliceFill for each.
+
+    Every slice after the first is seeded from the centre() of the fill on
+    the slice before it, where it has one, and tracks its outline if the propagator is
+    tracking. outline, if given, is filled on the first slice
+    instead of tracing it. Stops after the first slice that fails; a slice
+    is only started once the caller asks for it, so stopping the iteration
+    leaves the remaining slices untouched.
+    """
+    previous = None
+    for index in propagator.indexes:
+        if previous is not None:
+            recs_mean = previous.centre()
+            if recs_mean is not None:
+                optional_seeds = get_optional_seeds(previous.path, recs_mean)
+                point = optional_seeds[0]
+            debug("MEAN:", point, recs_mean)
+            # Only the clicked slice can use a previewed outline
+            outline = None
+        result = propagator.fillSlice(index, point, optional_seeds, label, maxPixels, outline, volumeKey,
+                                      previous.path if previous is not None else None)
+        yield result
+        if result.error is not None:
+            return
+        previous = result
+
+
+class PropagationJob(object):
+    """A propagate() run that is advanced a chunk of slices at a time.
+
+    Each step() fills slices until its time budget is used up, at least one
+    per call, so a GUI can handle events between chunks and cancel() stops
+    the run before the next slice. onSlice, if given, is called with each
+    SliceFill as it lands. results holds every SliceFill so far and
+    timings the (index, seconds) each slice took. The propagator is closed
+    once the job is done: after its last slice, a slice that failed,
+    cancel(), or an exception, which error then describes.
+    """
+
+    def __init__(self, propagator, point, optional_seeds, label, maxPixels, outline=None, volumeKey=None,
+                 onSlice=None):
+        self.propagator = propagator
+        self.total = len(propagator.indexes)
+        self.onSlice = onSlice
+        self.results = []
+        self.timings = []
+        self.error = None
+        self.cancelled = False
+        self.finished = False
+        self.started = timeit.default_timer()
+        self.stopped = None
+        self._slices = propagate(propagator, point, optional_seeds, label, maxPixels, outline, volumeKey)
+
+    @property
+    def done(self):
+        return self.finished or self.cancelled
+
+    @property
+    def slicesDone(self):
+        """The number of slices filled so far."""
+        return len([result for result in self.results if result.error is None])
+
+    @property
+    def region(self):
+        """The RegionStats of every slice filled so far together."""
+        return RegionStats.combine([result.region for result in self.results if result.error is None],
+                                   self.propagator.axis)
+
+    @property
+    def progress(self):
+        """The fraction of the slices that have been processed."""
+        return float(len(self.results)) / self.total if self.total else 1.0
+
+    def elapsed(self):
+        """Seconds from the start of the job to its end, or to now while it runs."""
+        return (self.stopped if self.stopped is not None else timeit.default_timer()) - self.started
+
+    def step(self, budget=0.1):
+        """Fill slices until budget seconds have passed or the job is done. Returns the SliceFills of this chunk."""
+        chunk = []
+        start = timeit.default_timer()
+        while not self.done:
+            sliceStart = timeit.default_timer()
+            try:
+                result = next(self._slices)
+            except StopIteration:
+                self._stop()
+                break
+            except Exception as error:
+                self.error = str(error) or error.__class__.__name__
+                self._stop()
+                raise
+            self.timings.append((result.index, timeit.default_timer() - sliceStart))
+            self.results.append(result)
+            chunk.append(result)
+            if self.onSlice is not None:
+                self.onSlice(result)
+            if result.error is not None:
+                self.error = result.error
+                self._stop()
+            elif len(self.results) == self.total:
+                self._stop()
+            elif timeit.default_timer() - start >= budget:
+                break
+        return chunk
+
+    def run(self):
+        """Fill every slice left. Returns all the SliceFills of the job."""
+        while not self.done:
+            self.step(float('inf'))
+        return self.results
+
+    def cancel(self):
+        """Leave the slices not filled yet untouched."""
+        if not self.done:
+            self.cancelled = True
+            self._stop()
+
+    def _stop(self):
+        self.finished = not self.cancelled
+        self.stopped = timeit.default_timer()
+        self._slices.close()
+        self.propagator.close()
@@ -0,0 +1,73 @@
+"""Tracing large slices coarse to fine: on a shrunken copy first, then in a thin band at full size."""
+
+import numpy
+
+from .contour import Contour
+from .tracing import gimme_a_path
+from .tracking import track_path
+from .instrumentation import debug, noStats
+
+
+def downsample(bgArray, factor):
+    """The slice shrunk by factor, each pixel the mean of a factor x factor block.
+
+    Rows and columns left over at the bottom and right edges are dropped.
+    The blocks are summed a row and a column of them at a time, which is
+    much faster than reducing over reshaped block axes.
+    """
+    height = bgArray.shape[0] // factor
+    width = bgArray.shape[1] // factor
+    trimmed = bgArray[:height * factor, :width * factor]
+    rows = trimmed[0::factor].astype(numpy.float64)
+    for row in range(1, factor):
+        rows += trimmed[row::factor]
+    blocks = rows[:, 0::factor].copy()
+    for col in range(1, factor):
+        blocks += rows[:, col::factor]
+    blocks /= factor * factor
+    return blocks
+
+def upsample_contour(contour, factor):
+    """contour, traced on a slice shrunk by factor, at full size.
+
+    Pixels go to the middle of their blocks, and the steps between
+    neighbouring pixels, and from the last back to the first, are filled in
+    so the outline stays closed and connected.
+    """
+    points = contour.points * factor + (factor - 1) // 2
+    steps = numpy.roll(points, -1, axis=0) - points
+    fractions = numpy.arange(factor) / float(factor)
+    filled = points[:, numpy.newaxis, :] + numpy.round(steps[:, numpy.newaxis, :] * fractions[:, numpy.newaxis])
+    return Contour(filled.reshape(-1, 2))
+
+def coarse_to_fine_path(location, seed_distance, hi, lo, bgArray, factor=2, optional_seeds=[], stats=None):
+    """Trace the outline around location on the slice shrunk by factor, then refine it at full size.
+
+    The shrunken slice is traced as gimme_a_path() traces a slice, with
+    seed_distance and the pixels scaled down, so seeds are found and
+    contours followed on a slice factor**2 times smaller. The outline is then
+    scaled back up and traced again at full size within a band of factor + 1
+    pixels around it by track_path(). Returns (path, visited, dead_ends)
+    like gimme_a_path(), or None if either step finds no outline, in which
+    case the slice should be traced at full size.
+    """
+    if stats is None:
+        stats = noStats
+    if factor < 2:
+        return None
+    with stats.stage('coarse'):
+        coarse = downsample(bgArray, factor)
+        coarseLocation = (location[0] // factor, location[1] // factor)
+        if not (0 <= coarseLocation[0] < coarse.shape[0] and 0 <= coarseLocation[1] < coarse.shape[1]):
+            return None
+        coarseSeeds = [(seed[0] // factor, seed[1] // factor) for seed in optional_seeds]
+        path, visited, dead_ends = gimme_a_path(coarseLocation, max(seed_distance // factor, 2), hi, lo, coarse,
+                                                coarseSeeds)
+    stats.add('coarse pixels visited', len(visited))
+    if not path:
+        debug("@@@No outline on the coarse slice")
+        return None
+    # A shrunken outline is smoother than the one it stands for, so its
+    # length is only a rough guide
+    return track_path(location, upsample_contour(path, factor), hi, lo, bgArray, band=factor + 1,
+                      maxLengthRatio=3.0, stats=stats)
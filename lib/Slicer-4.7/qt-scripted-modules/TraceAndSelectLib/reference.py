@@ -0,0 +1,118 @@
+"""The original pixel-by-pixel tracing and filling, kept as a baseline.
+
+build_path() and the breadth-first fill of the effect's fill() as they were
+before tracing moved to edge bitmaps and filling to NumPy, less their
+debugging output. The benchmark times them next to the code that replaced
+them, and the regression test holds that code to their results. They are
+slow on purpose; nothing else should call them.
+"""
+
+import numpy
+
+# Neighbours in the order build_path() tries them
+OFFSETS = [
+    (0, 1),
+    (1, 1),
+    (1, 0),
+    (1, -1),
+    (0, -1),
+    (-1, -1),
+    (-1, 0),
+    (-1, 1)
+]
+
+
+def fetch_val(array, coordinate):
+    if coordinate[0] < 0 or coordinate[1] < 0:
+        raise IndexError
+    return array[coordinate]
+
+def is_edge(location, hi, lo, bgArray):
+    """Return true is location is an edge pixel."""
+    try:
+        b = fetch_val(bgArray, location)
+    except IndexError:
+        return False
+    if b < lo or b > hi:
+        return False
+    # Check if its neighbors are outside the threshold
+    for offset in [(0, 1), (1, 0), (0, -1), (-1, 0)]:
+        tmp = (location[0] + offset[0], location[1] + offset[1])
+        try:
+            b = fetch_val(bgArray, tmp)
+        except IndexError:
+            return True
+        if b < lo or b > hi:
+            return True
+    return False
+
+def build_path(start, hi, lo, bgArray):
+    """Return a complete path from start as (path, visited, dead_ends), scanning the visited list for every neighbour."""
+    dead_ends = 0
+    visited = [start]
+    path = [start]
+    location = start
+    while path != []:
+        found = False
+        for offset in OFFSETS:
+            neighbor = (location[0] + offset[0], location[1] + offset[1])
+            if len(visited) > 1 and neighbor == start:
+                return (path, visited, dead_ends)
+            if is_edge(neighbor, hi, lo, bgArray) and neighbor not in visited:
+                visited.append(neighbor)
+                path.append(neighbor)
+                location = neighbor
+                found = True
+                break
+        if not found:
+            # Dead end found, re-trace steps
+            dead_ends += 1
+            path.pop()
+            if len(path) > 0:
+                location = path[len(path) - 1]
+    return ([], [], -1)
+
+def fill(labelArray, fill_point, best_path, label, maxPixels):
+    """The breadth-first fill fill_region() replaced; returns (pixelsSet, mean, count), or None if it leaks.
+
+    The original looked each pixel up in the best_path list; a set is used
+    here, which gives the same answers, as scanning the list would swamp
+    the timing of everything else the fill does.
+    """
+    mean = (0, 0)
+    count = 0
+    toVisit = [fill_point]
+    extrema = (min(p[0] for p in best_path), max(p[0] for p in best_path),
+               min(p[1] for p in best_path), max(p[1] for p in best_path))
+    visited = numpy.zeros(labelArray.shape, dtype=bool)
+    pixelsSet = 0
+    path = set(best_path)
+    while toVisit:
+        location = toVisit.pop(0)
+        if location[0] < 0 or location[1] < 0:
+            continue
+        try:
+            l = labelArray[location]
+        except IndexError:
+            continue
+        if l == label:
+            mean = (mean[0] + location[0], mean[1] + location[1])
+            count += 1
+            if visited[location]:
+                continue
+            visited[location] = True
+        if location in path:
+            continue
+        if not (extrema[0] < location[0] < extrema[1] and extrema[2] < location[1] < extrema[3]):
+            return None
+        labelArray[location] = label
+        if l != label:
+            pixelsSet += 1
+        if pixelsSet > maxPixels:
+            toVisit = []
+        else:
+            toVisit.append((location[0] - 1, location[1]))
+            toVisit.append((location[0] + 1, location[1]))
+            toVisit.append((location[0], location[1] - 1))
+            toVisit.append((location[0], location[1] + 1))
+    return pixelsSet, mean, count
@@ -0,0 +1,87 @@
+"""Size, position and shape of the pixels a fill set."""
+
+import numpy
+
+
+class RegionStats(object):
+    """The pixels an edit set, summarised with array operations over their coordinates.
+
+    count is the number of pixels that changed. centroid is their mean
+    position and bounds the (start, stop) range along each axis, both in the
+    index order of the label array, as [k, j, i]; both are None for an empty
+    region. axis is the axis slices are taken along, sliceAreas maps the
+    index of each slice along it to the number of pixels set there, and
+    perimeter is the length, in pixel sides, of the outline of the set
+    pixels on every slice together.
+    """
+
+    def __init__(self, count=0, centroid=None, bounds=None, perimeter=0, sliceAreas=None, axis=None):
+        self.count = count
+        self.centroid = centroid
+        self.bounds = bounds
+        self.perimeter = perimeter
+        self.sliceAreas = sliceAreas if sliceAreas is not None else {}
+        self.axis = axis
+
+    @classmethod
+    def fromCoordinates(cls, coordinates, axis):
+        """Summarise the pixels at coordinates, a tuple of three index arrays, with slices along axis."""
+        count = len(coordinates[0])
+        if not count:
+            return cls(axis=axis)
+        coordinates = [numpy.asarray(c, dtype=numpy.int64) for c in coordinates]
+        starts = [int(c.min()) for c in coordinates]
+        stops = [int(c.max()) + 1 for c in coordinates]
+        centroid = tuple(float(c.mean()) for c in coordinates)
+        areas = numpy.bincount(coordinates[axis] - starts[axis])
+        sliceAreas = dict((starts[axis] + int(index), int(areas[index])) for index in numpy.flatnonzero(areas))
+        # Pixel sides between a set pixel and any other, within each slice
+        inside = numpy.zeros([stop - start + 2 for start, stop in zip(starts, stops)], dtype=bool)
+        inside[tuple(c - start + 1 for c, start in zip(coordinates, starts))] = True
+        perimeter = 0
+        for inPlane in range(3):
+            if inPlane != axis:
+                perimeter += int(numpy.count_nonzero(numpy.diff(inside, axis=inPlane)))
+        return cls(count, centroid, tuple(zip(starts, stops)), perimeter, sliceAreas, axis)
+
+    @classmethod
+    def fromEdit(cls, edit, axis=None):
+        """Summarise the pixels a SliceEdit or VolumeEdit changed; axis defaults to the SliceEdit's."""
+        if hasattr(edit, 'box'):
+            coordinates = numpy.unravel_index(edit.pixels, edit.shape)
+            coordinates = tuple(c + s.start for c, s in zip(coordinates, edit.box))
+        else:
+            axis = edit.axis
+            rows, cols = numpy.unravel_index(edit.pixels, edit.shape)
+            coordinates = [rows, cols]
+            coordinates.insert(axis, numpy.empty(len(rows), dtype=numpy.int64))
+            coordinates[axis].fill(edit.index)
+        return cls.fromCoordinates(tuple(coordinates), axis)
+
+    @classmethod
+    def combine(cls, regions, axis=None):
+        """The RegionStats of several edits on different slices together, without going over their pixels again."""
+        regions = [region for region in regions if region.count]
+        if not regions:
+            return cls(axis=axis)
+        count = sum(region.count for region in regions)
+        centroid = tuple(sum(region.centroid[a] * region.count for region in regions) / float(count)
+                         for a in range(3))
+        bounds = tuple((min(region.bounds[a][0] for region in regions), max(region.bounds[a][1] for region in regions))
+                       for a in range(3))
+        sliceAreas = {}
+        for region in regions:
+            for index, area in region.sliceAreas.items():
+                sliceAreas[index] = sliceAreas.get(index, 0) + area
+        return cls(count, centroid, bounds, sum(region.perimeter for region in regions), sliceAreas,
+                   regions[0].axis if axis is None else axis)
+
+    def planeCentroid(self):
+        """The centroid within the slices, dropping its coordinate along axis; None for an empty region."""
+        if self.centroid is None:
+            return None
+        return tuple(c for a, c in enumerate(self.centroid) if a != self.axis)
+
+    def __repr__(self):
+        return 'RegionStats(count=%d, centroid=%r, bounds=%r, perimeter=%d, slices=%d)' % (
+            self.count, self.centroid, self.bounds, self.perimeter, len(self.sliceAreas))
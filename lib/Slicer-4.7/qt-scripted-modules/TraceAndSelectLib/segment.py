@@ -0,0 +1,132 @@
+"""Trace and fill a list of seeds in a volume on the command line, without Slicer.
+
+Run from the qt-scripted-modules directory, for example
+
+    python -m TraceAndSelectLib.segment ct.nrrd seeds.txt -o labels.nrrd --offset 20
+
+The volume is memory mapped and so is the label volume written, so only
+the slices being traced are read, and each request's slices are flushed
+to the output as soon as they are filled. Each line of the seed file is a
+voxel "i j k", optionally followed by settings for that seed alone:
+plane=IJ lo=250 hi=2799 maxPixels=25000 label=1 offset=0. Blank lines
+and lines starting with # are skipped. With --trace-workers the seeds of
+each slice are traced on that many worker processes. A summary with the slices per
+second and the peak resident memory is printed at the end.
+"""
+
+import argparse
+import json
+import sys
+import timeit
+
+from .masks import SliceMaskCache
+from .batch import batch_request, segment_batch
+from .tracepool import trace_pool
+from .volumes import open_volume, create_volume
+
+SEED_SETTINGS = ('plane', 'lo', 'hi', 'maxPixels', 'label', 'offset')
+
+
+def read_seeds(path, defaults):
+    """Return the BatchRequests of the seed file at path, taking unset settings from the defaults dictionary."""
+    requests = []
+    with open(path) as seeds:
+        for number, line in enumerate(seeds, 1):
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            words = line.replace(',', ' ').split()
+            try:
+                ijk = tuple(int(word) for word in words[:3])
+                settings = dict(defaults)
+                for word in words[3:]:
+                    key, value = word.split('=', 1)
+                    if key not in SEED_SETTINGS:
+                        raise ValueError("unknown setting %s" % key)
+                    settings[key] = value if key == 'plane' else float(value)
+                if len(ijk) != 3:
+                    raise ValueError("expected i j k")
+            except ValueError as error:
+                raise ValueError("%s line %d: %s" % (path, number, error))
+            requests.append(batch_request(ijk, settings['plane'], (settings['lo'], settings['hi']),
+                                          settings['maxPixels'], int(settings['label']), settings['offset']))
+    return requests
+
+def peak_rss_mb():
+    """Peak resident memory of this process in MB, or None where it can't be had."""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak / (2.0**20 if sys.platform == 'darwin' else 2.0**10)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('volume', help='background volume: .npy, .nrrd/.nhdr with raw encoding, or raw data')
+    parser.add_argument('seeds', help='seed file, one "i j k [key=value...]" per line')
+    parser.add_argument('-o', '--output', required=True, help='label volume to write: .npy, .nrrd or raw data')
+    parser.add_argument('--shape', type=int, nargs=3, metavar=('K', 'J', 'I'),
+                        help='array shape of a raw volume, slowest axis first')
+    parser.add_argument('--dtype', help='NumPy type of a raw volume, such as <i2')
+    parser.add_argument('--header-bytes', type=int, default=0, help='bytes before the data of a raw volume')
+    parser.add_argument('--label-dtype', default='int16', help='type of the label volume (default: int16)')
+    parser.add_argument('--plane', default='IJ', choices=('IJ', 'IK', 'JK'), help='default slice plane')
+    parser.add_argument('--thresholds', type=float, nargs=2, default=(250, 2799), metavar=('LO', 'HI'),
+                        help='default threshold range (default: 250 2799)')
+    parser.add_argument('--max-pixels', type=float, default=25000, help='default pixel cap per slice')
+    parser.add_argument('--label', type=int, default=1, help='default label value')
+    parser.add_argument('--offset', type=float, default=0,
+                        help='default number of slices to propagate through after the seed slice')
+    parser.add_argument('--cache-mb', type=float, default=128, help='memory for cached slice masks')
+    parser.add_argument('--trace-workers', type=int, default=0,
+                        help='trace the seeds of each slice on this many worker processes (default: 0, serial)')
+    parser.add_argument('--report', help='also write the per-seed results and summary to this JSON file')
+    args = parser.parse_args(argv)
+
+    start = timeit.default_timer()
+    backgroundArray, fields = open_volume(args.volume, args.shape, args.dtype, args.header_bytes)
+    if backgroundArray.ndim != 3:
+        parser.error("%s is not a 3D volume" % args.volume)
+    defaults = {'plane': args.plane, 'lo': args.thresholds[0], 'hi': args.thresholds[1],
+                'maxPixels': args.max_pixels, 'label': args.label, 'offset': args.offset}
+    try:
+        requests = read_seeds(args.seeds, defaults)
+    except ValueError as error:
+        parser.error(str(error))
+    labelArray = create_volume(args.output, backgroundArray.shape, args.label_dtype, fields)
+
+    cache = SliceMaskCache(args.cache_mb * 2**20)
+    tracePool = trace_pool(args.trace_workers)
+    rows = []
+    slices = 0
+    for number, request in enumerate(requests, 1):
+        result = segment_batch(backgroundArray, labelArray, [request], cache=cache, tracePool=tracePool)[0]
+        labelArray.flush()
+        reached = result.stats.counts.get('slices', 0)
+        slices += reached
+        rows.append({'ijk': list(request.ijk), 'plane': request.plane, 'slicesFilled': len(result.fills),
+                     'pixelsSet': result.pixelsSet, 'seconds': result.seconds, 'error': result.error,
+                     'stats': result.stats.asDict()})
+        sys.stdout.write('%d/%d %s: %d of %d slice(s) filled, %d pixels, %.1f ms%s\n' % (
+            number, len(requests), ' '.join(str(n) for n in request.ijk), len(result.fills), reached,
+            result.pixelsSet, result.seconds * 1000, ', ' + result.error if result.error else ''))
+    del labelArray
+    trace_pool(0)
+
+    seconds = timeit.default_timer() - start
+    peak = peak_rss_mb()
+    summary = {'seeds': len(requests), 'slices': slices, 'seconds': seconds,
+               'slicesPerSecond': slices / seconds if seconds else None, 'peakRssMB': peak,
+               'maskCache': cache.stats()}
+    sys.stdout.write('%d seed(s), %d slice(s) in %.2f s: %.1f slices/s, peak RSS %s\n' % (
+        len(requests), slices, seconds, summary['slicesPerSecond'] or 0,
+        '%.1f MB' % peak if peak is not None else 'unknown'))
+    if args.report:
+        with open(args.report, 'w') as report:
+            json.dump({'summary': summary, 'results': rows}, report, indent=1, sort_keys=True)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
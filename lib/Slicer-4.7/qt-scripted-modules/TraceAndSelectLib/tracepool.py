@@ -0,0 +1,196 @@
+"""Tracing the seeds of a click at the same time, on a pool of worker processes or threads."""
+
+import multiprocessing
+import multiprocessing.pool
+import sys
+
+import numpy
+
+from .tracing import build_path
+
+# What each worker process reads its tasks from, set by _start_worker()
+_worker = {}
+
+
+class BitmapMasks(object):
+    """The part of SliceMasks that build_path() uses: the padded edge bitmap and its width."""
+
+    def __init__(self, bitmap, paddedWidth):
+        self.bitmap = bitmap
+        self.paddedWidth = paddedWidth
+
+    def edgeBitmap(self):
+        return self.bitmap
+
+
+def _start_worker(bitmap, generation, cancelled):
+    _worker.update(bitmap=bitmap, generation=generation, cancelled=cancelled, masks=None, masksGeneration=None)
+
+def _trace_in_process(generation, position, seed, size, paddedWidth):
+    """build_path() from seed on the slice in shared memory, or None if the task was cancelled."""
+    if _worker['generation'].value != generation or _worker['cancelled'][position]:
+        return None
+    if _worker['masksGeneration'] != generation:
+        _worker['masks'] = BitmapMasks(shared_bitmap(_worker['bitmap'], size), paddedWidth)
+        _worker['masksGeneration'] = generation
+    return build_path(seed, _worker['masks'])
+
+def shared_bitmap(bitmap, size):
+    """The first size bytes of the shared bitmap, read in place.
+
+    Items of a Python 2 memoryview are one character strings rather than
+    numbers, so there the bytes are copied into a bytearray instead.
+    """
+    view = memoryview(bitmap)
+    if sys.version_info[0] < 3:
+        return bytearray(view[:size].tobytes())
+    return view.cast('B')[:size]
+
+def inside_slicer():
+    """True if running in the Slicer application, which worker processes would fork or start again."""
+    slicer = sys.modules.get('slicer')
+    return getattr(slicer, 'app', None) is not None
+
+def _trace_in_thread(pool, generation, position, seed, masks):
+    if pool.generation != generation or pool.cancelled[position]:
+        return None
+    return build_path(seed, masks)
+
+
+class TracePool(object):
+    """Workers that trace the seeds of a click with build_path() at the same time.
+
+    With kind 'process', the default, the seeds are traced in worker
+    processes. The edge bitmap of the slice is written once into shared
+    memory, which workers read in place under Python 3, so no slice data is
+    pickled; only seeds and traced paths are. With kind 'thread' the seeds
+    are traced on threads sharing the SliceMasks; build_path() is pure Python
+    and holds the GIL, so threads do not trace any faster than one would.
+    Starting worker processes would fork the running Slicer application, or
+    start it again, so process pools are refused inside Slicer: pools are
+    for headless scripts, such as segment.py, and the effect traces serially.
+    A pool serves one click at a time. Use trace() to start the seeds of a
+    click, and close() when done with the pool.
+    """
+
+    # Seeds per click whose traces can be cancelled
+    maxSeeds = 256
+
+    def __init__(self, workers=None, kind='process'):
+        if kind not in ('process', 'thread'):
+            raise ValueError("unknown kind of trace pool %s" % kind)
+        if kind == 'process' and inside_slicer():
+            raise ValueError("process trace pools cannot run inside Slicer")
+        if workers is None:
+            try:
+                workers = multiprocessing.cpu_count()
+            except NotImplementedError:
+                workers = 1
+        self.workers = max(workers, 1)
+        self.kind = kind
+        self.pool = None
+        self.bitmap = None
+        if kind == 'process':
+            self.generation = multiprocessing.RawValue('l', 0)
+            self.cancelled = multiprocessing.RawArray('b', self.maxSeeds)
+        else:
+            self.generation = 0
+            self.cancelled = bytearray(self.maxSeeds)
+
+    def _start(self, size):
+        """Start the workers, with room in shared memory for an edge bitmap of size bytes."""
+        if self.kind == 'thread':
+            if self.pool is None:
+                self.pool = multiprocessing.pool.ThreadPool(self.workers)
+            return
+        if self.bitmap is not None and len(self.bitmap) >= size:
+            return
+        # The shared bitmap is handed to the workers as they start, so a
+        # larger slice needs new workers
+        self.close()
+        self.bitmap = multiprocessing.RawArray('B', size)
+        self.pool = multiprocessing.Pool(self.workers, _start_worker,
+                                         (self.bitmap, self.generation, self.cancelled))
+
+    def trace(self, seeds, masks):
+        """Start tracing from each of seeds on the slice of masks. Returns the SeedTraces of the click.
+
+        Any traces of the click before are cancelled.
+        """
+        bitmap = masks.edgeBitmap()
+        self._start(len(bitmap))
+        if self.kind == 'process':
+            self.generation.value += 1
+            generation = self.generation.value
+        else:
+            self.generation += 1
+            generation = self.generation
+        self.cancelled[:] = [0] * self.maxSeeds
+        if self.kind == 'process':
+            numpy.frombuffer(self.bitmap, dtype=numpy.uint8, count=len(bitmap))[:] = \
+                numpy.frombuffer(bitmap, dtype=numpy.uint8)
+        results = []
+        for position, seed in enumerate(seeds):
+            if seed is None:
+                results.append(None)
+            elif self.kind == 'process':
+                results.append(self.pool.apply_async(
+                    _trace_in_process, (generation, min(position, self.maxSeeds - 1), seed,
+                                        len(bitmap), masks.paddedWidth)))
+            else:
+                results.append(self.pool.apply_async(
+                    _trace_in_thread, (self, generation, min(position, self.maxSeeds - 1), seed, masks)))
+        return SeedTraces(self, results)
+
+    def close(self):
+        """Stop the workers."""
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool.join()
+            self.pool = None
+        self.bitmap = None
+
+
+class SeedTraces(object):
+    """The traces of the seeds of one click, started by TracePool.trace()."""
+
+    def __init__(self, pool, results):
+        self.pool = pool
+        self.results = results
+
+    def result(self, position):
+        """Wait for the trace of seeds[position]; returns what build_path() did, or None if it was cancelled."""
+        if self.results[position] is None:
+            return None
+        return self.results[position].get()
+
+    def cancel(self, position):
+        """Skip the trace of seeds[position] if it has not started yet."""
+        if position < self.pool.maxSeeds - 1:
+            self.pool.cancelled[position] = 1
+
+    def cancelAll(self):
+        """Skip every trace that has not started yet."""
+        for position in range(min(len(self.results), self.pool.maxSeeds - 1)):
+            self.pool.cancelled[position] = 1
+
+
+# The pool shared by every click, if one has been started
+_sharedPool = None
+
+
+def trace_pool(workers, kind='process'):
+    """The shared TracePool of workers of kind, started on first use, or None if workers is 0.
+
+    A shared pool of another size or kind is closed and replaced, and
+    trace_pool(0) closes it.
+    """
+    global _sharedPool
+    if _sharedPool is not None and (workers <= 0 or (_sharedPool.workers, _sharedPool.kind) != (workers, kind)):
+        _sharedPool.close()
+        _sharedPool = None
+    if workers <= 0:
+        return None
+    if _sharedPool is None:
+        _sharedPool = TracePool(workers, kind)
+    return _sharedPool
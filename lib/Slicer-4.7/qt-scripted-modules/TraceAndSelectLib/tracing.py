@@ -0,0 +1,320 @@
+"""Tracing outlines along the edges of the thresholded background."""
+
+import numpy
+
+from .masks import SliceMasks, NO_EDGE
+from .contour import Contour, as_contour
+from .fill import path_enclosure
+from .instrumentation import debug, noStats
+
+
+def get_optional_seeds(seeds, mid, a= 2, b=3):
+    """Guess seeds for the next slice from the pixels of the last path and the centroid mid of its fill."""
+    optional_seeds = []
+    maxes = [0,0]
+    mins = [10000, 10000]
+    seeds = as_contour(seeds)
+    if len(seeds):
+        extrema = seeds.extrema()
+        maxes = [max(extrema[1], 0), max(extrema[3], 0)]
+        mins = [min(extrema[0], 10000), min(extrema[2], 10000)]
+
+    optional_seeds.append( (int(mid[0] + a*mins[0])//b, int(mid[1]) ))
+    optional_seeds.append( ( int(mid[0]), int(mid[1] + a*mins[1])//b) )
+    optional_seeds.append( (int(mid[0] + a*maxes[0])//b  ,int(mid[1])) )
+    optional_seeds.append( (int(mid[0]), int(mid[1] + a*mins[1])//b) )
+
+    return optional_seeds
+
+
+def gimme_a_path(location, seed_distance, hi, lo, bgArray, optional_seeds=[], masks=None, stats=None,
+                 pool=None, enough=None):
+    """Finds the seeds, then builds the paths, then outputs the best path. No messy stuff required.
+    masks is the SliceMasks of bgArray for (hi, lo); it is computed here if not given.
+    The time spent in each stage and the work done are added to stats, a StageStats, if given.
+    If pool, a TracePool, is given the seeds are traced on it at the same time; the
+    result is the same. Once enough contours around location are found, if enough
+    is given, the seeds left are not traced."""
+    if stats is None:
+        stats = noStats
+    if masks is None:
+        with stats.stage('masks'):
+            masks = SliceMasks(bgArray, hi, lo)
+    #
+    # Find edge pixels
+    #
+    with stats.stage('seeds'):
+        seeds = find_edges(location, seed_distance, masks)
+    debug("BEFORE", seeds)
+    seeds.extend(optional_seeds)
+    debug("AFTER", seeds)
+    #
+    # Build paths
+    #
+    debug("@@@BUILDING PATH")
+    traces = None
+    if pool is not None and len(seeds) > 1:
+        traces = pool.trace(seeds, masks)
+    # Seeds on a contour traced already would only trace it again
+    contours = ContourIndex(bgArray.shape)
+    around = 0
+    for position, seed in enumerate(seeds):
+        if seed is None:
+            continue
+        debug("--- SEED ---", seed)
+        if contours.find(seed) is not None:
+            contours.saved += 1
+            continue
+        with stats.stage('trace'):
+            ret_val = build_path(seed, masks) if traces is None else traces.result(position)
+        stats.add('seeds tried')
+        stats.add('pixels visited', len(ret_val[1]))
+        if not ret_val[0]:
+            continue
+        stats.add('dead ends', ret_val[2])
+        contours.add(ret_val)
+        if traces is not None:
+            for later in range(position + 1, len(seeds)):
+                if seeds[later] is not None and contours.find(seeds[later]) is not None:
+                    traces.cancel(later)
+        if enough is not None and encloses(ret_val[0], location):
+            around += 1
+            if around >= enough:
+                break
+    if traces is not None:
+        traces.cancelAll()
+    paths = contours.paths
+    stats.add('traces saved', contours.saved)
+
+    #
+    # Find best path
+    #
+    with stats.stage('best path'):
+        best_path = find_best_path(paths, location)
+    visitedBefore = len(best_path[1])
+    with stats.stage('smooth'):
+        best_path = smooth_path(best_path, hi, lo, bgArray)
+    stats.add('pixels smoothed', len(best_path[1]) - visitedBefore)
+        
+    return best_path
+    
+
+def smooth_path(path_obj, hi, lo, bgArray):
+    """Smooth the path by adding extra pixels to visited; returns the path with the longer visited Contour.
+
+    An 8-neighbour of a path pixel is added if it is inside the slice, not
+    visited yet, not strictly between lo and hi, and within 125 of that
+    band. All neighbours are tested at once as arrays; pixels are added in
+    the order a walk along the path, testing the neighbours of each pixel
+    in turn, would find them.
+    """
+    best_path, visited, dead_ends = path_obj
+    if not best_path:
+        return path_obj
+    height, width = bgArray.shape
+    path = as_contour(best_path).points.astype(numpy.intp)
+    neighbors = (path[:, numpy.newaxis, :] + SMOOTHING_OFFSETS).reshape(-1, 2)
+    rows = neighbors[:, 0]
+    cols = neighbors[:, 1]
+    inside = (rows >= 0) & (rows < height) & (cols >= 0) & (cols < width)
+    rows = rows[inside]
+    cols = cols[inside]
+    values = bgArray[rows, cols].astype(numpy.float64)
+    distance = numpy.where(values > hi, values - hi, lo - values)
+    close = ~((lo < values) & (values < hi)) & (distance <= 125)
+    flat = rows[close] * width + cols[close]
+    # Each pixel once, where the walk first reaches it
+    first = numpy.unique(flat, return_index=True)[1]
+    first.sort()
+    flat = flat[first]
+    visited = as_contour(visited)
+    if len(visited) and len(flat):
+        visitedFlat = numpy.sort(visited.flat(width))
+        position = numpy.minimum(numpy.searchsorted(visitedFlat, flat), len(visitedFlat) - 1)
+        flat = flat[visitedFlat[position] != flat]
+    visited = visited.concatenate(numpy.column_stack((flat // width, flat % width)))
+    debug(len(flat), "pixels were added during smoothing.")
+    return (best_path, visited, dead_ends)
+
+# Neighbours in the order smoothing tests them
+SMOOTHING_OFFSETS = numpy.array([
+    (0, 1),
+    (1, 1),
+    (1, 0),
+    (1, -1),
+    (0, -1),
+    (-1, -1),
+    (-1, 0),
+    (-1, 1)
+], dtype=numpy.intp)
+
+def find_edge(point, offset, max_dist, masks):
+    """Return the first edgepoint and its distance from point using offset.
+    None if no path found.
+    Along the axes, from a point in the slice, this is one lookup in the edge
+    distance maps of masks; otherwise the edge is searched for step by step.
+    """
+    distance = masks.edgeDistance(point, offset) if max_dist <= NO_EDGE else None
+    if distance is not None:
+        if distance >= max_dist:
+            return None
+        return ((point[0] + distance * offset[0], point[1] + distance * offset[1]), distance)
+    for i in range(1, max_dist):
+        next = (point[0] + i * offset[0], point[1] + i * offset[1])
+        if is_edge(next, masks):
+            return (next, i)
+    return None
+
+def find_edges(starting_point, max_dist, masks):
+    """Return an array of edge points found growing outward from starting_point.
+    Search does not exceed max_dist.
+    If starting_point is within threshold, find a maximum of 4 points, one for each offset.
+    If starting_point is NOT within threshold, try to find as many as 8 points; two for each offset.
+    """
+    try:
+        inside = fetch_val(masks.inThreshold, starting_point)
+    except IndexError:
+        return None
+    offsets = [(0,1), (1,0), (0,-1), (-1,0)]
+    edgePoints = []
+    for offset in offsets:
+        first_result = find_edge(starting_point, offset, max_dist, masks)
+        if first_result is not None:
+            edgePoints.append(first_result[0])
+            if not inside:
+                # Try to find second point, since starting click was outside threshold
+                second_result = find_edge(first_result[0], offset, max_dist - first_result[1], masks)
+                if second_result is not None:
+                    edgePoints.append(second_result[0])
+    return edgePoints
+
+def build_path(start, masks):
+    """Return a complete path from start.
+
+    The path follows 8-connected edge pixels depth first, backing up out of
+    dead ends, until it steps back next to start. Returns (path, visited,
+    dead_ends), path and visited being Contours, or empty Contours and -1 if
+    the walk never closes.
+    Pixels are handled as flat indices into the edge bitmap of masks (padded
+    by two pixels so neighbours never fall off the array), and visited pixels
+    are marked in a bitmap, so each step costs O(1) however long the contour.
+    """
+    width = masks.paddedWidth
+    edges = masks.edgeBitmap()
+    # Same neighbour order as before:
+    # (0,1) (1,1) (1,0) (1,-1) (0,-1) (-1,-1) (-1,0) (-1,1)
+    offsets = (1, width + 1, width, width - 1, -1, -width - 1, -width, -width + 1)
+    row = int(start[0]) + 2
+    col = int(start[1]) + 2
+    if not (1 <= row < len(edges) // width - 1 and 1 <= col < width - 1):
+        # None of the neighbours can be an edge pixel
+        return (Contour(), Contour(), -1)
+    origin = row * width + col
+    seen = bytearray(len(edges))
+    seen[origin] = 1
+    visited = [origin,]
+    path = [origin,]
+    location = origin
+    dead_ends = 0
+    while path:
+        for offset in offsets:
+            neighbor = location + offset
+            if neighbor == origin and len(visited) > 1:
+                return (Contour.fromFlat(path, width, 2), Contour.fromFlat(visited, width, 2), dead_ends)
+            if edges[neighbor] and not seen[neighbor]:
+                seen[neighbor] = 1
+                visited.append(neighbor)
+                path.append(neighbor)
+                location = neighbor
+                break
+        else:
+            # Dead end found, re-trace steps
+            dead_ends += 1
+            path.pop()
+            if path:
+                location = path[-1]
+    debug("@@@Edge is not part of the path? What the?")
+    return (Contour(), Contour(), -1)
+
+def find_best_path(paths, ijk):
+    """Returns the path from a list of paths (points, visited, dead_ends) enclosing the largest area around ijk.
+
+    Paths are tested exactly, by filling from ijk inside them; ones that
+    leak do not enclose ijk and are passed over. Paths are tried from the
+    largest inside of their bounding box (the box less its outer ring) down,
+    stopping once none can hold more than the best area found.
+    """
+    best_path = (Contour(), Contour(), -1)
+    best_area = -1
+    candidates = []
+    for path in paths:
+        extrema = as_contour(path[0]).extrema()
+        # Cheap rejection first: ijk must be inside the bounding box
+        if encloses(path[0], ijk, extrema):
+            # The inside of the box, less its outer ring, is the most the path can enclose
+            candidates.append(((extrema[1]-extrema[0]-1)*(extrema[3]-extrema[2]-1), path))
+    candidates.sort(key=lambda candidate: -candidate[0])
+    for bound, path in candidates:
+        if bound <= best_area:
+            break
+        enclosure = path_enclosure(path[0], ijk)
+        if enclosure.leaked:
+            continue
+        if enclosure.area > best_area:
+            best_path = path
+            best_area = enclosure.area
+    return best_path
+
+def encloses(path, ijk, extrema=None):
+    """True if ijk is strictly inside the bounding box of path, so the path likely goes round it."""
+    if extrema is None:
+        extrema = as_contour(path).extrema()
+    return extrema[0] < ijk[0] < extrema[1] and extrema[2] < ijk[1] < extrema[3]
+
+def is_edge(location, masks):
+    """Return true is location is an edge pixel."""
+    try:
+        return bool(fetch_val(masks.edges, location))
+    except IndexError:
+        return False
+
+def fetch_val(array, coordinate):
+    if coordinate[0] < 0 or coordinate[1] < 0:
+        raise IndexError
+    return array[coordinate]
+
+
+class ContourIndex(object):
+    """The contours traced on a slice, with a map of the pixels on each for O(1) lookups.
+
+    ids holds, for each pixel of the slice, 1 + the index in paths of the
+    first contour through it, or 0. saved counts the traces callers skipped
+    because their seed was found on a contour.
+    """
+
+    def __init__(self, shape):
+        self.shape = shape
+        self.ids = None
+        self.paths = []
+        self.saved = 0
+
+    def add(self, path_obj):
+        """Add a (path, visited, dead_ends) trace; pixels on an earlier contour stay with it."""
+        self.paths.append(path_obj)
+        if self.ids is None:
+            self.ids = numpy.zeros(self.shape, dtype=numpy.int16)
+        path = as_contour(path_obj[0])
+        rows = path.rows
+        cols = path.cols
+        free = self.ids[rows, cols] == 0
+        self.ids[rows[free], cols[free]] = len(self.paths)
+
+    def find(self, pixel):
+        """Return the trace whose contour pixel is on, or None."""
+        if self.ids is None:
+            return None
+        row, col = pixel
+        if not (0 <= row < self.shape[0] and 0 <= col < self.shape[1]):
+            return None
+        pathId = self.ids[row, col]
+        return self.paths[pathId - 1] if pathId else None
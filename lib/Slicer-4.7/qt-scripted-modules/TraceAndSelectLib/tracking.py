@@ -0,0 +1,104 @@
+"""Following an outline from one slice to the next instead of seeding every slice in full."""
+
+import numpy
+
+from .masks import SliceMasks
+from .contour import as_contour
+from .tracing import build_path, find_best_path, smooth_path, ContourIndex
+from .instrumentation import debug, noStats
+
+# Pixels an outline may move between neighbouring slices and still be tracked
+TRACKING_BAND = 4
+
+
+def dilate(mask, radius):
+    """Grow the boolean mask by radius pixels in every direction, diagonals included."""
+    grown = mask.copy()
+    for shift in range(1, radius + 1):
+        grown[shift:, :] |= mask[:-shift, :]
+        grown[:-shift, :] |= mask[shift:, :]
+    rows = grown.copy()
+    for shift in range(1, radius + 1):
+        grown[:, shift:] |= rows[:, :-shift]
+        grown[:, :-shift] |= rows[:, shift:]
+    return grown
+
+def box_overlap(a, b):
+    """Intersection over union of two (min_row, max_row, min_col, max_col) boxes, ends included."""
+    rows = min(a[1], b[1]) - max(a[0], b[0]) + 1
+    cols = min(a[3], b[3]) - max(a[2], b[2]) + 1
+    if rows <= 0 or cols <= 0:
+        return 0.0
+    area = lambda box: (box[1] - box[0] + 1) * (box[3] - box[2] + 1)
+    return float(rows * cols) / (area(a) + area(b) - rows * cols)
+
+def track_path(location, previous, hi, lo, bgArray, band=TRACKING_BAND, minOverlap=0.7, maxLengthRatio=1.5,
+               stats=None):
+    """Trace the outline around location close to previous, the Contour traced on the slice before.
+
+    Only edges within band pixels of previous are used, so the work scales
+    with the band instead of the slice: masks are built for the box around
+    the band alone, and the band edges nearest the four extreme pixels of
+    previous are the seeds. The result is trusted if a trace closes around
+    location with at most 150 dead ends, its bounding box overlaps that of
+    previous by at least minOverlap and its length is within a factor of
+    maxLengthRatio of previous. Returns (path, visited, dead_ends), smoothed as
+    gimme_a_path() does, or None if the slice needs seeding in full.
+    """
+    if stats is None:
+        stats = noStats
+    previous = as_contour(previous)
+    if not len(previous):
+        return None
+    height, width = bgArray.shape
+    extrema = previous.extrema()
+    # One pixel more than the band, so edges along its border are exact
+    top = max(extrema[0] - band - 1, 0)
+    bottom = min(extrema[1] + band + 2, height)
+    left = max(extrema[2] - band - 1, 0)
+    right = min(extrema[3] + band + 2, width)
+    with stats.stage('masks'):
+        boxMasks = SliceMasks(bgArray[top:bottom, left:right], hi, lo)
+        near = dilate(previous.mask(boxMasks.edges.shape, (top, left)), band)
+        masks = SliceMasks.fromMasks(hi, lo, boxMasks.inThreshold, boxMasks.edges & near)
+
+    with stats.stage('seeds'):
+        rows, cols = numpy.nonzero(masks.edges)
+        if not len(rows):
+            return None
+        seeds = []
+        for extreme in (previous.rows.argmin(), previous.rows.argmax(),
+                        previous.cols.argmin(), previous.cols.argmax()):
+            row, col = previous.points[extreme]
+            nearest = ((rows - (row - top)) ** 2 + (cols - (col - left)) ** 2).argmin()
+            seeds.append((int(rows[nearest]), int(cols[nearest])))
+
+    contours = ContourIndex(masks.edges.shape)
+    for seed in seeds:
+        if contours.find(seed) is not None:
+            contours.saved += 1
+            continue
+        with stats.stage('trace'):
+            traced = build_path(seed, masks)
+        stats.add('seeds tried')
+        stats.add('pixels visited', len(traced[1]))
+        if not traced[0]:
+            continue
+        stats.add('dead ends', traced[2])
+        contours.add(traced)
+    stats.add('traces saved', contours.saved)
+    paths = [(path.shifted((top, left)), visited.shifted((top, left)), dead_ends)
+             for path, visited, dead_ends in contours.paths]
+
+    with stats.stage('best path'):
+        best_path = find_best_path(paths, location)
+    path, visited, dead_ends = best_path
+    if not path or not 0 <= dead_ends <= 150:
+        debug("@@@Lost track: no outline around", location)
+        return None
+    if not 1.0 / maxLengthRatio <= float(len(path)) / len(previous) <= maxLengthRatio or \
+       box_overlap(path.extrema(), extrema) < minOverlap:
+        debug("@@@Lost track: outline changed too much")
+        return None
+    with stats.stage('smooth'):
+        return smooth_path(best_path, hi, lo, bgArray)
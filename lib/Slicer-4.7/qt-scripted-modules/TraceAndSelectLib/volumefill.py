@@ -0,0 +1,264 @@
+"""Filling a whole structure in 3D from one seed, instead of tracing it slice by slice."""
+
+import numpy
+
+from .history import VolumeEdit
+from .regions import RegionStats
+from .instrumentation import debug, noStats
+
+
+def in_threshold(values, hi, lo):
+    """True where lo <= value <= hi; NaN counts as in threshold, as in SliceMasks."""
+    return ~((values < lo) | (values > hi))
+
+def volume_seeds(backgroundArray, voxel, axis, hi, lo, maxDistance=200):
+    """The voxels a 3D fill around voxel can start from, nearest first.
+
+    voxel itself if it is in threshold, otherwise the first in-threshold
+    voxel within maxDistance in each of the four directions of the slice
+    plane normal to axis, as find_edges() looks for an edge to trace.
+    """
+    if in_threshold(backgroundArray[voxel], hi, lo):
+        return [voxel]
+    found = []
+    for direction in [a for a in range(3) if a != axis]:
+        for step in (-1, 1):
+            start = voxel[direction]
+            stop = min(max(start + step * (maxDistance + 1), -1), backgroundArray.shape[direction])
+            line = list(voxel)
+            line[direction] = slice(start, stop if stop >= 0 else None, step)
+            hits = numpy.flatnonzero(in_threshold(backgroundArray[tuple(line)], hi, lo))
+            if len(hits):
+                seed = list(voxel)
+                seed[direction] = start + step * int(hits[0])
+                found.append((int(hits[0]), tuple(seed)))
+    found.sort()
+    return [seed for distance, seed in found]
+
+def grow_region(backgroundArray, seed, hi, lo, maxVoxels, axis=0, bounds=None):
+    """Return (voxels, capped): the in-threshold voxels 6-connected to seed, as flat indices.
+
+    The region grows breadth first, one layer of neighbours at a time, each
+    layer found with a few array operations on the one before it. Once it
+    would hold more than maxVoxels voxels the last layer is cut short, at
+    maxVoxels voxels, and capped is True. bounds, a (start, stop) range of
+    slices along axis, keeps the region within a slab of the volume.
+    The voxels looked at are marked in a LookedAt box around the region,
+    not in an array the size of the volume.
+    """
+    shape = backgroundArray.shape
+    if bounds is None:
+        bounds = (0, shape[axis])
+    values = backgroundArray.reshape(-1)
+    strides = (shape[1] * shape[2], shape[2], 1)
+    limits = [(0, size) for size in shape]
+    limits[axis] = tuple(bounds)
+    lookedAt = LookedAt(seed, limits)
+    looked = lookedAt.looked
+    frontier = numpy.array([numpy.ravel_multi_index(seed, shape)], dtype=numpy.int64)
+    layers = [frontier]
+    count = 1
+    capped = False
+    while len(frontier):
+        coordinates = numpy.unravel_index(frontier, shape)
+        if lookedAt.fit([int(c.min()) - 1 for c in coordinates], [int(c.max()) + 2 for c in coordinates]):
+            looked = lookedAt.looked
+        local = lookedAt.index(coordinates)
+        neighbours = []
+        for coordinate, (low, high), stride, localStride in zip(coordinates, limits, strides, lookedAt.strides):
+            for step, inside in ((-1, coordinate > low), (1, coordinate < high - 1)):
+                # Each direction yields distinct voxels; marking them as
+                # looked at keeps the other directions from adding them again
+                candidates = local[inside] + step * localStride
+                fresh = ~looked[candidates]
+                looked[candidates[fresh]] = True
+                neighbours.append(frontier[inside][fresh] + step * stride)
+        neighbours = numpy.concatenate(neighbours)
+        frontier = neighbours[in_threshold(values[neighbours], hi, lo)]
+        if count + len(frontier) > maxVoxels:
+            frontier = frontier[:max(maxVoxels - count, 0)]
+            capped = True
+        layers.append(frontier)
+        count += len(frontier)
+        if capped:
+            break
+    return (numpy.concatenate(layers), capped)
+
+
+class LookedAt(object):
+    """The voxels grow_region() has looked at, marked in a box that grows to take in new ones.
+
+    looked is the flat boolean array of the box, whose corner is start and
+    whose flat strides are strides. The box starts around seed and, when it
+    has to take in voxels outside it, at least doubles along each axis it
+    grows on, staying within limits, the (start, stop) range of each axis.
+    Memory follows the size of the region rather than of the volume.
+    """
+
+    # Half the first width of the box along each axis
+    margin = 16
+
+    def __init__(self, seed, limits):
+        self.limits = limits
+        self.start = [max(c - self.margin, low) for c, (low, high) in zip(seed, limits)]
+        self.stop = [min(c + self.margin + 1, high) for c, (low, high) in zip(seed, limits)]
+        self._allocate()
+        self.looked[self.index([numpy.array([c]) for c in seed])] = True
+
+    def _allocate(self):
+        self.shape = [stop - start for start, stop in zip(self.start, self.stop)]
+        self.strides = (self.shape[1] * self.shape[2], self.shape[2], 1)
+        self.looked = numpy.zeros(self.shape[0] * self.strides[0], dtype=bool)
+
+    def index(self, coordinates):
+        """Flat indices into looked of the voxels at coordinates, which must be in the box."""
+        return sum((c - start) * stride for c, start, stride in zip(coordinates, self.start, self.strides))
+
+    def fit(self, lows, highs):
+        """Grow the box to hold lows up to highs along each axis, within limits. Returns True if it grew."""
+        start = [max(min(low, start), limit[0]) for low, start, limit in zip(lows, self.start, self.limits)]
+        stop = [min(max(high, stop), limit[1]) for high, stop, limit in zip(highs, self.stop, self.limits)]
+        if start == self.start and stop == self.stop:
+            return False
+        for a, (low, high) in enumerate(self.limits):
+            size = self.stop[a] - self.start[a]
+            if start[a] < self.start[a]:
+                start[a] = max(min(start[a], self.start[a] - size), low)
+            if stop[a] > self.stop[a]:
+                stop[a] = min(max(stop[a], self.stop[a] + size), high)
+        old = self.looked.reshape(self.shape)
+        corner = [old - new for old, new in zip(self.start, start)]
+        self.start = start
+        self.stop = stop
+        self._allocate()
+        self.looked.reshape(self.shape)[tuple(slice(c, c + size) for c, size in zip(corner, old.shape))] = old
+        return True
+
+
+def fill_holes(region, axis):
+    """Add to the boolean 3D region everything it encloses on each slice normal to axis.
+
+    A pixel is enclosed if it cannot reach the edge of its slice through
+    pixels outside the region, moving in 4 directions, like the inside of a
+    traced outline. The pixels outside the region are split into runs along
+    rows; runs at the edge of a slice are outside, and so is every run that
+    overlaps an outside run on the row above or below it. That is settled
+    for all the slices together, a step of the flood at a time, and the runs
+    left over are the holes. Works in place and returns region.
+    """
+    planes = numpy.rollaxis(region, axis, 0)
+    depth, height, width = planes.shape
+    # The region padded with a column on each side, so every run has a start and an end
+    padded = numpy.ones((depth * height, width + 2), dtype=numpy.int8)
+    padded[:, 1:-1] = planes.reshape(depth * height, width)
+    steps = numpy.diff(padded, axis=1)
+    runRows, runStarts = numpy.nonzero(steps == -1)
+    runEnds = numpy.nonzero(steps == 1)[1]
+    line = runRows % height
+    outside = (runStarts == 0) | (runEnds == width) | (line == 0) | (line == height - 1)
+    # Runs are in row order, and by start within a row
+    keys = runRows * (width + 1) + runStarts
+    candidates = numpy.flatnonzero(~outside)
+    while len(candidates):
+        outsideKeys = keys[outside]
+        outsideRows = runRows[outside]
+        outsideEnds = runEnds[outside]
+        starts = runStarts[candidates]
+        ends = runEnds[candidates]
+        reached = numpy.zeros(len(candidates), dtype=bool)
+        for other in (runRows[candidates] - 1, runRows[candidates] + 1):
+            # The last outside run starting before this one ends reaches
+            # furthest, so it overlaps this run if any run of the row does
+            position = numpy.searchsorted(outsideKeys, other * (width + 1) + ends) - 1
+            found = position >= 0
+            position[~found] = 0
+            reached |= found & (outsideRows[position] == other) & (outsideEnds[position] > starts)
+        if not reached.any():
+            break
+        outside[candidates[reached]] = True
+        candidates = candidates[~reached]
+    if len(candidates):
+        change = numpy.zeros((depth * height, width + 1), dtype=numpy.int8)
+        change[runRows[candidates], runStarts[candidates]] = 1
+        change[runRows[candidates], runEnds[candidates]] = -1
+        holes = numpy.cumsum(change, axis=1, dtype=numpy.int8)[:, :-1].view(bool)
+        planes |= holes.reshape(planes.shape)
+    return region
+
+
+class VolumeFill(object):
+    """What a fill_volume() call did.
+
+    error is None after a fill, or says why the volume was left unchanged.
+    seed is the voxel the region grew from, voxelsSet the number of voxels
+    that changed and count the number of voxels filled; capped is True if
+    the region was cut short at the voxel cap. bounds gives the (start, stop)
+    range of the filled voxels along each axis, and edit is the VolumeEdit.
+    region is the RegionStats of the voxels that changed.
+    """
+
+    def __init__(self, seed=None, voxelsSet=0, count=0, capped=False, bounds=None, edit=None, region=None,
+                 error=None):
+        self.seed = seed
+        self.voxelsSet = voxelsSet
+        self.count = count
+        self.capped = capped
+        self.bounds = bounds
+        self.edit = edit
+        self.region = region if region is not None else RegionStats()
+        self.error = error
+
+
+def fill_volume(backgroundArray, labelArray, voxel, axis, hi, lo, label, maxVoxels, bounds=None,
+                volumeKey=None, stats=None):
+    """Fill the structure around voxel in 3D: its in-threshold voxels and everything they enclose.
+
+    The region is grown from the voxels volume_seeds() finds near voxel,
+    then holes are filled on each slice normal to axis. This is a
+    segmentation of its own rather than a faster propagate(): the region
+    follows 6-connected voxels, not the outline traced on each slice, so
+    where walls are thin or broken it can label more or less than
+    propagating the click would. On solid structures the two mostly agree;
+    the regression test records by how much on the phantoms. A seed whose
+    region does not enclose voxel is passed over for the next one, unless
+    the region was cut short at maxVoxels, in which case what it reached is
+    filled. bounds limits the fill to a (start, stop) range of slices along
+    axis that voxel lies in. Existing labels are painted over. Returns a
+    VolumeFill; its edit is recorded under volumeKey.
+    """
+    if stats is None:
+        stats = noStats
+    if bounds is None:
+        bounds = (0, backgroundArray.shape[axis])
+    with stats.stage('seeds'):
+        seeds = volume_seeds(backgroundArray, voxel, axis, hi, lo)
+    if not seeds:
+        return VolumeFill(error="no voxel within the threshold near the click")
+    for seed in seeds:
+        with stats.stage('grow'):
+            voxels, capped = grow_region(backgroundArray, seed, hi, lo, maxVoxels, axis, bounds)
+        stats.add('voxels grown', len(voxels))
+        coordinates = numpy.unravel_index(voxels, backgroundArray.shape)
+        box = tuple(slice(int(c.min()), int(c.max()) + 1) for c in coordinates)
+        with stats.stage('holes'):
+            region = numpy.zeros([s.stop - s.start for s in box], dtype=bool)
+            region[tuple(c - s.start for c, s in zip(coordinates, box))] = True
+            fill_holes(region, axis)
+        if capped:
+            # Cut short, the region need not go round the click yet
+            break
+        if all(s.start <= v < s.stop for v, s in zip(voxel, box)) and \
+           region[tuple(v - s.start for v, s in zip(voxel, box))]:
+            break
+        debug("@@@Seed", seed, "does not enclose the click")
+    else:
+        return VolumeFill(error="no structure around the click")
+
+    with stats.stage('paint'):
+        labelBox = labelArray[box]
+        before = labelBox.copy()
+        labelBox[region] = label
+        edit = VolumeEdit(volumeKey, box, before, labelBox)
+    stats.add('voxels filled', len(edit))
+    return VolumeFill(seed, len(edit), int(region.sum()), capped, tuple((s.start, s.stop) for s in box), edit,
+                      RegionStats.fromEdit(edit, axis))
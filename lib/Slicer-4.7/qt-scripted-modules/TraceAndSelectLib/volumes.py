@@ -0,0 +1,129 @@
+"""Memory-mapped reading and writing of .npy, NRRD and raw volumes.
+
+Volumes are mapped rather than read, so only the slices that are actually
+traced and filled are paged in. Arrays are indexed [k, j, i], the reverse
+of the IJK order NRRD sizes are given in.
+"""
+
+import os
+
+import numpy
+import numpy.lib.format
+
+NRRD_TYPES = {
+    'int8': 'i1', 'int8_t': 'i1', 'signed char': 'i1',
+    'uint8': 'u1', 'uint8_t': 'u1', 'uchar': 'u1', 'unsigned char': 'u1',
+    'int16': 'i2', 'int16_t': 'i2', 'short': 'i2', 'short int': 'i2', 'signed short': 'i2',
+    'signed short int': 'i2',
+    'uint16': 'u2', 'uint16_t': 'u2', 'ushort': 'u2', 'unsigned short': 'u2', 'unsigned short int': 'u2',
+    'int32': 'i4', 'int32_t': 'i4', 'int': 'i4', 'signed int': 'i4',
+    'uint32': 'u4', 'uint32_t': 'u4', 'uint': 'u4', 'unsigned int': 'u4',
+    'int64': 'i8', 'int64_t': 'i8', 'longlong': 'i8', 'long long': 'i8', 'long long int': 'i8',
+    'signed long long': 'i8', 'signed long long int': 'i8',
+    'uint64': 'u8', 'uint64_t': 'u8', 'ulonglong': 'u8', 'unsigned long long': 'u8',
+    'unsigned long long int': 'u8',
+    'float': 'f4', 'double': 'f8',
+}
+# Name written for each NumPy type
+NRRD_TYPE_NAMES = {'i1': 'int8', 'u1': 'uint8', 'i2': 'int16', 'u2': 'uint16', 'i4': 'int32',
+                   'u4': 'uint32', 'i8': 'int64', 'u8': 'uint64', 'f4': 'float', 'f8': 'double'}
+# Fields describing where the volume is, copied from the input to the label volume
+NRRD_GEOMETRY = ('space', 'space dimension', 'space directions', 'space origin', 'space units',
+                 'kinds', 'centerings', 'spacings', 'axis mins', 'axis maxs')
+
+
+def read_nrrd_header(path):
+    """Return (fields, dataOffset) of the NRRD file at path.
+
+    fields maps lower case field names to their values as text; dataOffset
+    is where the data starts in a file with the data attached.
+    """
+    fields = {}
+    with open(path, 'rb') as nrrd:
+        magic = nrrd.readline().decode('latin-1').strip()
+        if not magic.startswith('NRRD'):
+            raise ValueError("%s is not a NRRD file" % path)
+        while True:
+            line = nrrd.readline()
+            if not line or not line.strip():
+                break
+            line = line.decode('latin-1').rstrip('\r\n')
+            if line.startswith('#') or ':=' in line:
+                continue
+            key, separator, value = line.partition(': ')
+            if separator:
+                fields[key.strip().lower()] = value.strip()
+        return (fields, nrrd.tell())
+
+def open_nrrd(path):
+    """Map the 3D NRRD volume at path read-only. Returns (array, fields)."""
+    fields, offset = read_nrrd_header(path)
+    if fields.get('encoding', 'raw') != 'raw':
+        raise ValueError("%s is %s encoded; only raw NRRD data can be memory mapped" %
+                         (path, fields['encoding']))
+    if int(fields.get('line skip', 0)) != 0:
+        raise ValueError("%s uses line skip, which is not supported" % path)
+    dtype = numpy.dtype(NRRD_TYPES[fields['type'].lower()])
+    if dtype.itemsize > 1:
+        dtype = dtype.newbyteorder('>' if fields.get('endian', 'little') == 'big' else '<')
+    shape = tuple(int(size) for size in fields['sizes'].split())[::-1]
+    dataFile = fields.get('data file', fields.get('datafile'))
+    if dataFile is not None:
+        path = os.path.join(os.path.dirname(path), dataFile)
+        offset = 0
+    byteSkip = int(fields.get('byte skip', 0))
+    if byteSkip < 0:
+        offset = os.path.getsize(path) - dtype.itemsize * int(numpy.prod(shape))
+    else:
+        offset += byteSkip
+    return (numpy.memmap(path, dtype=dtype, mode='r', offset=offset, shape=shape), fields)
+
+def open_volume(path, shape=None, dtype=None, offset=0):
+    """Map the volume at path read-only. Returns (array, fields).
+
+    .npy and .nrrd/.nhdr files describe themselves; anything else is read as
+    raw data, for which shape (in array order, slowest axis first), dtype
+    and the offset of the data in bytes are needed. fields holds the NRRD
+    header fields, and is empty for other formats.
+    """
+    extension = os.path.splitext(path)[1].lower()
+    if extension == '.npy':
+        return (numpy.load(path, mmap_mode='r'), {})
+    if extension in ('.nrrd', '.nhdr'):
+        return open_nrrd(path)
+    if shape is None or dtype is None:
+        raise ValueError("the shape and type of raw volume %s must be given" % path)
+    return (numpy.memmap(path, dtype=numpy.dtype(dtype), mode='r', offset=offset, shape=tuple(shape)), {})
+
+def create_volume(path, shape, dtype, fields={}):
+    """Create a zero filled volume at path and map it for writing.
+
+    The format follows the extension as for open_volume(). A NRRD volume
+    takes its geometry from fields, the header fields of the volume it
+    labels. Pages are only written once something is stored in them.
+    """
+    dtype = numpy.dtype(dtype)
+    extension = os.path.splitext(path)[1].lower()
+    if extension == '.npy':
+        return numpy.lib.format.open_memmap(path, mode='w+', dtype=dtype, shape=tuple(shape))
+    offset = 0
+    if extension in ('.nrrd', '.nhdr'):
+        if extension == '.nhdr':
+            raise ValueError("write the label volume as .nrrd, .npy or raw data")
+        lines = ['NRRD0004',
+                 'type: %s' % NRRD_TYPE_NAMES[dtype.str[1:]],
+                 'dimension: %d' % len(shape),
+                 'sizes: %s' % ' '.join(str(size) for size in reversed(shape)),
+                 'encoding: raw']
+        if dtype.itemsize > 1:
+            lines.append('endian: %s' % ('big' if dtype.str[0] == '>' else 'little'))
+        lines.extend('%s: %s' % (key, fields[key]) for key in NRRD_GEOMETRY if key in fields)
+        header = ('\n'.join(lines) + '\n\n').encode('latin-1')
+        with open(path, 'wb') as nrrd:
+            nrrd.write(header)
+        offset = len(header)
+    else:
+        open(path, 'wb').close()
+    with open(path, 'r+b') as volume:
+        volume.truncate(offset + dtype.itemsize * int(numpy.prod(shape)))
+    return numpy.memmap(path, dtype=dtype, mode='r+', offset=offset, shape=tuple(shape))